@@ -4,7 +4,8 @@ from sqlalchemy import engine_from_config
 from sqlalchemy import pool
 
 from alembic import context
-from sqlalchemy.engine.url import URL
+
+from db import DatabaseSettings
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -28,6 +29,11 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+def database_url():
+    """-x url=... (e.g. one shard of DB_SHARD_URLS), otherwise the database from .env"""
+    return context.get_x_argument(as_dictionary=True).get('url') or DatabaseSettings.from_env().url()
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -40,19 +46,7 @@ def run_migrations_offline() -> None:
     script output.
 
     """
-    from environs import Env
-
-    env = Env()
-    env.read_env('.env')
-
-    url = url = URL.create(
-    drivername="postgresql+psycopg2",
-    username=env.str("POSTGRES_USER"),
-    password=env.str("POSTGRES_PASSWORD"),
-    host=env.str("POSTGRES_HOST"),
-    port=env.str("POSTGRES_PORT"),
-    database=env.str("POSTGRES_DB"),
-)
+    url = database_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
@@ -71,20 +65,8 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
-    from environs import Env
-
-    env = Env()
-    env.read_env('.env')
-
-    url = URL.create(
-        drivername="postgresql+psycopg2",
-        username=env.str("POSTGRES_USER"),
-        password=env.str("POSTGRES_PASSWORD"),
-        host=env.str("POSTGRES_HOST"),
-        port=env.str("POSTGRES_PORT"),
-        database=env.str("POSTGRES_DB"),
-    )
-    
+    url = database_url()
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section, {}),
         prefix="sqlalchemy.",
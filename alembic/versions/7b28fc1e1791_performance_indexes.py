@@ -0,0 +1,49 @@
+"""performance indexes
+
+Revision ID: 7b28fc1e1791
+Revises: fc41a8309e52
+Create Date: 2026-10-18 11:03:27.918442
+
+Indexes are built with CREATE INDEX CONCURRENTLY so the migration can run against a live
+database. CONCURRENTLY cannot run inside a transaction, hence the autocommit blocks.
+If a concurrent build fails it leaves an INVALID index behind: drop it and run the upgrade again.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b28fc1e1791'
+down_revision: Union[str, Sequence[str], None] = 'fc41a8309e52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_referrer_id', 'users', ['referrer_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'},
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_products_price', 'products', ['price'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_orderproducts_product_id', 'orderproducts', ['product_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_orderproducts_product_id', table_name='orderproducts',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_products_price', table_name='products',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_users_username_trgm', table_name='users',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_users_referrer_id', table_name='users',
+                      postgresql_concurrently=True, if_exists=True)
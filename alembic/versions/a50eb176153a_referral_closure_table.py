@@ -0,0 +1,116 @@
+"""referral closure table
+
+Revision ID: a50eb176153a
+Revises: 7b28fc1e1791
+Create Date: 2026-10-18 13:21:07.316904
+
+userreferrals holds one row per (ancestor, descendant) pair of the users.referrer_id tree, so a whole
+downline or the top referrers come from index scans instead of a recursive query. Triggers on users
+keep it in sync:
+    INSERT                   walks the new user's referrer chain and adds its ancestor rows
+    UPDATE OF referrer_id    moves the user's subtree under the new referrer (rejects cycles);
+                             this also covers deletes, which SET NULL the children's referrer_id
+Rows of a deleted user go away through the ON DELETE CASCADE foreign keys.
+Each inserted user costs one extra insert per level of its chain, which also slows down bulk loads.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a50eb176153a'
+down_revision: Union[str, Sequence[str], None] = '7b28fc1e1791'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('userreferrals',
+    sa.Column('ancestor_id', sa.BIGINT(), nullable=False),
+    sa.Column('descendant_id', sa.BIGINT(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['users.telegram_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['users.telegram_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_userreferrals_descendant_id', 'userreferrals', ['descendant_id'], unique=False)
+
+    op.execute("""
+        CREATE FUNCTION userreferrals_after_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Walk users rather than userreferrals: AFTER ROW triggers run once the whole statement
+            -- is done, so a referrer inserted by the same statement (in any order) is visible here
+            INSERT INTO userreferrals (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE chain(ancestor_id, depth, path) AS (
+                SELECT NEW.telegram_id, 0, ARRAY[NEW.telegram_id]
+                UNION ALL
+                SELECT u.referrer_id, chain.depth + 1, chain.path || u.referrer_id
+                FROM chain JOIN users u ON u.telegram_id = chain.ancestor_id
+                WHERE u.referrer_id IS NOT NULL AND NOT u.referrer_id = ANY(chain.path)
+            )
+            SELECT ancestor_id, NEW.telegram_id, depth FROM chain;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION userreferrals_after_update() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.referrer_id IS NOT NULL AND EXISTS (
+                SELECT 1 FROM userreferrals WHERE ancestor_id = NEW.telegram_id AND descendant_id = NEW.referrer_id
+            ) THEN
+                RAISE EXCEPTION 'referral cycle: user % is in the downline of user %',
+                    NEW.referrer_id, NEW.telegram_id;
+            END IF;
+
+            -- Detach the user's subtree from its old ancestors ...
+            DELETE FROM userreferrals r
+            USING userreferrals subtree, userreferrals old_ancestors
+            WHERE subtree.ancestor_id = NEW.telegram_id
+              AND old_ancestors.descendant_id = NEW.telegram_id AND old_ancestors.depth > 0
+              AND r.ancestor_id = old_ancestors.ancestor_id AND r.descendant_id = subtree.descendant_id;
+
+            -- ... and attach it below the new referrer
+            INSERT INTO userreferrals (ancestor_id, descendant_id, depth)
+            SELECT new_ancestors.ancestor_id, subtree.descendant_id, new_ancestors.depth + subtree.depth + 1
+            FROM userreferrals new_ancestors, userreferrals subtree
+            WHERE new_ancestors.descendant_id = NEW.referrer_id AND subtree.ancestor_id = NEW.telegram_id;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER userreferrals_insert AFTER INSERT ON users
+        FOR EACH ROW EXECUTE FUNCTION userreferrals_after_insert()
+    """)
+    op.execute("""
+        CREATE TRIGGER userreferrals_update AFTER UPDATE OF referrer_id ON users
+        FOR EACH ROW WHEN (OLD.referrer_id IS DISTINCT FROM NEW.referrer_id)
+        EXECUTE FUNCTION userreferrals_after_update()
+    """)
+
+    # Backfill the existing tree
+    op.execute("""
+        INSERT INTO userreferrals (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE chain(ancestor_id, descendant_id, depth, path) AS (
+            SELECT telegram_id, telegram_id, 0, ARRAY[telegram_id] FROM users
+            UNION ALL
+            SELECT u.referrer_id, chain.descendant_id, chain.depth + 1, chain.path || u.referrer_id
+            FROM chain JOIN users u ON u.telegram_id = chain.ancestor_id
+            WHERE u.referrer_id IS NOT NULL AND NOT u.referrer_id = ANY(chain.path)
+        )
+        SELECT ancestor_id, descendant_id, depth FROM chain
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS userreferrals_update ON users")
+    op.execute("DROP TRIGGER IF EXISTS userreferrals_insert ON users")
+    op.execute("DROP FUNCTION IF EXISTS userreferrals_after_update()")
+    op.execute("DROP FUNCTION IF EXISTS userreferrals_after_insert()")
+    op.drop_index('ix_userreferrals_descendant_id', table_name='userreferrals')
+    op.drop_table('userreferrals')
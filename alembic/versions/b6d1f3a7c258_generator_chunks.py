@@ -0,0 +1,38 @@
+"""generator chunks
+
+Revision ID: b6d1f3a7c258
+Revises: f2a9c6e8d413
+Create Date: 2026-10-18 21:16:48.207394
+
+_generator_chunks records every chunk data_generator.py has loaded, so a build that failed is
+restarted with only the missing chunks.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d1f3a7c258'
+down_revision: Union[str, Sequence[str], None] = 'f2a9c6e8d413'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('_generator_chunks',
+    sa.Column('table_name', sa.VARCHAR(length=32), nullable=False),
+    sa.Column('chunk', sa.Integer(), nullable=False),
+    sa.Column('seed', sa.Integer(), nullable=False),
+    sa.Column('row_count', sa.BIGINT(), nullable=False),
+    sa.Column('finished_at', postgresql.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('table_name', 'chunk', 'seed')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('_generator_chunks')
@@ -0,0 +1,167 @@
+"""orders monthly partitions
+
+Revision ID: c3d81f5a9e42
+Revises: a50eb176153a
+Create Date: 2026-10-18 15:02:44.518230
+
+orders and orderproducts become range-partitioned tables with one partition per calendar month
+(orders_pYYYYMM / orderproducts_pYYYYMM), orders on created_at and orderproducts on the new
+order_created_at column (a copy of its order's created_at), so an order and its lines always sit
+in partitions of the same month:
+    - reports bounded on orders.created_at only scan the months they need (partition pruning)
+    - retention detaches and drops whole months instead of deleting rows (see partitioning.py)
+Primary keys gain the partition key, (order_id, created_at) and (order_id, product_id,
+order_created_at); the foreign key from orderproducts references (order_id, created_at).
+order_id keeps its sequence. Needs PostgreSQL 12+ (foreign keys to a partitioned table).
+
+Partitions are created by create_order_partitions(from_month, to_month); the migration covers
+the existing data up to 3 months ahead, ensure_order_partitions(months_ahead) has to run
+regularly afterwards (python partitioning.py from cron, or pg_cron), otherwise inserts fail once
+the last partition is full.
+
+The tables are rewritten in one transaction that locks them: run it in a maintenance window.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d81f5a9e42'
+down_revision: Union[str, Sequence[str], None] = 'a50eb176153a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _create_indexes(orders_pk, orderproducts_pk, orderproducts_fk_columns, orders_fk_columns) -> None:
+    op.create_primary_key('orders_pkey', 'orders', orders_pk)
+    op.create_foreign_key('orders_user_id_fkey', 'orders', 'users', ['user_id'], ['telegram_id'], ondelete='CASCADE')
+    op.create_index('ix_orders_created_at_order_id', 'orders', ['created_at', 'order_id'], unique=False)
+    op.create_index('ix_orders_user_id_created_at_order_id', 'orders', ['user_id', 'created_at', 'order_id'],
+                    unique=False)
+    op.create_primary_key('orderproducts_pkey', 'orderproducts', orderproducts_pk)
+    op.create_foreign_key('orderproducts_order_id_fkey', 'orderproducts', 'orders',
+                          orderproducts_fk_columns, orders_fk_columns, ondelete='CASCADE')
+    op.create_foreign_key('orderproducts_product_id_fkey', 'orderproducts', 'products',
+                          ['product_id'], ['product_id'], ondelete='RESTRICT')
+    op.create_index('ix_orderproducts_product_id', 'orderproducts', ['product_id'], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("""
+        CREATE FUNCTION create_order_partitions(from_month date, to_month date) RETURNS integer
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            month_start date := date_trunc('month', from_month);
+            suffix text;
+            created integer := 0;
+        BEGIN
+            WHILE month_start <= to_month LOOP
+                suffix := to_char(month_start, '"p"YYYYMM');
+                IF to_regclass('orders_' || suffix) IS NULL THEN
+                    EXECUTE format('CREATE TABLE %I PARTITION OF orders FOR VALUES FROM (%L) TO (%L)',
+                                   'orders_' || suffix, month_start, month_start + interval '1 month');
+                    created := created + 1;
+                END IF;
+                IF to_regclass('orderproducts_' || suffix) IS NULL THEN
+                    EXECUTE format('CREATE TABLE %I PARTITION OF orderproducts FOR VALUES FROM (%L) TO (%L)',
+                                   'orderproducts_' || suffix, month_start, month_start + interval '1 month');
+                END IF;
+                month_start := month_start + interval '1 month';
+            END LOOP;
+            RETURN created;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION ensure_order_partitions(months_ahead integer DEFAULT 3) RETURNS integer
+        LANGUAGE sql AS $$
+            SELECT create_order_partitions(date_trunc('month', now())::date,
+                                           (date_trunc('month', now()) + make_interval(months => months_ahead))::date)
+        $$
+    """)
+
+    # The sequence would be dropped with the old table
+    op.execute("ALTER SEQUENCE orders_order_id_seq OWNED BY NONE")
+    op.rename_table('orderproducts', 'orderproducts_unpartitioned')
+    op.rename_table('orders', 'orders_unpartitioned')
+    op.execute("""
+        CREATE TABLE orders (
+            order_id integer NOT NULL DEFAULT nextval('orders_order_id_seq'),
+            user_id bigint NOT NULL,
+            created_at timestamp NOT NULL DEFAULT now(),
+            updated_at timestamp NOT NULL DEFAULT now()
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("""
+        CREATE TABLE orderproducts (
+            order_id integer NOT NULL,
+            product_id integer NOT NULL,
+            quantity integer NOT NULL,
+            order_created_at timestamp NOT NULL
+        ) PARTITION BY RANGE (order_created_at)
+    """)
+    op.execute("""
+        SELECT create_order_partitions(
+            COALESCE((SELECT min(created_at) FROM orders_unpartitioned), now())::date,
+            (date_trunc('month', GREATEST((SELECT max(created_at) FROM orders_unpartitioned), now()))
+             + interval '3 months')::date
+        )
+    """)
+    op.execute("""
+        INSERT INTO orders (order_id, user_id, created_at, updated_at)
+        SELECT order_id, user_id, created_at, updated_at FROM orders_unpartitioned
+    """)
+    op.execute("""
+        INSERT INTO orderproducts (order_id, product_id, quantity, order_created_at)
+        SELECT l.order_id, l.product_id, l.quantity, o.created_at
+        FROM orderproducts_unpartitioned l JOIN orders_unpartitioned o ON o.order_id = l.order_id
+    """)
+    op.drop_table('orderproducts_unpartitioned')
+    op.drop_table('orders_unpartitioned')
+    op.execute("ALTER SEQUENCE orders_order_id_seq OWNED BY orders.order_id")
+
+    # Created on the parents, so every partition (existing and future) gets them
+    _create_indexes(['order_id', 'created_at'], ['order_id', 'product_id', 'order_created_at'],
+                    ['order_id', 'order_created_at'], ['order_id', 'created_at'])
+    op.execute("ANALYZE orders")
+    op.execute("ANALYZE orderproducts")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER SEQUENCE orders_order_id_seq OWNED BY NONE")
+    op.rename_table('orderproducts', 'orderproducts_partitioned')
+    op.rename_table('orders', 'orders_partitioned')
+    op.execute("""
+        CREATE TABLE orders (
+            order_id integer NOT NULL DEFAULT nextval('orders_order_id_seq'),
+            user_id bigint NOT NULL,
+            created_at timestamp NOT NULL DEFAULT now(),
+            updated_at timestamp NOT NULL DEFAULT now()
+        )
+    """)
+    op.execute("""
+        CREATE TABLE orderproducts (
+            order_id integer NOT NULL,
+            product_id integer NOT NULL,
+            quantity integer NOT NULL
+        )
+    """)
+    op.execute("""
+        INSERT INTO orders (order_id, user_id, created_at, updated_at)
+        SELECT order_id, user_id, created_at, updated_at FROM orders_partitioned
+    """)
+    op.execute("""
+        INSERT INTO orderproducts (order_id, product_id, quantity)
+        SELECT order_id, product_id, quantity FROM orderproducts_partitioned
+    """)
+    # Dropping the parents drops every partition with them
+    op.drop_table('orderproducts_partitioned')
+    op.drop_table('orders_partitioned')
+    op.execute("ALTER SEQUENCE orders_order_id_seq OWNED BY orders.order_id")
+    _create_indexes(['order_id'], ['order_id', 'product_id'], ['order_id'], ['order_id'])
+    op.execute("DROP FUNCTION IF EXISTS ensure_order_partitions(integer)")
+    op.execute("DROP FUNCTION IF EXISTS create_order_partitions(date, date)")
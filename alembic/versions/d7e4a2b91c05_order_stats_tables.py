@@ -0,0 +1,339 @@
+"""order stats tables
+
+Revision ID: d7e4a2b91c05
+Revises: c3d81f5a9e42
+Create Date: 2026-10-18 16:40:12.803517
+
+Summary tables for the analytics Repo methods (use_summaries=True), kept up to date on every write:
+    userorderstats      per user: orders, orders with lines, lines, spend
+    productorderstats   per product (and slot): quantity, lines
+    monthlyorderstats   per month of the order (and slot): lines, revenue
+Statement-level triggers with transition tables apply each statement's changes in a few grouped
+upserts, so bulk loads (COPY included) pay once per statement rather than once per row:
+    orderproducts INSERT / UPDATE / DELETE   quantities, lines, revenue and spend
+    orders INSERT / UPDATE                   order counts, and orders moving to another user
+    orders BEFORE DELETE (row)               the order and its lines come off its user's totals
+                                             before ON DELETE CASCADE removes the lines
+    products UPDATE                          revenue and spend of every line at the new price
+    TRUNCATE of any of the four tables       full recompute (refresh_order_stats())
+Revenue and spend use the current product price, as the live queries do.
+Dropping partitions fires no triggers, partitioning.drop_order_partitions calls
+order_stats_forget() for the dropped months.
+
+Hot rows take their slot from pg_backend_pid() % 8, so concurrent writers rarely share a row lock.
+Needs PostgreSQL 13+ (BEFORE ROW triggers on partitioned tables).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e4a2b91c05'
+down_revision: Union[str, Sequence[str], None] = 'c3d81f5a9e42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SLOT = "pg_backend_pid() % 8"
+
+# Signed order line changes of one statement
+LINE_DELTAS = {
+    'insert': "SELECT order_id, order_created_at, product_id, quantity, 1 AS lines FROM new_lines",
+    'update': "SELECT order_id, order_created_at, product_id, quantity, 1 AS lines FROM new_lines "
+              "UNION ALL SELECT order_id, order_created_at, product_id, -quantity, -1 FROM old_lines",
+    'delete': "SELECT order_id, order_created_at, product_id, -quantity AS quantity, -1 AS lines FROM old_lines",
+}
+TRANSITION_TABLES = {
+    'insert': "NEW TABLE AS new_lines",
+    'update': "OLD TABLE AS old_lines NEW TABLE AS new_lines",
+    'delete': "OLD TABLE AS old_lines",
+}
+TRUNCATED_TABLES = ('users', 'products', 'orders', 'orderproducts')
+
+
+def _lines_function(event: str, delta: str) -> str:
+    return f"""
+        CREATE FUNCTION order_stats_lines_{event}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            WITH delta AS ({delta})
+            INSERT INTO productorderstats AS s (product_id, slot, total_quantity, line_count)
+            SELECT product_id, {SLOT}, sum(quantity), sum(lines) FROM delta GROUP BY product_id
+            ON CONFLICT (product_id, slot) DO UPDATE
+            SET total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+                line_count = s.line_count + EXCLUDED.line_count;
+
+            WITH delta AS ({delta})
+            INSERT INTO monthlyorderstats AS s (month, slot, line_count, revenue)
+            SELECT date_trunc('month', d.order_created_at), {SLOT}, sum(d.lines), sum(d.quantity * p.price)
+            FROM delta d JOIN products p ON p.product_id = d.product_id
+            GROUP BY 1
+            ON CONFLICT (month, slot) DO UPDATE
+            SET line_count = s.line_count + EXCLUDED.line_count, revenue = s.revenue + EXCLUDED.revenue;
+
+            -- Lines whose order is gone were removed by ON DELETE CASCADE, and the orders' BEFORE DELETE
+            -- trigger already took them off the user's totals
+            WITH delta AS ({delta}),
+            per_order AS (
+                SELECT o.user_id, d.order_id, d.order_created_at,
+                       sum(d.lines) AS lines, sum(d.quantity * p.price) AS spent
+                FROM delta d
+                JOIN orders o ON o.order_id = d.order_id AND o.created_at = d.order_created_at
+                JOIN products p ON p.product_id = d.product_id
+                GROUP BY o.user_id, d.order_id, d.order_created_at
+            ),
+            counted AS (
+                SELECT per_order.*, (SELECT count(*) FROM orderproducts l
+                                     WHERE l.order_id = per_order.order_id
+                                       AND l.order_created_at = per_order.order_created_at) AS lines_now
+                FROM per_order
+            )
+            INSERT INTO userorderstats AS s (user_id, order_count, orders_with_lines, line_count, total_spent)
+            SELECT user_id, 0, sum((lines_now > 0)::int - (lines_now - lines > 0)::int), sum(lines), sum(spent)
+            FROM counted GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET orders_with_lines = s.orders_with_lines + EXCLUDED.orders_with_lines,
+                line_count = s.line_count + EXCLUDED.line_count,
+                total_spent = s.total_spent + EXCLUDED.total_spent;
+            RETURN NULL;
+        END
+        $$
+    """
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('userorderstats',
+    sa.Column('user_id', sa.BIGINT(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('orders_with_lines', sa.Integer(), nullable=False),
+    sa.Column('line_count', sa.BIGINT(), nullable=False),
+    sa.Column('total_spent', sa.Numeric(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.telegram_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('productorderstats',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('total_quantity', sa.BIGINT(), nullable=False),
+    sa.Column('line_count', sa.BIGINT(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.product_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'slot')
+    )
+    op.create_table('monthlyorderstats',
+    sa.Column('month', sa.TIMESTAMP(), nullable=False),
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('line_count', sa.BIGINT(), nullable=False),
+    sa.Column('revenue', sa.Numeric(), nullable=False),
+    sa.PrimaryKeyConstraint('month', 'slot')
+    )
+
+    for event, delta in LINE_DELTAS.items():
+        op.execute(_lines_function(event, delta))
+        op.execute(f"""
+            CREATE TRIGGER order_stats_lines_{event} AFTER {event.upper()} ON orderproducts
+            REFERENCING {TRANSITION_TABLES[event]}
+            FOR EACH STATEMENT EXECUTE FUNCTION order_stats_lines_{event}()
+        """)
+
+    op.execute("""
+        CREATE FUNCTION order_stats_orders_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO userorderstats AS s (user_id, order_count, orders_with_lines, line_count, total_spent)
+            SELECT user_id, count(*), 0, 0, 0 FROM new_orders GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET order_count = s.order_count + EXCLUDED.order_count;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION order_stats_orders_update() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Orders that changed owner (transfer_order_ownership) take their lines along
+            WITH moved AS (
+                SELECT o.user_id AS from_user, n.user_id AS to_user,
+                       count(l.order_id) AS lines, coalesce(sum(l.quantity * p.price), 0) AS spent
+                FROM old_orders o
+                JOIN new_orders n ON n.order_id = o.order_id AND n.created_at = o.created_at
+                LEFT JOIN orderproducts l ON l.order_id = n.order_id AND l.order_created_at = n.created_at
+                LEFT JOIN products p ON p.product_id = l.product_id
+                WHERE n.user_id <> o.user_id
+                GROUP BY o.user_id, n.user_id, n.order_id, n.created_at
+            ),
+            changes AS (
+                SELECT to_user AS user_id, 1 AS sign, lines, spent FROM moved
+                UNION ALL
+                SELECT from_user, -1, lines, spent FROM moved
+            )
+            INSERT INTO userorderstats AS s (user_id, order_count, orders_with_lines, line_count, total_spent)
+            SELECT user_id, sum(sign), sum(sign * (lines > 0)::int), sum(sign * lines), sum(sign * spent)
+            FROM changes GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET order_count = s.order_count + EXCLUDED.order_count,
+                orders_with_lines = s.orders_with_lines + EXCLUDED.orders_with_lines,
+                line_count = s.line_count + EXCLUDED.line_count,
+                total_spent = s.total_spent + EXCLUDED.total_spent;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION order_stats_orders_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE userorderstats s
+            SET order_count = s.order_count - 1,
+                orders_with_lines = s.orders_with_lines - (lines.line_count > 0)::int,
+                line_count = s.line_count - lines.line_count,
+                total_spent = s.total_spent - lines.spent
+            FROM (SELECT count(*) AS line_count, coalesce(sum(l.quantity * p.price), 0) AS spent
+                  FROM orderproducts l JOIN products p ON p.product_id = l.product_id
+                  WHERE l.order_id = OLD.order_id AND l.order_created_at = OLD.created_at) lines
+            WHERE s.user_id = OLD.user_id;
+            RETURN OLD;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER order_stats_orders_insert AFTER INSERT ON orders
+        REFERENCING NEW TABLE AS new_orders
+        FOR EACH STATEMENT EXECUTE FUNCTION order_stats_orders_insert()
+    """)
+    op.execute("""
+        CREATE TRIGGER order_stats_orders_update AFTER UPDATE ON orders
+        REFERENCING OLD TABLE AS old_orders NEW TABLE AS new_orders
+        FOR EACH STATEMENT EXECUTE FUNCTION order_stats_orders_update()
+    """)
+    op.execute("""
+        CREATE TRIGGER order_stats_orders_delete BEFORE DELETE ON orders
+        FOR EACH ROW EXECUTE FUNCTION order_stats_orders_delete()
+    """)
+
+    op.execute(f"""
+        CREATE FUNCTION order_stats_products_update() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            WITH repriced AS (
+                SELECT n.product_id, n.price - o.price AS change
+                FROM old_products o JOIN new_products n ON n.product_id = o.product_id
+                WHERE n.price <> o.price
+            )
+            INSERT INTO monthlyorderstats AS s (month, slot, line_count, revenue)
+            SELECT date_trunc('month', l.order_created_at), {SLOT}, 0, sum(l.quantity * r.change)
+            FROM repriced r JOIN orderproducts l ON l.product_id = r.product_id
+            GROUP BY 1
+            ON CONFLICT (month, slot) DO UPDATE SET revenue = s.revenue + EXCLUDED.revenue;
+
+            WITH repriced AS (
+                SELECT n.product_id, n.price - o.price AS change
+                FROM old_products o JOIN new_products n ON n.product_id = o.product_id
+                WHERE n.price <> o.price
+            )
+            UPDATE userorderstats s SET total_spent = s.total_spent + changes.spent
+            FROM (SELECT o.user_id, sum(l.quantity * r.change) AS spent
+                  FROM repriced r
+                  JOIN orderproducts l ON l.product_id = r.product_id
+                  JOIN orders o ON o.order_id = l.order_id AND o.created_at = l.order_created_at
+                  GROUP BY o.user_id) changes
+            WHERE s.user_id = changes.user_id;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE TRIGGER order_stats_products_update AFTER UPDATE ON products
+        REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+        FOR EACH STATEMENT EXECUTE FUNCTION order_stats_products_update()
+    """)
+
+    op.execute("""
+        CREATE FUNCTION refresh_order_stats() RETURNS void LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM userorderstats;
+            DELETE FROM productorderstats;
+            DELETE FROM monthlyorderstats;
+            INSERT INTO userorderstats (user_id, order_count, orders_with_lines, line_count, total_spent)
+            SELECT user_id, count(*), count(*) FILTER (WHERE lines > 0), sum(lines), sum(spent)
+            FROM (SELECT o.user_id, count(l.order_id) AS lines, coalesce(sum(l.quantity * p.price), 0) AS spent
+                  FROM orders o
+                  LEFT JOIN orderproducts l ON l.order_id = o.order_id AND l.order_created_at = o.created_at
+                  LEFT JOIN products p ON p.product_id = l.product_id
+                  GROUP BY o.user_id, o.order_id, o.created_at) per_order
+            GROUP BY user_id;
+            INSERT INTO productorderstats (product_id, slot, total_quantity, line_count)
+            SELECT product_id, 0, sum(quantity), count(*) FROM orderproducts GROUP BY product_id;
+            INSERT INTO monthlyorderstats (month, slot, line_count, revenue)
+            SELECT date_trunc('month', l.order_created_at), 0, count(*), sum(l.quantity * p.price)
+            FROM orderproducts l JOIN products p ON p.product_id = l.product_id
+            GROUP BY 1;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION order_stats_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM refresh_order_stats();
+            RETURN NULL;
+        END
+        $$
+    """)
+    for table in TRUNCATED_TABLES:
+        op.execute(f"""
+            CREATE TRIGGER order_stats_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION order_stats_truncate()
+        """)
+
+    op.execute(f"""
+        CREATE FUNCTION order_stats_forget(from_ts timestamp, to_ts timestamp) RETURNS void
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            -- The effect of deleting the orders (and lines) created in [from_ts, to_ts), for partitions
+            -- that are dropped instead
+            INSERT INTO productorderstats AS s (product_id, slot, total_quantity, line_count)
+            SELECT product_id, {SLOT}, -sum(quantity), -count(*) FROM orderproducts
+            WHERE order_created_at >= from_ts AND order_created_at < to_ts
+            GROUP BY product_id
+            ON CONFLICT (product_id, slot) DO UPDATE
+            SET total_quantity = s.total_quantity + EXCLUDED.total_quantity,
+                line_count = s.line_count + EXCLUDED.line_count;
+
+            DELETE FROM monthlyorderstats WHERE month >= date_trunc('month', from_ts) AND month < to_ts;
+
+            UPDATE userorderstats s
+            SET order_count = s.order_count - gone.orders,
+                orders_with_lines = s.orders_with_lines - gone.orders_with_lines,
+                line_count = s.line_count - gone.lines,
+                total_spent = s.total_spent - gone.spent
+            FROM (SELECT user_id, count(*) AS orders, count(*) FILTER (WHERE lines > 0) AS orders_with_lines,
+                         sum(lines) AS lines, sum(spent) AS spent
+                  FROM (SELECT o.user_id, count(l.order_id) AS lines,
+                               coalesce(sum(l.quantity * p.price), 0) AS spent
+                        FROM orders o
+                        LEFT JOIN orderproducts l ON l.order_id = o.order_id AND l.order_created_at = o.created_at
+                        LEFT JOIN products p ON p.product_id = l.product_id
+                        WHERE o.created_at >= from_ts AND o.created_at < to_ts
+                        GROUP BY o.user_id, o.order_id, o.created_at) per_order
+                  GROUP BY user_id) gone
+            WHERE s.user_id = gone.user_id;
+        END
+        $$
+    """)
+
+    op.execute("SELECT refresh_order_stats()")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TRUNCATED_TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS order_stats_truncate ON {table}")
+    op.execute("DROP TRIGGER IF EXISTS order_stats_products_update ON products")
+    for trigger in ('insert', 'update', 'delete'):
+        op.execute(f"DROP TRIGGER IF EXISTS order_stats_orders_{trigger} ON orders")
+        op.execute(f"DROP TRIGGER IF EXISTS order_stats_lines_{trigger} ON orderproducts")
+        op.execute(f"DROP FUNCTION IF EXISTS order_stats_orders_{trigger}()")
+        op.execute(f"DROP FUNCTION IF EXISTS order_stats_lines_{trigger}()")
+    op.execute("DROP FUNCTION IF EXISTS order_stats_products_update()")
+    op.execute("DROP FUNCTION IF EXISTS order_stats_truncate()")
+    op.execute("DROP FUNCTION IF EXISTS order_stats_forget(timestamp, timestamp)")
+    op.execute("DROP FUNCTION IF EXISTS refresh_order_stats()")
+    op.drop_table('monthlyorderstats')
+    op.drop_table('productorderstats')
+    op.drop_table('userorderstats')
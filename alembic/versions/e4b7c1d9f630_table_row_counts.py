@@ -0,0 +1,123 @@
+"""table row counts
+
+Revision ID: e4b7c1d9f630
+Revises: d7e4a2b91c05
+Create Date: 2026-10-18 18:05:31.129406
+
+tablerowcounts holds exact row counts of users, orders, products and orderproducts, so
+Repo.get_database_statistics(mode='exact') and get_total_users_count(mode='exact') read a few
+rows instead of scanning the tables. Statement-level triggers with transition tables add the
+number of inserted / deleted rows of each statement (COPY and ON DELETE CASCADE included), TRUNCATE
+resets the table's count. Rows written directly into a partition instead of its parent table are
+not counted.
+Like the order summaries, every backend adds to its own slot (pg_backend_pid() % 8) so concurrent
+inserts don't queue on one row lock; a table's count is the sum over its slots.
+Dropping a partition fires no triggers, partitioning.drop_order_partitions calls
+table_row_counts_forget() for the dropped partitions.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7c1d9f630'
+down_revision: Union[str, Sequence[str], None] = 'd7e4a2b91c05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COUNTED_TABLES = ('users', 'orders', 'products', 'orderproducts')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tablerowcounts',
+    sa.Column('table_name', sa.VARCHAR(length=63), nullable=False),
+    sa.Column('slot', sa.SmallInteger(), nullable=False),
+    sa.Column('row_count', sa.BIGINT(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name', 'slot')
+    )
+
+    op.execute("""
+        CREATE FUNCTION table_row_counts_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO tablerowcounts AS c (table_name, slot, row_count)
+            SELECT TG_TABLE_NAME, pg_backend_pid() % 8, count(*) FROM new_rows HAVING count(*) > 0
+            ON CONFLICT (table_name, slot) DO UPDATE SET row_count = c.row_count + EXCLUDED.row_count;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION table_row_counts_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO tablerowcounts AS c (table_name, slot, row_count)
+            SELECT TG_TABLE_NAME, pg_backend_pid() % 8, -count(*) FROM old_rows HAVING count(*) > 0
+            ON CONFLICT (table_name, slot) DO UPDATE SET row_count = c.row_count + EXCLUDED.row_count;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION table_row_counts_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM tablerowcounts WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END
+        $$
+    """)
+    op.execute("""
+        CREATE FUNCTION table_row_counts_forget(parent_table text, relation regclass) RETURNS bigint
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            removed bigint;
+        BEGIN
+            -- For a partition of parent_table that is about to be dropped
+            EXECUTE format('SELECT count(*) FROM %s', relation) INTO removed;
+            INSERT INTO tablerowcounts AS c (table_name, slot, row_count) VALUES (parent_table, 0, -removed)
+            ON CONFLICT (table_name, slot) DO UPDATE SET row_count = c.row_count + EXCLUDED.row_count;
+            RETURN removed;
+        END
+        $$
+    """)
+    op.execute(f"""
+        CREATE FUNCTION refresh_table_row_counts() RETURNS void LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM tablerowcounts;
+            INSERT INTO tablerowcounts (table_name, slot, row_count)
+            {' UNION ALL '.join(f"SELECT '{table}', 0, count(*) FROM {table}" for table in COUNTED_TABLES)};
+        END
+        $$
+    """)
+
+    for table in COUNTED_TABLES:
+        op.execute(f"""
+            CREATE TRIGGER table_row_counts_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION table_row_counts_insert()
+        """)
+        op.execute(f"""
+            CREATE TRIGGER table_row_counts_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION table_row_counts_delete()
+        """)
+        op.execute(f"""
+            CREATE TRIGGER table_row_counts_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION table_row_counts_truncate()
+        """)
+
+    # The triggers hold off writers until commit, so the counts start exact
+    op.execute("SELECT refresh_table_row_counts()")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in COUNTED_TABLES:
+        for event in ('insert', 'delete', 'truncate'):
+            op.execute(f"DROP TRIGGER IF EXISTS table_row_counts_{event} ON {table}")
+    for event in ('insert', 'delete', 'truncate'):
+        op.execute(f"DROP FUNCTION IF EXISTS table_row_counts_{event}()")
+    op.execute("DROP FUNCTION IF EXISTS table_row_counts_forget(text, regclass)")
+    op.execute("DROP FUNCTION IF EXISTS refresh_table_row_counts()")
+    op.drop_table('tablerowcounts')
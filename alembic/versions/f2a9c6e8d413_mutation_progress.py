@@ -0,0 +1,38 @@
+"""mutation progress
+
+Revision ID: f2a9c6e8d413
+Revises: e4b7c1d9f630
+Create Date: 2026-10-18 19:42:07.513820
+
+_mutation_progress holds the checkpoint of every running batched UPDATE / DELETE job (see
+batched_mutations.py): the last key done, with the batch and row counts so far.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a9c6e8d413'
+down_revision: Union[str, Sequence[str], None] = 'e4b7c1d9f630'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('_mutation_progress',
+    sa.Column('job', sa.VARCHAR(length=255), nullable=False),
+    sa.Column('last_key', sa.Text(), nullable=False),
+    sa.Column('batches', sa.Integer(), nullable=False),
+    sa.Column('row_count', sa.BIGINT(), nullable=False),
+    sa.Column('updated_at', postgresql.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('job')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('_mutation_progress')
@@ -0,0 +1,32 @@
+"""keyset pagination indexes
+
+Revision ID: fc41a8309e52
+Revises: 1407e1833e97
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'fc41a8309e52'
+down_revision: Union[str, Sequence[str], None] = '1407e1833e97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_users_created_at_telegram_id', 'users', ['created_at', 'telegram_id'], unique=False)
+    op.create_index('ix_orders_created_at_order_id', 'orders', ['created_at', 'order_id'], unique=False)
+    op.create_index('ix_orders_user_id_created_at_order_id', 'orders', ['user_id', 'created_at', 'order_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_user_id_created_at_order_id', table_name='orders')
+    op.drop_index('ix_orders_created_at_order_id', table_name='orders')
+    op.drop_index('ix_users_created_at_telegram_id', table_name='users')
@@ -0,0 +1,222 @@
+"""
+Export of Repo queries as Apache Arrow record batches and Parquet files (pyarrow, optional dependency).
+
+Rows are fetched through a server-side cursor `batch_size` at a time and every batch is turned
+into one RecordBatch column by column, so no Row objects or dicts are kept and memory stays
+bounded by a batch (plus the buffers of the open Parquet files), whatever the size of the result. write_parquet appends every batch to the
+Parquet files of a directory as it arrives, optionally hive-partitioned on some of the selected
+columns (e.g. partition_by=['month'] -> month=2026-01-01 00:00:00/part-0.parquet), which
+pyarrow.dataset, pandas, Spark or DuckDB read back as one dataset.
+
+Column types come from the statement, not from the values:
+    DECIMAL(p, s) / NUMERIC(p, s)   decimal128(p, s), exact (products.price is decimal128(16, 4))
+    NUMERIC without a scale         decimal128(38, 10), values rounded to 10 places if needed
+    TIMESTAMP                       timestamp[us] (timestamp[us, tz=UTC] WITH TIME ZONE)
+    INTEGER / BIGINT / SMALLINT     int32 / int64 / int16
+    VARCHAR / TEXT                  string
+Expressions without a SQL type (func.date_trunc(...), avg(...)) take the type pyarrow infers from
+the first batch, decimals again as decimal128(38, 10).
+
+    repo.export_parquet('monthly_order_summary', 'exports/monthly', partition_by=['month'])
+    for batch in repo.stream_record_batches('order_details'): ...
+    ArrowExporter(session).to_table(select(User))   # any select
+"""
+import os
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from urllib.parse import quote
+from typing import Iterator, NamedTuple, Optional, Sequence
+
+from sqlalchemy import types as sqltypes
+
+DEFAULT_DECIMAL = (38, 10)  # precision, scale of NUMERIC columns without a declared scale
+
+
+class ExportStats(NamedTuple):
+    rows: int
+    batches: int
+    files: list  # paths of the Parquet files written
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _pyarrow():
+    # pyarrow is only needed for exports, keep it out of the import path of Repo
+    try:
+        import pyarrow
+    except ImportError as exc:
+        raise ImportError("Arrow / Parquet export needs pyarrow: pip install pyarrow") from exc
+    return pyarrow
+
+
+def arrow_type(sql_type) -> Optional[object]:
+    """Arrow type of a SQLAlchemy column type, None when it has to be inferred from the values"""
+    pa = _pyarrow()
+    if isinstance(sql_type, sqltypes.Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, sqltypes.SmallInteger):
+        return pa.int16()
+    if isinstance(sql_type, sqltypes.BigInteger):
+        return pa.int64()
+    if isinstance(sql_type, sqltypes.Integer):
+        return pa.int32()
+    if isinstance(sql_type, sqltypes.Float) or (isinstance(sql_type, sqltypes.Numeric) and not sql_type.asdecimal):
+        return pa.float64()
+    if isinstance(sql_type, sqltypes.Numeric):
+        if sql_type.scale is None:
+            return pa.decimal128(*DEFAULT_DECIMAL)
+        return pa.decimal128(sql_type.precision or DEFAULT_DECIMAL[0], sql_type.scale)
+    if isinstance(sql_type, sqltypes.DateTime):
+        return pa.timestamp('us', tz='UTC' if sql_type.timezone else None)
+    if isinstance(sql_type, sqltypes.Date):
+        return pa.date32()
+    if isinstance(sql_type, sqltypes.String):
+        return pa.string()
+    return None
+
+
+def _pyarrow_parquet():
+    _pyarrow()
+    import pyarrow.parquet
+    return pyarrow.parquet
+
+
+def _partition_value(value) -> str:
+    # Readers (pyarrow.dataset, Spark, DuckDB) URI-decode hive partition values
+    return '__HIVE_DEFAULT_PARTITION__' if value is None else quote(str(value), safe=' -:._')
+
+
+def _split(batch, partition_by: Sequence[str]) -> Iterator:
+    """(partition directory, Table of the batch's rows without the partition columns) per partition"""
+    pa = _pyarrow()
+    table = pa.Table.from_batches([batch])
+    if not partition_by:
+        yield '', table
+        return
+    import pyarrow.compute as pc
+
+    data = table.drop_columns(list(partition_by))
+    for key in table.select(list(partition_by)).group_by(list(partition_by)).aggregate([]).to_pylist():
+        mask = None
+        for column, value in key.items():
+            condition = pc.is_null(table[column]) if value is None else pc.equal(table[column], value)
+            mask = condition if mask is None else pc.and_(mask, condition)
+        yield os.path.join(*(f"{column}={_partition_value(value)}" for column, value in key.items())), data.filter(mask)
+
+
+def _to_array(values: list, type_):
+    pa = _pyarrow()
+    try:
+        return pa.array(values, type=type_)
+    except pa.ArrowInvalid:
+        if type_ is None or not pa.types.is_decimal(type_):
+            raise
+        # More decimal places than the column's scale (e.g. avg()): round instead of failing
+        exponent = Decimal(1).scaleb(-type_.scale)
+        return pa.array([value if value is None else value.quantize(exponent) for value in values], type=type_)
+
+
+def _pinned_type(inferred):
+    pa = _pyarrow()
+    if pa.types.is_decimal(inferred):
+        return pa.decimal128(*DEFAULT_DECIMAL)
+    if pa.types.is_null(inferred):
+        return pa.string()  # only NULLs in the first batch, as in schema()
+    return inferred
+
+
+class ArrowExporter:
+    """Stream the result of a select through a Session into Arrow record batches / Parquet"""
+
+    def __init__(self, session, batch_size: int = 50_000):
+        self.session = session
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _columns_stmt(stmt):
+        # select(User) would yield User objects: select the entity's columns instead, same FROM / WHERE
+        return stmt.with_only_columns(*stmt.selected_columns)
+
+    def record_batches(self, stmt) -> Iterator:
+        """RecordBatches of at most batch_size rows; the schema is fixed by the first batch"""
+        pa = _pyarrow()
+        stmt = self._columns_stmt(stmt)
+        names = [column.name for column in stmt.selected_columns]
+        types = [arrow_type(column.type) for column in stmt.selected_columns]
+        schema = None
+        # yield_per opens a server-side cursor (stream_results) and buffers batch_size rows at a time
+        result = self.session.execute(stmt, execution_options={'yield_per': self.batch_size})
+        try:
+            for rows in result.partitions():
+                columns = [list(values) for values in zip(*rows)]
+                arrays = [_to_array(values, type_) for values, type_ in zip(columns, types)]
+                if schema is None:
+                    # Pin inferred types, so a later batch of NULLs doesn't become a null column. Rebuild
+                    # rather than cast: a cast fails on decimals with more places than the pinned scale
+                    types = [type_ or _pinned_type(array.type) for array, type_ in zip(arrays, types)]
+                    arrays = [array if array.type == type_ else _to_array(values, type_)
+                              for array, values, type_ in zip(arrays, columns, types)]
+                    schema = pa.schema(list(zip(names, types)))
+                yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+        finally:
+            result.close()
+
+    def schema(self, stmt):
+        """Arrow schema of stmt's columns, string for the ones whose type is only known from the values"""
+        pa = _pyarrow()
+        columns = self._columns_stmt(stmt).selected_columns
+        return pa.schema([(column.name, arrow_type(column.type) or pa.string()) for column in columns])
+
+    def to_table(self, stmt):
+        """The whole result as one pyarrow.Table (in memory, columnar)"""
+        pa = _pyarrow()
+        batches = list(self.record_batches(stmt))
+        return pa.Table.from_batches(batches) if batches else self.schema(stmt).empty_table()
+
+    def write_parquet(self, stmt, path: str, partition_by: Sequence[str] = (), compression: str = 'zstd',
+                      max_rows_per_file: int = 0, max_open_files: int = 64) -> ExportStats:
+        """
+        Stream the result into Parquet files under the directory `path`, one batch in memory at a time.
+
+        Every batch becomes a row group of part-N.parquet in its partition directory (hive style,
+        the partition columns are stored in the directory names only); a file is closed once it
+        holds max_rows_per_file rows or more. At most max_open_files files are open at once: with
+        more partitions the least recently written one is closed and its next rows start a new
+        part file, so memory stays bounded by a batch plus max_open_files writer buffers.
+        An empty result writes no files.
+        """
+        pq = _pyarrow_parquet()
+        started = time.perf_counter()
+        rows = batches = 0
+        files = []
+        writers = OrderedDict()  # partition directory -> open ParquetWriter, least recently written first
+        parts = {}  # partition directory -> (rows in its open file, number of its next / open file)
+        try:
+            for batch in self.record_batches(stmt):
+                rows += batch.num_rows
+                batches += 1
+                for directory, part in _split(batch, partition_by):
+                    written, number = parts.get(directory, (0, 0))
+                    writer = writers.pop(directory, None)
+                    if writer is not None and max_rows_per_file and written >= max_rows_per_file:
+                        writer.close()
+                        writer, written, number = None, 0, number + 1
+                    if writer is None:
+                        if len(writers) >= max(1, max_open_files):
+                            closed, lru_writer = writers.popitem(last=False)
+                            lru_writer.close()
+                            parts[closed] = (0, parts[closed][1] + 1)
+                        os.makedirs(directory and os.path.join(path, directory) or path, exist_ok=True)
+                        files.append(os.path.join(path, directory, f'part-{number}.parquet'))
+                        writer = pq.ParquetWriter(files[-1], part.schema, compression=compression)
+                    writer.write_table(part)
+                    writers[directory] = writer
+                    parts[directory] = (written + part.num_rows, number)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return ExportStats(rows, batches, files, time.perf_counter() - started)
@@ -0,0 +1,441 @@
+from datetime import datetime
+
+from sqlalchemy import insert, select, or_, join, func, desc, update, delete, and_, case, exists, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from lesson_2 import User, Order, Product, OrderProduct
+
+
+class AsyncRepo:
+    """Asyncio counterpart of lesson_3.Repo built on AsyncSession (asyncpg driver)"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add_user(self, telegram_id: int, full_name: str, username: str, language_code=None):
+        stmt = select(User).from_statement(
+            pg_insert(User).values(
+                telegram_id=telegram_id,
+                full_name=full_name,
+                username=username,
+                language_code=language_code
+            ).on_conflict_do_update(
+                index_elements=[User.telegram_id],
+                set_=dict(full_name=full_name, username=username)
+            ).returning(User)
+        )
+        result = (await self.session.scalars(stmt)).first()
+        await self.session.commit()
+        return result
+
+    async def get_user_by_id(self, telegram_id: int) -> User:
+        stmt = select(User).where(User.telegram_id == telegram_id)
+        result = await self.session.execute(stmt)
+        return result.scalars().first()
+
+    async def get_all_users(self):
+        stmt = select(User).where(or_(User.language_code == 'en', User.language_code == "uk"),
+                                  User.username.ilike("%john%"),
+                                  User.telegram_id > 0).order_by(User.created_at.desc()).limit(10)
+        result = await self.session.execute(stmt)
+        return result.scalars().all()
+
+    async def get_user_language(self, telegram_id: int) -> str:
+        stmt = select(User.language_code).where(User.telegram_id == telegram_id).order_by(User.created_at.desc())
+        result = await self.session.execute(stmt)
+        return result.scalars().first()
+
+    async def add_order(self, user_id: int):
+        stmt = select(Order).from_statement(
+            insert(Order).values(
+                user_id=user_id
+            ).returning(Order)
+        )
+        result = (await self.session.scalars(stmt)).first()
+        await self.session.commit()
+        return result
+
+    async def add_product(self, title, description, price):
+        stmt = select(Product).from_statement(
+            insert(Product).values(
+                title=title, description=description, price=price
+            ).returning(Product)
+        )
+        result = (await self.session.scalars(stmt)).first()
+        await self.session.commit()
+        return result
+
+    async def add_product_to_order(self, order_id, product_id, quantity):
+        stmt = select(OrderProduct).from_statement(
+            pg_insert(OrderProduct).values(
+                order_id=order_id, product_id=product_id, quantity=quantity,
+                order_created_at=select(Order.created_at).where(Order.order_id == order_id).scalar_subquery()
+            ).on_conflict_do_update(
+                index_elements=[OrderProduct.order_id, OrderProduct.product_id, OrderProduct.order_created_at],
+                set_=dict(quantity=quantity)
+            ).returning(OrderProduct)
+        )
+        result = (await self.session.scalars(stmt)).first()
+        await self.session.commit()
+        return result
+
+    async def select_all_invited_users(self):
+        ParentUser = aliased(User)
+        ReferralUser = aliased(User)
+        stmt = select(ParentUser.full_name.label('parent_name'),
+                      ReferralUser.full_name.label('referral_name')).select_from(
+            join(ParentUser, ReferralUser, ReferralUser.telegram_id == ParentUser.referrer_id)
+        ).where(ParentUser.referrer_id.isnot(None))
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    # Advanced Join Queries
+    async def get_users_with_orders(self):
+        """Get users with their order count using JOIN"""
+        stmt = select(User.full_name, func.count(Order.order_id).label('order_count')).join(
+            Order, User.telegram_id == Order.user_id
+        ).group_by(User.telegram_id, User.full_name)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_order_details_with_products(self):
+        """Get order details with product information using multiple JOINs"""
+        stmt = select(
+            User.full_name.label('customer_name'),
+            Order.order_id,
+            Product.title.label('product_name'),
+            OrderProduct.quantity,
+            Product.price
+        ).select_from(
+            join(join(join(User, Order, User.telegram_id == Order.user_id),
+                      OrderProduct, Order.order_id == OrderProduct.order_id),
+                 Product, OrderProduct.product_id == Product.product_id)
+        )
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_users_with_referral_count(self):
+        """Get users with count of people they referred using LEFT JOIN"""
+        Referrer = aliased(User)
+        Referred = aliased(User)
+        stmt = select(
+            Referrer.full_name.label('referrer_name'),
+            func.count(Referred.telegram_id).label('referral_count')
+        ).select_from(
+            Referrer
+        ).outerjoin(Referred, Referrer.telegram_id == Referred.referrer_id
+        ).group_by(Referrer.telegram_id, Referrer.full_name)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    # Aggregated Queries
+    async def get_total_users_count(self):
+        """Get total number of users"""
+        stmt = select(func.count(User.telegram_id))
+        result = await self.session.execute(stmt)
+        return result.scalar()
+
+    async def get_average_order_value(self):
+        """Get average order value across all orders"""
+        stmt = select(func.avg(Product.price * OrderProduct.quantity)).select_from(
+            join(OrderProduct, Product, OrderProduct.product_id == Product.product_id)
+        )
+        result = await self.session.execute(stmt)
+        return result.scalar()
+
+    async def get_top_products_by_quantity(self, limit=5):
+        """Get top products by total quantity ordered"""
+        stmt = select(
+            Product.title,
+            func.sum(OrderProduct.quantity).label('total_quantity')
+        ).join(OrderProduct).group_by(
+            Product.product_id, Product.title
+        ).order_by(desc('total_quantity')).limit(limit)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_user_statistics(self):
+        """Get user statistics by language"""
+        stmt = select(
+            User.language_code,
+            func.count(User.telegram_id).label('user_count'),
+            func.count(Order.order_id).label('total_orders')
+        ).outerjoin(Order).group_by(User.language_code)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_monthly_order_summary(self, since: datetime = None, until: datetime = None):
+        """Get monthly order summary with aggregations (see Repo.get_monthly_order_summary)"""
+        stmt = select(
+            func.date_trunc('month', Order.created_at).label('month'),
+            func.count(Order.order_id).label('order_count'),
+            func.sum(Product.price * OrderProduct.quantity).label('total_revenue')
+        ).select_from(
+            join(join(Order, OrderProduct, and_(Order.order_id == OrderProduct.order_id,
+                                                Order.created_at == OrderProduct.order_created_at)),
+                 Product, OrderProduct.product_id == Product.product_id)
+        ).group_by(func.date_trunc('month', Order.created_at)).order_by('month')
+        if since is not None:
+            stmt = stmt.where(Order.created_at >= since, OrderProduct.order_created_at >= since)
+        if until is not None:
+            stmt = stmt.where(Order.created_at < until, OrderProduct.order_created_at < until)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    # Update Queries with ORM
+    async def update_user_language(self, telegram_id: int, new_language: str):
+        """Update user language by telegram_id"""
+        stmt = update(User).where(User.telegram_id == telegram_id).values(language_code=new_language)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def update_product_price(self, product_id: int, new_price: float):
+        """Update product price"""
+        stmt = update(Product).where(Product.product_id == product_id).values(price=new_price)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def update_order_quantities(self, order_id: int, quantity_multiplier: float):
+        """Update all product quantities in an order"""
+        stmt = update(OrderProduct).where(
+            OrderProduct.order_id == order_id
+        ).values(quantity=OrderProduct.quantity * quantity_multiplier)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    # Delete Queries with ORM
+    async def delete_user_by_id(self, telegram_id: int):
+        """Delete user by telegram_id"""
+        stmt = delete(User).where(User.telegram_id == telegram_id)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def delete_products_by_price_range(self, min_price: float, max_price: float):
+        """Delete products within price range (handles foreign key constraints)"""
+        try:
+            product_ids_subquery = select(Product.product_id).where(
+                and_(Product.price >= min_price, Product.price <= max_price)
+            )
+
+            delete_orderproducts = delete(OrderProduct).where(
+                OrderProduct.product_id.in_(product_ids_subquery)
+            )
+            await self.session.execute(delete_orderproducts)
+
+            stmt = delete(Product).where(
+                and_(Product.price >= min_price, Product.price <= max_price)
+            )
+            result = await self.session.execute(stmt)
+            await self.session.commit()
+            return result.rowcount
+
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            raise e
+
+    async def delete_empty_orders(self):
+        """Delete orders with no products"""
+        subquery = select(OrderProduct.order_id).distinct()
+        stmt = delete(Order).where(~Order.order_id.in_(subquery))
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    # Bulk Insert Operations with ORM
+    async def bulk_insert_users(self, users_data: list):
+        """Bulk insert multiple users"""
+        stmt = insert(User).values(users_data)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def bulk_insert_products(self, products_data: list):
+        """Bulk insert multiple products"""
+        stmt = insert(Product).values(products_data)
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    async def bulk_upsert_users(self, users_data: list):
+        """Bulk upsert users (insert or update on conflict)"""
+        stmt = pg_insert(User).values(users_data).on_conflict_do_update(
+            index_elements=[User.telegram_id],
+            set_=dict(
+                full_name=pg_insert(User).excluded.full_name,
+                username=pg_insert(User).excluded.username,
+                language_code=pg_insert(User).excluded.language_code
+            )
+        )
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    # Advanced Query Operations
+    async def get_users_with_conditional_data(self):
+        """Get users with conditional fields using CASE statements"""
+        stmt = select(
+            User.full_name,
+            User.language_code,
+            case(
+                (func.count(Order.order_id) > 2, 'VIP'),
+                (func.count(Order.order_id) > 0, 'Regular'),
+                else_='New'
+            ).label('customer_type'),
+            func.coalesce(func.sum(Product.price * OrderProduct.quantity), 0).label('total_spent')
+        ).outerjoin(Order).outerjoin(OrderProduct).outerjoin(Product
+        ).group_by(User.telegram_id, User.full_name, User.language_code)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_products_with_window_functions(self):
+        """Get products with ranking and running totals using window functions"""
+        stmt = select(
+            Product.title,
+            Product.price,
+            func.rank().over(order_by=desc(Product.price)).label('price_rank'),
+            func.sum(Product.price).over(order_by=Product.product_id).label('running_total'),
+            func.avg(Product.price).over().label('avg_price')
+        ).order_by(desc(Product.price))
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_users_with_subqueries(self):
+        """Get users using EXISTS and subqueries"""
+        has_orders = exists().where(Order.user_id == User.telegram_id)
+        has_referrals = exists().where(User.referrer_id == User.telegram_id)
+
+        stmt = select(
+            User.full_name,
+            User.language_code,
+            has_orders.label('has_orders'),
+            has_referrals.label('has_referrals')
+        ).where(or_(has_orders, has_referrals))
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_complex_filtered_data(self):
+        """Complex filtering with multiple conditions"""
+        stmt = select(
+            User.full_name,
+            func.count(Order.order_id).label('order_count'),
+            func.sum(Product.price * OrderProduct.quantity).label('total_value')
+        ).join(Order).join(OrderProduct).join(Product).where(
+            and_(
+                User.language_code.in_(['en', 'fr', 'es']),
+                Product.price > 1000,
+                OrderProduct.quantity >= 2
+            )
+        ).group_by(User.telegram_id, User.full_name).having(
+            func.count(Order.order_id) > 1
+        )
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    # Advanced Update Operations
+    async def conditional_update_users(self):
+        """Update users based on complex conditions"""
+        subquery = select(Order.user_id).join(OrderProduct).join(Product).group_by(
+            Order.user_id
+        ).having(func.sum(Product.price * OrderProduct.quantity) > 10000)
+
+        stmt = update(User).where(
+            User.telegram_id.in_(subquery)
+        ).values(language_code='premium')
+
+        result = await self.session.execute(stmt)
+        await self.session.commit()
+        return result.rowcount
+
+    # Transaction Management
+    async def transfer_order_ownership(self, from_user_id: int, to_user_id: int):
+        """Transfer all orders from one user to another with transaction"""
+        try:
+            from_user = (await self.session.execute(
+                select(User).where(User.telegram_id == from_user_id)
+            )).scalar_one_or_none()
+
+            to_user = (await self.session.execute(
+                select(User).where(User.telegram_id == to_user_id)
+            )).scalar_one_or_none()
+
+            if not from_user or not to_user:
+                raise ValueError("One or both users not found")
+
+            stmt = update(Order).where(
+                Order.user_id == from_user_id
+            ).values(user_id=to_user_id)
+
+            result = await self.session.execute(stmt)
+            await self.session.commit()
+            return result.rowcount
+
+        except SQLAlchemyError as e:
+            await self.session.rollback()
+            raise e
+
+    # Raw SQL Operations
+    async def execute_raw_sql_query(self, sql_query: str):
+        """Execute raw SQL for complex operations"""
+        result = await self.session.execute(text(sql_query))
+        return result.fetchall()
+
+    async def get_database_statistics(self):
+        """Get database statistics using raw SQL"""
+        stats_query = """
+        SELECT
+            'users' as table_name, COUNT(*) as record_count
+        FROM users
+        UNION ALL
+        SELECT
+            'orders' as table_name, COUNT(*) as record_count
+        FROM orders
+        UNION ALL
+        SELECT
+            'products' as table_name, COUNT(*) as record_count
+        FROM products
+        UNION ALL
+        SELECT
+            'orderproducts' as table_name, COUNT(*) as record_count
+        FROM orderproducts
+        """
+        return await self.execute_raw_sql_query(stats_query)
+
+    async def get_top_customers_optimized(self, limit: int = 10):
+        """Optimized query for top customers by order value"""
+        stmt = select(
+            User.full_name,
+            User.telegram_id,
+            func.sum(Product.price * OrderProduct.quantity).label('total_spent'),
+            func.count(func.distinct(Order.order_id)).label('order_count')
+        ).join(Order).join(OrderProduct).join(Product
+        ).group_by(User.telegram_id, User.full_name
+        ).order_by(desc('total_spent')).limit(limit)
+
+        result = await self.session.execute(stmt)
+        return result.all()
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    from db import make_async_engine
+
+    async def main():
+        engine = make_async_engine()
+        session_pool = async_sessionmaker(engine, expire_on_commit=False)
+        async with session_pool() as session:
+            repo = AsyncRepo(session)
+            user = await repo.add_user(telegram_id=1, full_name="John Doe", username="john", language_code="en")
+            print(user)
+            print(await repo.get_user_language(1))
+            print(f"Total users: {await repo.get_total_users_count()}")
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+Batched UPDATE / DELETE for large tables.
+
+Instead of one statement over every matching row, the matching keys are walked in primary key
+order, `batch_size` at a time:
+    SELECT key FROM t WHERE <filter> AND key > :last_key ORDER BY key LIMIT :batch_size
+    UPDATE / DELETE t WHERE key IN (<those keys>) AND <filter>
+Every batch commits on its own, so row locks and WAL volume stay bounded and replicas can keep up
+(`sleep` adds a pause between batches). The last key of each batch is stored in `_mutation_progress`
+in the same transaction (the table comes from the mutation progress migration), so a job that was
+interrupted resumes after its last committed batch when it is started again under the same name;
+a finished job removes its checkpoint.
+"""
+import json
+import time
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import delete, select, text, tuple_, update
+
+
+class MutationStats(NamedTuple):
+    job: str
+    batches: int
+    rows: int
+    seconds: float
+    last_key: Optional[tuple]
+    resumed_rows: int = 0  # rows done by earlier, interrupted runs of the same job
+
+    @property
+    def rows_per_sec(self) -> float:
+        return (self.rows - self.resumed_rows) / self.seconds if self.seconds else 0.0
+
+
+def _encode_key(key: tuple) -> str:
+    return json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in key])
+
+
+def _decode_key(columns, encoded: str) -> tuple:
+    # Timestamps in keys (e.g. orderproducts.order_created_at) are stored as ISO strings
+    return tuple(datetime.fromisoformat(value) if isinstance(value, str) and column.type.python_type is datetime
+                 else value for column, value in zip(columns, json.loads(encoded)))
+
+
+def _key_expression(columns):
+    return columns[0] if len(columns) == 1 else tuple_(*columns)
+
+
+class BatchedMutation:
+    """Run an UPDATE (values given) or DELETE (values=None) over a model in committed key-ordered batches"""
+
+    def __init__(self, session, batch_size: int = 1000, sleep: float = 0.0,
+                 progress: Optional[Callable[[MutationStats], None]] = None):
+        self.session = session
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.progress = progress
+
+    def _checkpoint(self, job: str, key_columns):
+        row = self.session.execute(
+            text("SELECT last_key, batches, row_count FROM _mutation_progress WHERE job = :job"), {'job': job}
+        ).first()
+        if row is None:
+            return None, 0, 0
+        return _decode_key(key_columns, row.last_key), row.batches, row.row_count
+
+    def _save_checkpoint(self, job: str, last_key: tuple, batches: int, rows: int):
+        self.session.execute(
+            text("INSERT INTO _mutation_progress (job, last_key, batches, row_count) "
+                 "VALUES (:job, :last_key, :batches, :rows) "
+                 "ON CONFLICT (job) DO UPDATE SET last_key = EXCLUDED.last_key, batches = EXCLUDED.batches, "
+                 "row_count = EXCLUDED.row_count, updated_at = now()"),
+            {'job': job, 'last_key': _encode_key(last_key), 'batches': batches, 'rows': rows},
+        )
+
+    def run(self, job: str, model, where=None, values: Optional[dict] = None) -> MutationStats:
+        """
+        Mutate every row of `model` matching `where`; returns totals including resumed batches.
+
+        `job` names the checkpoint, so it has to identify the mutation and its arguments.
+        """
+        key_columns = list(model.__table__.primary_key.columns)
+        key = _key_expression(key_columns)
+        criteria = [where] if where is not None else []
+        last_key, batches, rows = self._checkpoint(job, key_columns)
+        resumed_rows = rows
+        started = time.perf_counter()
+
+        while True:
+            batch = select(*key_columns).where(*criteria).order_by(*key_columns).limit(self.batch_size)
+            if last_key is not None:
+                batch = batch.where(key > (last_key[0] if len(key_columns) == 1 else tuple_(*last_key)))
+            keys = [tuple(row) for row in self.session.execute(batch)]
+            if not keys:
+                break
+
+            # The filter is checked again: rows may have changed since the keys were read
+            targets = key.in_([k[0] for k in keys] if len(key_columns) == 1 else keys)
+            stmt = delete(model) if values is None else update(model).values(values)
+            result = self.session.execute(stmt.where(targets, *criteria).execution_options(synchronize_session=False))
+            last_key = keys[-1]
+            batches += 1
+            rows += result.rowcount
+            self._save_checkpoint(job, last_key, batches, rows)
+            self.session.commit()
+
+            if self.progress is not None:
+                self.progress(MutationStats(job, batches, rows, time.perf_counter() - started, last_key, resumed_rows))
+            if len(keys) < self.batch_size:
+                break
+            if self.sleep:
+                time.sleep(self.sleep)
+
+        self.session.execute(text("DELETE FROM _mutation_progress WHERE job = :job"), {'job': job})
+        self.session.commit()
+        return MutationStats(job, batches, rows, time.perf_counter() - started, last_key, resumed_rows)
@@ -0,0 +1,78 @@
+"""
+Throughput and peak RSS of getting a Repo report into a dataframe-ready form:
+    rows     Repo.get_order_details_with_products() -> dict per Row -> pyarrow.Table.from_pylist
+             (the row-by-row path the analytics notebooks use)
+    arrow    Repo.stream_record_batches('order_details') -> pyarrow.Table.from_batches
+    parquet  Repo.export_parquet('order_details', <tmp dir>), nothing kept in memory
+Each measurement runs in a fresh process, because ru_maxrss only ever goes up. The current tables
+are only read (generate data with data_generator.py first).
+
+Run from the repository root (needs pyarrow):
+    python -m benchmarks.bench_arrow_export --queries order_details products_with_window_functions
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from db import DatabaseSettings, make_engine
+from lesson_3 import Repo
+
+MODES = ('rows', 'arrow', 'parquet')
+# order_details is the large one; products_with_window_functions has an untyped avg(numeric) column
+DEFAULT_QUERIES = ['order_details', 'products_with_window_functions']
+# Row-by-row counterpart of each named export
+ROW_METHODS = {
+    'order_details': 'get_order_details_with_products',
+    'monthly_order_summary': 'get_monthly_order_summary',
+    'users_with_conditional_data': 'get_users_with_conditional_data',
+    'products_with_window_functions': 'get_products_with_window_functions',
+}
+
+
+def measure(url: str, mode: str, query: str, batch_size: int, queue):
+    import pyarrow as pa
+
+    engine = make_engine(url=url)
+    with sessionmaker(engine)() as session, tempfile.TemporaryDirectory() as directory:
+        repo = Repo(session)
+        started = time.perf_counter()
+        if mode == 'rows':
+            rows = len(pa.Table.from_pylist([row._asdict() for row in getattr(repo, ROW_METHODS[query])()]))
+        elif mode == 'arrow':
+            rows = pa.Table.from_batches(list(repo.stream_record_batches(query, batch_size=batch_size))).num_rows
+        else:
+            rows = repo.export_parquet(query, directory, batch_size=batch_size).rows
+        elapsed = time.perf_counter() - started
+    engine.dispose()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    queue.put((rows, elapsed, peak_mb))
+
+
+def run_isolated(url: str, mode: str, query: str, batch_size: int):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(url, mode, query, batch_size, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', nargs='+', choices=list(ROW_METHODS), default=DEFAULT_QUERIES)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    url = DatabaseSettings.from_env().url().render_as_string(hide_password=False)
+
+    print(f"{'query':>30} {'mode':>8} {'rows':>10} {'seconds':>8} {'rows/s':>12} {'peak RSS MB':>12}")
+    for query in args.queries:
+        for mode in args.modes:
+            rows, elapsed, peak_mb = run_isolated(url, mode, query, args.batch_size)
+            print(f"{query:>30} {mode:>8} {rows:>10} {elapsed:>8.2f} {rows / elapsed if elapsed else 0:>12.0f} "
+                  f"{peak_mb:>12.1f}")
@@ -0,0 +1,88 @@
+"""
+Concurrency benchmark: AsyncRepo vs the sync lesson_3.Repo inside an asyncio event loop.
+
+Every handler simulates one incoming bot message (get_user_by_id + get_user_language).
+The sync Repo blocks the loop on psycopg2 I/O, so handlers run one after another,
+while AsyncRepo lets them overlap on the asyncpg connection pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_async_repo --handlers 200 --rounds 5
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from async_repo import AsyncRepo
+from db import DatabaseSettings, make_async_engine, make_engine
+from lesson_3 import Repo
+
+USER_IDS = range(900_000, 901_000)
+
+
+def prepare_users(session_pool):
+    with session_pool() as session:
+        Repo(session).bulk_upsert_users([
+            {'telegram_id': telegram_id, 'full_name': f'Bench User {telegram_id}',
+             'username': f'bench{telegram_id}', 'language_code': 'en'}
+            for telegram_id in USER_IDS
+        ])
+
+
+async def sync_handler(session_pool, telegram_id):
+    # What the bot does today: a blocking call straight from a coroutine
+    with session_pool() as session:
+        repo = Repo(session)
+        repo.get_user_by_id(telegram_id)
+        repo.get_user_language(telegram_id)
+
+
+async def async_handler(session_pool, telegram_id):
+    async with session_pool() as session:
+        repo = AsyncRepo(session)
+        await repo.get_user_by_id(telegram_id)
+        await repo.get_user_language(telegram_id)
+
+
+async def run_round(handler, session_pool, handlers):
+    ids = [random.choice(USER_IDS) for _ in range(handlers)]
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(session_pool, telegram_id) for telegram_id in ids))
+    return handlers / (time.perf_counter() - started)
+
+
+async def main(handlers, rounds, pool_size):
+    settings = DatabaseSettings.from_env(pool_size=pool_size)
+    sync_engine = make_engine(settings)
+    async_engine = make_async_engine(settings)
+    sync_pool = sessionmaker(sync_engine, expire_on_commit=False)
+    async_pool = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    prepare_users(sync_pool)
+
+    results = {}
+    for name, handler, session_pool in (
+        ('sync Repo', sync_handler, sync_pool),
+        ('AsyncRepo', async_handler, async_pool),
+    ):
+        await run_round(handler, session_pool, handlers)  # warm up the pool
+        rates = [await run_round(handler, session_pool, handlers) for _ in range(rounds)]
+        results[name] = sum(rates) / len(rates)
+        print(f"{name:10s}: {results[name]:10.1f} req/s ({handlers} concurrent handlers, {rounds} rounds)")
+
+    print(f"Speedup: {results['AsyncRepo'] / results['sync Repo']:.2f}x")
+
+    sync_engine.dispose()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handlers', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--pool-size', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.handlers, args.rounds, args.pool_size))
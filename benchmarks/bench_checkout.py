@@ -0,0 +1,70 @@
+"""
+Checkout latency: add_order + one add_product_to_order per line (a statement and a commit each)
+vs add_order_with_products (one statement, one commit), for growing cart sizes.
+
+Orders created by the benchmark are deleted at the end.
+
+Run from the repository root against a database with users and products (see data_generator.py):
+    python -m benchmarks.bench_checkout --carts 1 5 20 --repeat 50
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import delete, select
+
+from db import make_engine, make_session_pool
+from instrumentation import count_queries
+from lesson_2 import User, Order, Product
+from lesson_3 import Repo
+
+
+def per_line_checkout(repo, user_id, items):
+    order = repo.add_order(user_id)
+    for product_id, quantity in items:
+        repo.add_product_to_order(order.order_id, product_id, quantity)
+    return order
+
+
+def single_statement_checkout(repo, user_id, items):
+    return repo.add_order_with_products(user_id, items)
+
+
+def measure(session, repo, checkout, user_id, items, repeat, created):
+    samples = []
+    with count_queries(session) as counter:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            order = checkout(repo, user_id, items)
+            samples.append((time.perf_counter() - started) * 1000)
+            created.append(order.order_id)
+    return statistics.median(samples), counter.count / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--carts', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    created = []
+    with make_session_pool(engine)() as session:
+        repo = Repo(session)
+        user_id = session.scalar(select(User.telegram_id).limit(1))
+        product_ids = session.scalars(select(Product.product_id).limit(max(args.carts))).all()
+        try:
+            for size in args.carts:
+                items = [(product_id, 1) for product_id in product_ids[:size]]
+                before_ms, before_queries = measure(session, repo, per_line_checkout, user_id, items,
+                                                    args.repeat, created)
+                after_ms, after_queries = measure(session, repo, single_statement_checkout, user_id, items,
+                                                  args.repeat, created)
+                print(f"{len(items):3d} lines: per-line {before_ms:8.2f} ms ({before_queries:.0f} statements), "
+                      f"single statement {after_ms:8.2f} ms ({after_queries:.0f} statement), "
+                      f"{before_ms / after_ms:.1f}x")
+        finally:
+            session.rollback()
+            session.execute(delete(Order).where(Order.order_id.in_(created)))
+            session.commit()
+    engine.dispose()
@@ -0,0 +1,75 @@
+"""
+Import-time budget check based on `python -X importtime`.
+
+Each module is imported in a fresh interpreter `--runs` times and the best cumulative time is
+compared with its budget. The check also fails if importing a module pulls in a forbidden module
+(Faker, the MySQL dialect) or creates an engine as a side effect.
+Exits with status 1 when anything is over budget, so it can gate CI.
+
+Run from the repository root:
+    python -m benchmarks.bench_import_time
+    python -m benchmarks.bench_import_time --scale 1.5   # loosen every budget on slow machines
+"""
+import argparse
+import subprocess
+import sys
+
+# module -> cumulative import budget in milliseconds (SQLAlchemy itself accounts for most of it)
+BUDGETS_MS = {
+    'lesson_2': 500,   # imported by alembic/env.py on every alembic command
+    'lesson_3': 650,   # imported by every worker process
+    'db': 450,
+}
+FORBIDDEN = ['faker', 'sqlalchemy.dialects.mysql']
+
+PROBE = """
+import sys
+import {module}
+import db
+print(','.join(name for name in {forbidden!r} if name in sys.modules))
+print(db._engine is not None)
+"""
+
+
+def cumulative_us(stderr: str, module: str) -> int:
+    for line in stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2].startswith('  '):
+            return int(parts[1])
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def measure(module: str, runs: int):
+    best = None
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, forbidden=FORBIDDEN)],
+            capture_output=True, text=True, check=True,
+        )
+        elapsed = cumulative_us(completed.stderr, module)
+        best = elapsed if best is None else min(best, elapsed)
+    forbidden, engine_created = completed.stdout.split('\n')[:2]
+    return best / 1000, [name for name in forbidden.split(',') if name], engine_created == 'True'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every budget')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS_MS.items():
+        elapsed_ms, forbidden, engine_created = measure(module, args.runs)
+        budget *= args.scale
+        problems = []
+        if elapsed_ms > budget:
+            problems.append(f"over budget ({budget:.0f} ms)")
+        if forbidden:
+            problems.append(f"imports {', '.join(forbidden)}")
+        if engine_created:
+            problems.append("creates an engine at import time")
+        failed = failed or bool(problems)
+        print(f"{module:10s} {elapsed_ms:8.1f} ms  {'; '.join(problems) or 'ok'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,60 @@
+"""
+Latency of page 1 vs a deep page for OFFSET paging and keyset paging (get_users_page / get_orders_page).
+
+The deep page's continuation token is computed once up front, exactly what a client holding
+the token from the previous page would send.
+
+Run from the repository root against a database with enough rows (see data_generator.py):
+    python -m benchmarks.bench_keyset_pagination --page 10000 --page-size 10
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from db import make_engine
+
+from lesson_2 import User, Order
+from lesson_3 import Repo, encode_page_token
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def offset_page(session, model, key_column, page, page_size):
+    stmt = select(model).order_by(model.created_at.desc(), key_column.desc()).offset((page - 1) * page_size).limit(page_size)
+    return session.execute(stmt).scalars().all()
+
+
+def token_for_page(session, model, key_column, page, page_size):
+    if page == 1:
+        return None
+    last = offset_page(session, model, key_column, page - 1, page_size)[-1]
+    return encode_page_token(last.created_at, getattr(last, key_column.key))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page', type=int, default=10_000)
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with sessionmaker(engine)() as session:
+        repo = Repo(session)
+        for model, key_column, keyset in ((User, User.telegram_id, repo.get_users_page),
+                                          (Order, Order.order_id, repo.get_orders_page)):
+            for page in (1, args.page):
+                token = token_for_page(session, model, key_column, page, args.page_size)
+                offset_ms = timed(lambda: offset_page(session, model, key_column, page, args.page_size), args.repeat)
+                keyset_ms = timed(lambda: keyset(args.page_size, token), args.repeat)
+                print(f"{model.__tablename__:7s} page {page:>6}: OFFSET {offset_ms:8.2f} ms, keyset {keyset_ms:8.2f} ms")
@@ -0,0 +1,163 @@
+"""
+Monthly order summaries and retention on unpartitioned vs monthly partitioned orders/orderproducts.
+
+The current orders and their lines are copied into two scratch schemas, one with plain tables and
+one with a partition per month (the layout of the orders monthly partitions migration), with the
+same keys and indexes. On each layout:
+    - Repo.get_monthly_order_summary() over all months and over the last --recent-months months,
+      with the number of partitions the bounded query scans (from EXPLAIN)
+    - retention of the oldest --drop-months months: DELETE ... WHERE created_at < cutoff (cascading
+      to the lines) vs drop_order_partitions (DETACH + DROP)
+The scratch schemas are dropped at the end; the real tables are only read.
+
+Run from the repository root against a database with orders (see data_generator.py):
+    python -m benchmarks.bench_partitioning --recent-months 3 --drop-months 6 --repeat 5
+"""
+import argparse
+import statistics
+import time
+from datetime import date
+
+from sqlalchemy import func, select, text
+
+from db import make_engine, make_session_pool
+from lesson_2 import Order
+from lesson_3 import Repo
+from partitioning import add_months, drop_order_partitions, partition_suffix
+
+LAYOUTS = {'unpartitioned': 'bench_unpartitioned', 'partitioned': 'bench_partitioned'}
+STATS_TABLES = ('userorderstats', 'productorderstats', 'monthlyorderstats', 'tablerowcounts')
+
+
+def build_layout(session, schema: str, partitioned: bool, first_month: date, last_month: date):
+    session.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    session.execute(text(f"CREATE SCHEMA {schema}"))
+    session.execute(text(f"""
+        CREATE TABLE {schema}.orders (
+            order_id integer NOT NULL, user_id bigint NOT NULL,
+            created_at timestamp NOT NULL, updated_at timestamp NOT NULL
+        ) {'PARTITION BY RANGE (created_at)' if partitioned else ''}
+    """))
+    session.execute(text(f"""
+        CREATE TABLE {schema}.orderproducts (
+            order_id integer NOT NULL, product_id integer NOT NULL, quantity integer NOT NULL,
+            order_created_at timestamp NOT NULL
+        ) {'PARTITION BY RANGE (order_created_at)' if partitioned else ''}
+    """))
+    if partitioned:
+        month = first_month
+        while month <= last_month:
+            bounds = f"FROM ('{month}') TO ('{add_months(month, 1)}')"
+            for table in ('orders', 'orderproducts'):
+                session.execute(text(f"CREATE TABLE {schema}.{table}_{partition_suffix(month)} "
+                                     f"PARTITION OF {schema}.{table} FOR VALUES {bounds}"))
+            month = add_months(month, 1)
+
+    # Works for the source tables in either layout: the lines get their order's created_at from the join
+    session.execute(text(f"""
+        INSERT INTO {schema}.orders SELECT order_id, user_id, created_at, updated_at FROM public.orders
+    """))
+    session.execute(text(f"""
+        INSERT INTO {schema}.orderproducts (order_id, product_id, quantity, order_created_at)
+        SELECT l.order_id, l.product_id, l.quantity, o.created_at
+        FROM public.orderproducts l JOIN public.orders o ON o.order_id = l.order_id
+    """))
+    session.execute(text(f"ALTER TABLE {schema}.orders ADD PRIMARY KEY (order_id, created_at)"))
+    session.execute(text(f"CREATE INDEX ON {schema}.orders (created_at, order_id)"))
+    session.execute(text(f"ALTER TABLE {schema}.orderproducts ADD PRIMARY KEY (order_id, product_id, order_created_at)"))
+    session.execute(text(f"""
+        ALTER TABLE {schema}.orderproducts ADD FOREIGN KEY (order_id, order_created_at)
+        REFERENCES {schema}.orders (order_id, created_at) ON DELETE CASCADE
+    """))
+    # drop_order_partitions updates the order summaries and row counts: scratch copies keep it off the real ones
+    for table in STATS_TABLES:
+        if session.execute(text(f"SELECT to_regclass('public.{table}')")).scalar() is not None:
+            session.execute(text(f"CREATE TABLE {schema}.{table} (LIKE public.{table} INCLUDING ALL)"))
+    session.execute(text(f"ANALYZE {schema}.orders"))
+    session.execute(text(f"ANALYZE {schema}.orderproducts"))
+    session.commit()
+
+
+def median_ms(call, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def scanned_orders_tables(session, stmt) -> int:
+    """orders tables (the table or its partitions) in the plan of stmt; pruned partitions do not appear"""
+    compiled = stmt.compile(dialect=session.get_bind().dialect, compile_kwargs={'literal_binds': True})
+    plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+    relations = set()
+
+    def walk(node):
+        if node.get('Relation Name', '').startswith('orders'):
+            relations.add(node['Relation Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return len(relations)
+
+
+def measure(session, partitioned: bool, since: date, cutoff: date, repeat: int) -> dict:
+    repo = Repo(session)
+    # Same bound on orders.created_at as the recent summary, so the same partitions are pruned
+    bounded = select(func.count()).select_from(Order).where(Order.created_at >= since)
+    results = {
+        'summary_all_ms': median_ms(repo.get_monthly_order_summary, repeat),
+        'summary_recent_ms': median_ms(lambda: repo.get_monthly_order_summary(since=since), repeat),
+        'tables_scanned_recent': scanned_orders_tables(session, bounded),
+    }
+    orders_removed = session.scalar(select(func.count()).select_from(Order).where(Order.created_at < cutoff))
+    started = time.perf_counter()
+    if partitioned:
+        drop_order_partitions(session, cutoff)
+    else:
+        session.execute(text("DELETE FROM orders WHERE created_at < :cutoff"), {'cutoff': cutoff})
+        session.commit()
+    results['retention_ms'] = (time.perf_counter() - started) * 1000
+    results['orders_removed'] = orders_removed
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recent-months', type=int, default=3)
+    parser.add_argument('--drop-months', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with make_session_pool(engine)() as session:
+        first, last = session.execute(text("SELECT min(created_at), max(created_at) FROM orders")).one()
+        if first is None:
+            raise SystemExit("No orders in the database, generate some data first")
+        first_month, last_month = first.date().replace(day=1), last.date().replace(day=1)
+        for layout, schema in LAYOUTS.items():
+            build_layout(session, schema, layout == 'partitioned', first_month, last_month)
+    engine.dispose()
+
+    since = add_months(last_month, 1 - args.recent_months)
+    cutoff = add_months(first_month, args.drop_months)
+    print(f"orders from {first_month} to {last_month}, recent = since {since}, retention drops before {cutoff}")
+    try:
+        for layout, schema in LAYOUTS.items():
+            # Unqualified table names (Repo, partitioning.py) resolve to the scratch schema
+            layout_engine = make_engine(connect_args={'options': f'-c search_path={schema},public'})
+            with make_session_pool(layout_engine)() as session:
+                r = measure(session, layout == 'partitioned', since, cutoff, args.repeat)
+            layout_engine.dispose()
+            print(f"{layout:14s} summary all {r['summary_all_ms']:9.1f} ms, "
+                  f"last {args.recent_months} months {r['summary_recent_ms']:9.1f} ms "
+                  f"({r['tables_scanned_recent']} orders tables scanned), "
+                  f"retention of {r['orders_removed']} orders {r['retention_ms']:9.1f} ms")
+    finally:
+        engine = make_engine()
+        with engine.begin() as connection:
+            for schema in LAYOUTS.values():
+                connection.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        engine.dispose()
@@ -0,0 +1,56 @@
+"""
+Pool load test: connection setups, checkout wait and throughput under concurrency for
+    - NullPool (a new connection per request, what short-lived engines amount to)
+    - SQLAlchemy's default QueuePool (size 5, overflow 10, opened lazily)
+    - the tuned pool from db.py (sized to the workers and warmed up at startup)
+
+Run from the repository root:
+    python -m benchmarks.bench_pool --threads 32 --requests 200
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.pool import NullPool
+
+from db import DatabaseSettings, make_engine, make_session_pool, warm_up
+from instrumentation import QueryMetrics
+from lesson_3 import Repo
+
+
+def worker(session_pool, requests):
+    for telegram_id in range(requests):
+        with session_pool() as session:
+            Repo(session).get_user_by_id(telegram_id)
+
+
+def run(name, engine, metrics, threads, requests, warm=False):
+    if warm:
+        warm_up(engine)
+    setups_before = metrics.connections_opened
+    session_pool = make_session_pool(engine)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: worker(session_pool, requests), range(threads)))
+    elapsed = time.perf_counter() - started
+    print(f"{name:14s}: {threads * requests / elapsed:9.1f} req/s, "
+          f"{metrics.connections_opened - setups_before:5d} connection setups during the run, "
+          f"checkout wait p95 <= {metrics.checkout_wait.percentile(0.95) * 1000:.1f} ms")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    settings = DatabaseSettings.from_env()
+    for name, engine_kwargs, warm in (
+        ('NullPool', {'poolclass': NullPool}, False),
+        ('default pool', {'pool_size': 5, 'max_overflow': 10, 'pool_pre_ping': False}, False),
+        ('tuned pool', {'pool_size': args.threads, 'max_overflow': 0}, True),
+    ):
+        metrics = QueryMetrics()
+        engine = make_engine(settings, metrics=metrics, **engine_kwargs)
+        run(name, engine, metrics, args.threads, args.requests, warm)
@@ -0,0 +1,87 @@
+"""
+Hydration time and retained memory per 1M rows of read-only results (see readonly.py):
+    tuples   Core rows of the same columns (the fetch itself, the baseline)
+    orm      select(Model) -> tracked ORM instances in the Session's identity map
+    dto      Repo(result_type='dto') path -> frozen __slots__ DTOs
+    columns  Repo.stream_columns -> ColumnBatch (array.array columns), all batches kept
+Hydration = the mode's time minus the tuples time. Memory is what the results keep alive
+(tracemalloc, measured in a separate run because tracing slows everything down), scaled to 1M rows.
+Each run uses a fresh process. The tables are only read (generate data with data_generator.py first).
+
+Run from the repository root:
+    python -m benchmarks.bench_readonly_results --model orders --rows 1000000
+"""
+import argparse
+import gc
+import multiprocessing
+import time
+import tracemalloc
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from db import DatabaseSettings, make_engine
+from lesson_2 import User, Order, Product
+from lesson_3 import Repo
+from readonly import dto_stmt, to_dtos
+
+MODELS = {'users': User, 'orders': Order, 'products': Product}
+MODES = ('tuples', 'orm', 'dto', 'columns')
+
+
+def load(session, mode: str, model, rows: int, batch_size: int):
+    stmt = select(model).limit(rows)
+    dto, columns_stmt = dto_stmt(stmt)
+    if mode == 'tuples':
+        return session.execute(columns_stmt).all()
+    if mode == 'orm':
+        return session.execute(stmt).scalars().all()
+    if mode == 'dto':
+        return to_dtos(dto, session.execute(columns_stmt))
+    return list(Repo(session).stream_columns(stmt, batch_size=batch_size))
+
+
+def measure(url: str, mode: str, model_name: str, rows: int, batch_size: int, trace: bool, queue):
+    engine = make_engine(url=url)
+    with sessionmaker(engine)() as session:
+        session.connection()  # connect before measuring
+        gc.collect()
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = load(session, mode, MODELS[model_name], rows, batch_size)
+        elapsed = time.perf_counter() - started
+        count = sum(len(batch) for batch in result) if mode == 'columns' else len(result)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] if trace else 0
+        tracemalloc.stop()
+    engine.dispose()
+    queue.put((count, elapsed, retained))
+
+
+def run_isolated(*args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(*args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=list(MODELS), default='orders')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    args = parser.parse_args()
+
+    url = DatabaseSettings.from_env().url().render_as_string(hide_password=False)
+
+    print(f"{'mode':>8} {'rows':>10} {'seconds':>8} {'hydration s':>12} {'MB per 1M rows':>15}")
+    baseline = None
+    for mode in MODES:
+        count, elapsed, _ = run_isolated(url, mode, args.model, args.rows, args.batch_size, False)
+        _, _, retained = run_isolated(url, mode, args.model, args.rows, args.batch_size, True)
+        baseline = elapsed if baseline is None else baseline
+        per_million = retained / 2**20 * 1_000_000 / count if count else 0.0
+        print(f"{mode:>8} {count:>10} {elapsed:>8.2f} {elapsed - baseline:>12.2f} {per_million:>15.1f}")
@@ -0,0 +1,151 @@
+"""
+Python-side overhead per call of the hot Repo paths, for three ways of issuing the statement:
+    fresh     - a new select()/insert() construct on every call (how Repo used to do it)
+    lambda    - lambda_stmt(), cached by the lambda's code location
+    prebuilt  - the module-level statements with bindparam() that Repo uses now
+
+Overhead is the wall time of a call minus the time spent inside the driver (cursor.execute),
+which is measured with engine events, so network and server time drop out.
+Writes run inside a transaction that is rolled back.
+
+Run from the repository root against a database with at least one user, order and product:
+    python -m benchmarks.bench_statement_cache --calls 5000
+"""
+import argparse
+import statistics
+import time
+
+from sqlalchemy import event, insert, lambda_stmt, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from db import make_engine, make_session_pool
+from lesson_2 import User, Order, Product, OrderProduct
+from lesson_3 import Repo
+
+
+def fresh_calls(session, user_id, order_id, product_id):
+    def get_user_by_id():
+        return session.execute(select(User).where(User.telegram_id == user_id)).scalars().first()
+
+    def get_user_language():
+        stmt = select(User.language_code).where(User.telegram_id == user_id).order_by(User.created_at.desc())
+        return session.execute(stmt).scalars().first()
+
+    def add_order():
+        stmt = select(Order).from_statement(insert(Order).values(user_id=user_id).returning(Order))
+        return session.scalars(stmt).first()
+
+    def add_product_to_order():
+        stmt = select(OrderProduct).from_statement(
+            pg_insert(OrderProduct).values(order_id=order_id, product_id=product_id, quantity=2,
+                                           order_created_at=select(Order.created_at)
+                                           .where(Order.order_id == order_id).scalar_subquery())
+            .on_conflict_do_update(index_elements=[OrderProduct.order_id, OrderProduct.product_id,
+                                                   OrderProduct.order_created_at],
+                                   set_=dict(quantity=2))
+            .returning(OrderProduct)
+        )
+        return session.scalars(stmt).first()
+
+    return [get_user_by_id, get_user_language, add_order, add_product_to_order]
+
+
+def lambda_calls(session, user_id, order_id, product_id):
+    def get_user_by_id():
+        stmt = lambda_stmt(lambda: select(User).where(User.telegram_id == user_id))
+        return session.execute(stmt).scalars().first()
+
+    def get_user_language():
+        stmt = lambda_stmt(lambda: select(User.language_code).where(User.telegram_id == user_id))
+        stmt += lambda s: s.order_by(User.created_at.desc())
+        return session.execute(stmt).scalars().first()
+
+    def add_order():
+        stmt = lambda_stmt(
+            lambda: select(Order).from_statement(insert(Order).values(user_id=user_id).returning(Order))
+        )
+        return session.scalars(stmt).first()
+
+    def add_product_to_order():
+        quantity = 2
+        stmt = lambda_stmt(lambda: select(OrderProduct).from_statement(
+            pg_insert(OrderProduct).values(order_id=order_id, product_id=product_id, quantity=quantity,
+                                           order_created_at=select(Order.created_at)
+                                           .where(Order.order_id == order_id).scalar_subquery())
+            .on_conflict_do_update(index_elements=[OrderProduct.order_id, OrderProduct.product_id,
+                                                   OrderProduct.order_created_at],
+                                   set_=dict(quantity=quantity))
+            .returning(OrderProduct)
+        ))
+        return session.scalars(stmt).first()
+
+    return [get_user_by_id, get_user_language, add_order, add_product_to_order]
+
+
+def prebuilt_calls(repo, user_id, order_id, product_id):
+    return [
+        lambda: repo.get_user_by_id(user_id),
+        lambda: repo.get_user_language(user_id),
+        lambda: repo.add_order(user_id),
+        lambda: repo.add_product_to_order(order_id, product_id, 2),
+    ]
+
+
+class DriverTimer:
+    def __init__(self, engine):
+        self.total = 0.0
+        self._started = None
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, *args):
+        self._started = time.perf_counter()
+
+    def _after(self, *args):
+        self.total += time.perf_counter() - self._started
+
+
+def overhead_us(call, timer, calls: int, rounds: int) -> float:
+    call()  # warm the compiled cache
+    samples = []
+    for _ in range(rounds):
+        driver_before = timer.total
+        started = time.perf_counter()
+        for _ in range(calls):
+            call()
+        wall = time.perf_counter() - started
+        samples.append((wall - (timer.total - driver_before)) / calls * 1_000_000)
+    return statistics.median(samples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    timer = DriverTimer(engine)
+    with make_session_pool(engine)() as session:
+        user_id = session.scalar(select(User.telegram_id).limit(1))
+        order_id = session.scalar(select(Order.order_id).limit(1))
+        product_id = session.scalar(select(Product.product_id).limit(1))
+        repo = Repo(session, autocommit=False)
+
+        variants = {
+            'fresh': fresh_calls(session, user_id, order_id, product_id),
+            'lambda': lambda_calls(session, user_id, order_id, product_id),
+            'prebuilt': prebuilt_calls(repo, user_id, order_id, product_id),
+        }
+        names = ['get_user_by_id', 'get_user_language', 'add_order', 'add_product_to_order']
+        print(f"{'method':22s}" + ''.join(f"{variant:>12s}" for variant in variants) + "   (us of Python per call)")
+        for index, name in enumerate(names):
+            results = [overhead_us(calls[index], timer, args.calls, args.rounds) for calls in variants.values()]
+            print(f"{name:22s}" + ''.join(f"{result:12.1f}" for result in results))
+            session.expunge_all()
+        session.rollback()
+
+        stats = repo.get_statement_cache_stats()
+        print(f"compiled cache: {stats['hits']} hits, {stats['misses']} misses, "
+              f"hit ratio {stats['hit_ratio']:.1%}, {stats['cache_size']} entries")
+    engine.dispose()
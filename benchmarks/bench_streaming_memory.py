@@ -0,0 +1,68 @@
+"""
+Peak RSS of get_order_details_with_products (result.all()) vs stream_order_details_with_products
+(server-side cursor) as the number of order lines grows.
+
+Each measurement runs in a fresh process, because ru_maxrss only ever goes up.
+The tables are rebuilt with data_generator for every size, so point this at a scratch database.
+
+Run from the repository root:
+    python -m benchmarks.bench_streaming_memory --sizes 100000 1000000 5000000
+"""
+import argparse
+import multiprocessing
+import resource
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from data_generator import GeneratorConfig, generate_dataset
+from db import DatabaseSettings, make_engine
+from lesson_3 import Repo
+
+
+def measure(url: str, mode: str, queue):
+    engine = make_engine(url=url)
+    with sessionmaker(engine)() as session:
+        repo = Repo(session)
+        started = time.perf_counter()
+        if mode == 'all':
+            rows = len(repo.get_order_details_with_products())
+        else:
+            rows = sum(len(batch) for batch in repo.stream_order_details_with_products(batch_size=5000, partitions=True))
+        elapsed = time.perf_counter() - started
+    engine.dispose()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    queue.put((rows, elapsed, peak_mb))
+
+
+def run_isolated(url: str, mode: str):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(url, mode, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    url = DatabaseSettings.from_env().url().render_as_string(hide_password=False)
+
+    print(f"{'order lines':>12} {'mode':>8} {'rows':>10} {'seconds':>8} {'peak RSS MB':>12}")
+    for size in args.sizes:
+        engine = make_engine(url=url)
+        with engine.begin() as connection:
+            connection.execute(text("TRUNCATE TABLE users, products CASCADE"))
+            connection.execute(text("TRUNCATE TABLE _generator_chunks"))
+        engine.dispose()
+        generate_dataset(url, GeneratorConfig(users=max(1000, size // 20), products=max(100, size // 200),
+                                              order_lines=size, processes=args.processes),
+                         progress=lambda message: None)
+        for mode in ('all', 'stream'):
+            rows, elapsed, peak_mb = run_isolated(url, mode)
+            print(f"{size:>12} {mode:>8} {rows:>10} {elapsed:>8.2f} {peak_mb:>12.1f}")
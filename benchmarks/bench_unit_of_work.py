@@ -0,0 +1,60 @@
+"""
+Rows/sec of Repo writes with a commit per call (autocommit) vs one unit of work.
+
+Run from the repository root:
+    python -m benchmarks.bench_unit_of_work --rows 2000
+"""
+import argparse
+import time
+
+from sqlalchemy import delete
+from sqlalchemy.orm import sessionmaker
+
+from db import make_engine
+
+from lesson_2 import User
+from lesson_3 import Repo
+
+FIRST_ID = 800_000
+
+
+def write_rows(repo, rows):
+    for telegram_id in range(FIRST_ID, FIRST_ID + rows):
+        repo.add_user(telegram_id=telegram_id, full_name=f'UoW User {telegram_id}',
+                      username=f'uow{telegram_id}', language_code='en')
+        repo.update_user_language(telegram_id, 'uk')
+
+
+def clean_up(session_pool, rows):
+    with session_pool() as session:
+        session.execute(delete(User).where(User.telegram_id.between(FIRST_ID, FIRST_ID + rows)))
+        session.commit()
+
+
+def run(session_pool, rows, mode):
+    clean_up(session_pool, rows)
+    with session_pool() as session:
+        repo = Repo(session)
+        started = time.perf_counter()
+        if mode == 'autocommit':
+            write_rows(repo, rows)
+        else:
+            with repo.transaction():
+                write_rows(repo, rows)
+        elapsed = time.perf_counter() - started
+    clean_up(session_pool, rows)
+    return rows / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = make_engine()
+    session_pool = sessionmaker(engine, expire_on_commit=False)
+
+    results = {mode: run(session_pool, args.rows, mode) for mode in ('autocommit', 'unit of work')}
+    for mode, rate in results.items():
+        print(f"{mode:12s}: {rate:10.1f} rows/s")
+    print(f"Speedup: {results['unit of work'] / results['autocommit']:.2f}x")
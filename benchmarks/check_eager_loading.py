@@ -0,0 +1,97 @@
+"""
+Query-count check for the eager-loading Repo methods (get_user_order_history, get_users_page_with_referrers).
+
+For every loading strategy the order history of the user with the fewest orders and of the user
+with the most orders is loaded and fully rendered (orders -> lines -> product titles). Both must
+take the same number of round-trips, and rendering must take none (assert_query_count(..., 0)).
+Referrer pages of 10 and 400 users are compared the same way (selectin loads in batches of 500
+keys, so it is constant per page up to that size).
+The default lazy loading is shown first for comparison: it grows with the number of orders.
+Exits with status 1 if any strategy's query count depends on the data.
+
+Run from the repository root against a database with orders (see data_generator.py):
+    python -m benchmarks.check_eager_loading
+"""
+import sys
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import InvalidRequestError
+
+from db import make_engine, make_session_pool
+from instrumentation import assert_query_count, count_queries
+from lesson_2 import User, Order
+from lesson_3 import LOADER_STRATEGIES, Repo
+
+
+def render_history(user):
+    return [(order.order_id, [(line.product.title, line.quantity) for line in order.products])
+            for order in user.orders]
+
+
+def render_referrers(users):
+    return [(user.full_name, user.referrer.full_name if user.referrer else None) for user in users]
+
+
+def lazy_history_queries(session, telegram_id):
+    with count_queries(session) as counter:
+        render_history(session.get(User, telegram_id))
+    session.expunge_all()
+    return counter.count
+
+
+def history_queries(session, repo, telegram_id, strategy):
+    with count_queries(session) as counter:
+        user = repo.get_user_order_history(telegram_id, strategy)
+    if strategy == 'raise':
+        try:
+            render_history(user)
+        except InvalidRequestError:
+            pass  # raiseload: touching the unloaded relationship raises instead of querying
+        else:
+            raise AssertionError("raiseload did not raise")
+    else:
+        with assert_query_count(session, 0):
+            render_history(user)
+    session.expunge_all()
+    return counter.count
+
+
+def referrer_page_queries(session, repo, page_size, strategy):
+    with count_queries(session) as counter:
+        users, _ = repo.get_users_page_with_referrers(page_size, strategy=strategy)
+    if strategy != 'raise':
+        with assert_query_count(session, 0):
+            render_referrers(users)
+    session.expunge_all()
+    return counter.count
+
+
+def main(engine) -> bool:
+    ok = True
+    with make_session_pool(engine)() as session:
+        repo = Repo(session, autocommit=False)
+        order_counts = (select(Order.user_id, func.count().label('orders'))
+                        .group_by(Order.user_id).order_by(func.count()))
+        rows = session.execute(order_counts).all()
+        if not rows:
+            print("No orders in the database, generate some data first")
+            return False
+        (few_id, few), (many_id, many) = rows[0], rows[-1]
+        print(f"user {few_id} has {few} orders, user {many_id} has {many} orders")
+
+        print(f"{'lazy (default)':16s} history: {lazy_history_queries(session, few_id):5d} vs "
+              f"{lazy_history_queries(session, many_id):5d} queries")
+        for strategy in LOADER_STRATEGIES:
+            small = history_queries(session, repo, few_id, strategy)
+            large = history_queries(session, repo, many_id, strategy)
+            pages = [referrer_page_queries(session, repo, page_size, strategy) for page_size in (10, 400)]
+            constant = small == large and pages[0] == pages[1]
+            ok &= constant
+            print(f"{strategy:16s} history: {small:5d} vs {large:5d} queries, "
+                  f"referrer pages of 10 / 400: {pages[0]} / {pages[1]} queries  {'ok' if constant else 'NOT CONSTANT'}")
+        session.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(make_engine()) else 1)
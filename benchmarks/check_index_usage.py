@@ -0,0 +1,101 @@
+"""
+EXPLAIN-based check that the Repo queries can use the lesson_2 secondary indexes.
+
+Every statement a Repo method sends is EXPLAINed (FORMAT JSON) on the same connection right before
+it runs, with enable_seqscan off so small development tables don't hide a missing index.
+Everything runs in one transaction that is rolled back at the end, so write methods are safe.
+Exits with status 1 if any method's plan misses its expected index. Plans on the partitioned
+orders / orderproducts name the partitions' own indexes; those are mapped back to the index
+declared on the parent table (pg_inherits) before comparing.
+
+Run from the repository root after `alembic upgrade head`:
+    python -m benchmarks.check_index_usage
+"""
+import sys
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import sessionmaker
+
+from db import make_engine
+
+from lesson_3 import Repo
+
+# Repo call -> index that has to show up in at least one of its plans
+EXPECTED = [
+    ('get_all_users', lambda repo: repo.get_all_users(), 'ix_users_username_trgm'),
+    ('get_users_page', lambda repo: repo.get_users_page(), 'ix_users_created_at_telegram_id'),
+    ('get_orders_page', lambda repo: repo.get_orders_page(), 'ix_orders_created_at_order_id'),
+    ('get_orders_page(user_id)', lambda repo: repo.get_orders_page(user_id=1),
+     'ix_orders_user_id_created_at_order_id'),
+    ('get_users_with_orders', lambda repo: repo.get_users_with_orders(), 'ix_orders_user_id_created_at_order_id'),
+    ('select_all_invited_users', lambda repo: repo.select_all_invited_users(), 'ix_users_referrer_id'),
+    ('get_users_with_subqueries', lambda repo: repo.get_users_with_subqueries(), 'ix_users_referrer_id'),
+    ('get_top_products_by_quantity', lambda repo: repo.get_top_products_by_quantity(),
+     'ix_orderproducts_product_id'),
+    ('delete_products_by_price_range', lambda repo: repo.delete_products_by_price_range(10, 20),
+     'ix_products_price'),
+    ('delete_products_by_price_range (order lines)', lambda repo: repo.delete_products_by_price_range(10, 20),
+     'ix_orderproducts_product_id'),
+]
+
+
+def index_names(plan):
+    if isinstance(plan, dict):
+        if 'Index Name' in plan:
+            yield plan['Index Name']
+        for value in plan.values():
+            yield from index_names(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from index_names(value)
+
+
+# Used index name -> the index it was created from on the partitioned parent (itself if not a partition's)
+_PARENT_INDEXES = text("""
+    WITH RECURSIVE up(name, oid) AS (
+        SELECT n.name, to_regclass(quote_ident(n.name))::oid FROM unnest(CAST(:names AS text[])) AS n(name)
+        UNION ALL
+        SELECT up.name, i.inhparent FROM up JOIN pg_inherits i ON i.inhrelid = up.oid
+    )
+    SELECT up.name, c.relname AS parent FROM up JOIN pg_class c ON c.oid = up.oid
+    WHERE NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = up.oid)
+""")
+
+
+def parent_indexes(session, names) -> dict:
+    return {name: parent for name, parent in session.execute(_PARENT_INDEXES, {'names': sorted(names)})}
+
+
+def main(engine) -> bool:
+    plans = []
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement.lstrip().upper().startswith(('EXPLAIN', 'SET', 'SAVEPOINT', 'RELEASE')):
+            return
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        plans.append(cursor.fetchone()[0])
+
+    ok = True
+    with sessionmaker(engine)() as session:
+        repo = Repo(session, autocommit=False)
+        session.execute(text("SET LOCAL enable_seqscan = off"))
+        used_by_call = []
+        for name, call, index in EXPECTED:
+            plans.clear()
+            with session.begin_nested():
+                call(repo)
+            used_by_call.append({used_index for plan in plans for used_index in index_names(plan)})
+        event.remove(engine, 'before_cursor_execute', explain)
+        parents = parent_indexes(session, set().union(*used_by_call))
+        for (name, _, index), used in zip(EXPECTED, used_by_call):
+            used = {parents.get(used_index, used_index) for used_index in used}
+            status = 'ok' if index in used else 'MISSING'
+            ok = ok and index in used
+            print(f"{status:8s} {name:45s} expects {index:40s} used {sorted(used)}")
+        session.rollback()
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(make_engine()) else 1)
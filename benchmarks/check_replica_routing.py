@@ -0,0 +1,76 @@
+"""
+Routing check for RoutingSession (routing.py): which engine serves each Repo call.
+
+Runs against the primary and the replicas from DB_REPLICA_URLS; without replicas the primary URL is
+used a second time as a stand-in replica (one instance under two URLs), which is enough to see the
+routing. Statements are counted per engine with count_queries:
+    - reports (get_monthly_order_summary, get_user_statistics, ...) go to a replica
+    - point lookups and writes go to the primary
+    - after a write the session reads from the primary (read your writes)
+    - with a replica lagging more than max_lag, reports fall back to the primary
+The write is an update of a user that does not exist, rolled back at the end.
+Exits with status 1 if any call is routed to the wrong engine.
+
+Run from the repository root:
+    python -m benchmarks.check_replica_routing
+"""
+import sys
+
+from db import make_engine, make_replica_engines
+from instrumentation import count_queries
+from lesson_3 import Repo
+from routing import ReplicaRouter, make_routing_session_pool
+
+
+def routed_to(router, call) -> str:
+    counters = {}
+    with count_queries(router.primary) as counters['primary']:
+        with count_queries(router.replicas[0]) as counters['replica']:
+            call()
+    return '+'.join(name for name, counter in counters.items() if counter.count) or 'none'
+
+
+def check(router, label, call, expected) -> bool:
+    engine = routed_to(router, call)
+    print(f"{label:45s} {engine:15s} {'ok' if engine == expected else f'expected {expected}'}")
+    return engine == expected
+
+
+def main(router) -> bool:
+    ok = True
+    session_pool = make_routing_session_pool(router)
+    lag = router.replica_lag(router.replicas[0])
+    print(f"replica lag: {'unreachable' if lag is None else f'{lag:.2f} s'}")
+
+    with session_pool() as session:
+        repo = Repo(session, autocommit=False)
+        ok &= check(router, "get_monthly_order_summary", repo.get_monthly_order_summary, 'replica')
+        ok &= check(router, "get_user_statistics", repo.get_user_statistics, 'replica')
+        ok &= check(router, "get_user_by_id (point lookup)", lambda: repo.get_user_by_id(-1), 'primary')
+        ok &= check(router, "update_user_language (write)", lambda: repo.update_user_language(-1, 'en'), 'primary')
+        ok &= check(router, "get_user_statistics after the write", repo.get_user_statistics, 'primary')
+        session.rollback()
+
+    with session_pool() as session:
+        session.stick_to_primary()
+        ok &= check(router, "get_user_statistics after stick_to_primary()", Repo(session).get_user_statistics,
+                    'primary')
+
+    max_lag, router.max_lag = router.max_lag, -1.0  # every replica is now too far behind
+    router._lag.clear()
+    with session_pool() as session:
+        ok &= check(router, "get_user_statistics with a lagging replica", Repo(session).get_user_statistics,
+                    'primary')
+    router.max_lag = max_lag
+    return ok
+
+
+if __name__ == "__main__":
+    primary = make_engine()
+    replicas = make_replica_engines() or [make_engine()]
+    try:
+        passed = main(ReplicaRouter(primary, replicas))
+    finally:
+        for engine in [primary, *replicas]:
+            engine.dispose()
+    sys.exit(0 if passed else 1)
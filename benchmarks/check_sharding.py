@@ -0,0 +1,123 @@
+"""
+Sharding check for ShardedRepo (sharding.py) against the databases in DB_SHARD_URLS (two or more,
+each migrated with `alembic -x url=<shard url> upgrade head`).
+
+Seeds --users users with one order each (ids far above real telegram ids, a product with a
+reserved id on every shard), then checks:
+    - every user is stored on exactly one shard, the one shard_index() names, with its order
+    - get_total_users_count / get_monthly_order_summary grow by exactly the seeded users / revenue
+    - get_top_customers_optimized returns the seeded big spenders in order
+    - transfer_order_ownership works within a shard and is refused across shards
+and times the parallel scatter-gather of get_monthly_order_summary against querying the shards
+one after another. Seeded rows are deleted at the end.
+Exits with status 1 if any check fails.
+
+Run from the repository root:
+    python -m benchmarks.check_sharding --users 100
+"""
+import argparse
+import sys
+import time
+from decimal import Decimal
+
+from sqlalchemy import delete, func, select
+
+from db import make_shard_engines
+from lesson_2 import User, Order, Product
+from sharding import ShardedRepo, make_shard_session_pools
+
+FIRST_ID = 9_000_000_000_000
+PRODUCT_ID = 2_000_000_000
+PRICE = Decimal('1000000')
+
+
+def check(label, passed) -> bool:
+    print(f"{label:70s} {'ok' if passed else 'FAILED'}")
+    return passed
+
+
+def revenue_this_month(sharded):
+    summary = sharded.get_monthly_order_summary()
+    return summary[-1].total_revenue if summary else Decimal(0)
+
+
+def main(sharded, users: int) -> bool:
+    ok = True
+    ids = list(range(FIRST_ID, FIRST_ID + users))
+    users_before = sharded.get_total_users_count()
+    revenue_before = revenue_this_month(sharded)
+
+    sharded.upsert_products([{'product_id': PRODUCT_ID, 'title': 'sharding check', 'description': '',
+                              'price': PRICE}])
+    sharded.bulk_insert_users([{'telegram_id': telegram_id, 'full_name': f'shard check {telegram_id}',
+                                'username': 'shard_check', 'language_code': 'en'} for telegram_id in ids])
+    for quantity, telegram_id in enumerate(ids, start=1):
+        sharded.add_order_with_products(telegram_id, [(PRODUCT_ID, quantity)])
+
+    placement = [[repo.session.scalar(select(func.count()).select_from(User).where(User.telegram_id == telegram_id))
+                  for repo in sharded.shards] for telegram_id in ids]
+    ok &= check("every user is on exactly one shard, the one shard_index() names",
+                all(counts[sharded.shard_index(telegram_id)] == 1 and sum(counts) == 1
+                    for telegram_id, counts in zip(ids, placement)))
+    ok &= check("every order is on its user's shard",
+                all(sharded.shard_for(telegram_id).session.scalar(
+                    select(func.count()).select_from(Order).where(Order.user_id == telegram_id)) == 1
+                    for telegram_id in ids))
+    ok &= check("get_total_users_count grew by the seeded users",
+                sharded.get_total_users_count() == users_before + users)
+    ok &= check("get_monthly_order_summary grew by the seeded revenue",
+                revenue_this_month(sharded) - revenue_before == PRICE * users * (users + 1) // 2)
+    top = [row.telegram_id for row in sharded.get_top_customers_optimized(min(users, 5))]
+    ok &= check("get_top_customers_optimized merges the shards' top customers", top == ids[::-1][:len(top)])
+
+    same_shard = next((telegram_id for telegram_id in ids[1:]
+                       if sharded.shard_index(telegram_id) == sharded.shard_index(ids[0])), None)
+    other_shard = next((telegram_id for telegram_id in ids
+                        if sharded.shard_index(telegram_id) != sharded.shard_index(ids[0])), None)
+    if same_shard is not None:
+        ok &= check("transfer_order_ownership within a shard",
+                    sharded.transfer_order_ownership(ids[0], same_shard) == 1)
+    if other_shard is not None:
+        try:
+            sharded.transfer_order_ownership(ids[0], other_shard)
+        except ValueError:
+            ok &= check("transfer_order_ownership across shards is refused", True)
+        else:
+            ok &= check("transfer_order_ownership across shards is refused", False)
+
+    started = time.perf_counter()
+    sharded.get_monthly_order_summary()
+    parallel = time.perf_counter() - started
+    started = time.perf_counter()
+    for repo in sharded.shards:
+        repo.get_monthly_order_summary()
+    sequential = time.perf_counter() - started
+    print(f"get_monthly_order_summary over {len(sharded.shards)} shards: parallel {parallel * 1000:.1f} ms, "
+          f"one after another {sequential * 1000:.1f} ms")
+    return ok
+
+
+def cleanup(sharded, users: int):
+    for repo in sharded.shards:
+        repo.session.rollback()
+        repo.session.execute(delete(User).where(User.telegram_id.between(FIRST_ID, FIRST_ID + users - 1)))
+        repo.session.execute(delete(Product).where(Product.product_id == PRODUCT_ID))
+        repo.session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+
+    engines = make_shard_engines()
+    if len(engines) < 2:
+        sys.exit("Set DB_SHARD_URLS to two or more databases")
+    with ShardedRepo([session_pool() for session_pool in make_shard_session_pools(engines)]) as sharded:
+        try:
+            passed = main(sharded, args.users)
+        finally:
+            cleanup(sharded, args.users)
+    for engine in engines:
+        engine.dispose()
+    sys.exit(0 if passed else 1)
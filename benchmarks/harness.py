@@ -0,0 +1,285 @@
+"""
+Benchmark harness for every Repo method at several data scales.
+
+For each scale the tables are rebuilt with data_generator (scale = number of order lines), then each
+Repo method runs `--iterations` times. Every call runs inside a SAVEPOINT that is rolled back, so
+writes and deletes see the same data on every iteration. One extra call per method runs under
+tracemalloc to record the peak Python memory it allocates.
+
+Results (p50/p95/p99 latency, throughput, peak memory) are saved as JSON, one file per run,
+and two runs can be compared to catch regressions between commits.
+
+Run from the repository root against a scratch database (the tables are truncated!):
+    python -m benchmarks.harness run --scales 1000 100000 10000000
+    python -m benchmarks.harness run --scales 100000 --no-load --methods get_user_by_id get_all_users
+    python -m benchmarks.harness compare benchmarks/results/a.json benchmarks/results/b.json --threshold 0.2
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from data_generator import DEFAULT_NOW, FIRST_TELEGRAM_ID, GeneratorConfig, generate_dataset, generate_orders
+from db import DatabaseSettings, make_engine
+from lesson_2 import Product, OrderProduct
+from lesson_3 import Repo
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+
+def summaries(repo: Repo) -> Repo:
+    """The same session, analytics read from the summary tables"""
+    return Repo(repo.session, autocommit=False, use_summaries=True)
+
+
+def dtos(repo: Repo) -> Repo:
+    """The same session, user / order lookups return frozen DTOs"""
+    return Repo(repo.session, autocommit=False, result_type='dto')
+
+
+def repo_calls(config: GeneratorConfig):
+    """Every Repo method with arguments that hit existing rows of the generated dataset"""
+    user_id = FIRST_TELEGRAM_ID + config.users // 2
+    other_user_id = FIRST_TELEGRAM_ID + config.users // 3
+    new_users = [{'telegram_id': i, 'full_name': f'Bench {i}', 'username': f'bench{i}', 'language_code': 'en'}
+                 for i in range(1, 101)]
+    new_products = [{'title': f'Bench {i}', 'description': 'benchmark', 'price': i} for i in range(100)]
+    # Order lines carry their order's created_at (the partition key), order 1 is the first generated one
+    first_order_created_at = generate_orders(config, 0, DEFAULT_NOW)[0][0]['created_at']
+    return {
+        # CRUD
+        'add_user': lambda repo: repo.add_user(1, 'Bench User', 'bench', 'en'),
+        'get_user_by_id': lambda repo: repo.get_user_by_id(user_id),
+        'get_user_by_id(dto)': lambda repo: dtos(repo).get_user_by_id(user_id),
+        'get_all_users': lambda repo: repo.get_all_users(),
+        'get_user_language': lambda repo: repo.get_user_language(user_id),
+        'get_users_page': lambda repo: repo.get_users_page(page_size=50),
+        'get_users_page(dto)': lambda repo: dtos(repo).get_users_page(page_size=50),
+        'get_orders_page': lambda repo: repo.get_orders_page(page_size=50, user_id=user_id),
+        'add_order': lambda repo: repo.add_order(user_id),
+        'add_product': lambda repo: repo.add_product('Bench', 'benchmark', 9.99),
+        'add_product_to_order': lambda repo: repo.add_product_to_order(1, 1, 3),
+        'add_order_with_products': lambda repo: repo.add_order_with_products(user_id, [(i, 1) for i in range(1, 21)]),
+        # Joins
+        'select_all_invited_users': lambda repo: repo.select_all_invited_users(),
+        'get_users_with_orders': lambda repo: repo.get_users_with_orders(),
+        'get_order_details_with_products': lambda repo: repo.get_order_details_with_products(),
+        'get_users_with_referral_count': lambda repo: repo.get_users_with_referral_count(),
+        # Eager loading
+        'get_user_order_history': lambda repo: repo.get_user_order_history(user_id),
+        'get_users_page_with_referrers': lambda repo: repo.get_users_page_with_referrers(page_size=50),
+        # Referral tree
+        'get_referral_ancestors': lambda repo: repo.get_referral_ancestors(user_id),
+        'get_referral_descendants': lambda repo: repo.get_referral_descendants(FIRST_TELEGRAM_ID),
+        'get_referral_descendants(closure)':
+            lambda repo: repo.get_referral_descendants(FIRST_TELEGRAM_ID, use_closure=True),
+        'get_referral_subtree': lambda repo: repo.get_referral_subtree(FIRST_TELEGRAM_ID, max_depth=3),
+        'get_top_referrers_by_downline': lambda repo: repo.get_top_referrers_by_downline(),
+        'get_top_referrers_by_downline(closure)':
+            lambda repo: repo.get_top_referrers_by_downline(use_closure=True),
+        # Aggregates
+        'get_total_users_count': lambda repo: repo.get_total_users_count(),
+        'get_total_users_count(exact)': lambda repo: repo.get_total_users_count(mode='exact'),
+        'get_total_users_count(estimated)': lambda repo: repo.get_total_users_count(mode='estimated'),
+        'get_average_order_value': lambda repo: repo.get_average_order_value(),
+        'get_top_products_by_quantity': lambda repo: repo.get_top_products_by_quantity(),
+        'get_user_statistics': lambda repo: repo.get_user_statistics(),
+        'get_monthly_order_summary': lambda repo: repo.get_monthly_order_summary(),
+        'get_monthly_order_summary(3 months)':
+            lambda repo: repo.get_monthly_order_summary(since=DEFAULT_NOW - timedelta(days=90)),
+        'get_top_customers_optimized': lambda repo: repo.get_top_customers_optimized(),
+        # The same aggregates from the trigger-maintained summary tables (see order_stats.py)
+        'get_average_order_value(summaries)': lambda repo: summaries(repo).get_average_order_value(),
+        'get_top_products_by_quantity(summaries)': lambda repo: summaries(repo).get_top_products_by_quantity(),
+        'get_monthly_order_summary(summaries)': lambda repo: summaries(repo).get_monthly_order_summary(),
+        'get_top_customers_optimized(summaries)': lambda repo: summaries(repo).get_top_customers_optimized(),
+        'get_users_with_conditional_data(summaries)':
+            lambda repo: summaries(repo).get_users_with_conditional_data(),
+        'get_database_statistics': lambda repo: repo.get_database_statistics(),
+        'get_database_statistics(exact)': lambda repo: repo.get_database_statistics(mode='exact'),
+        'get_database_statistics(estimated)': lambda repo: repo.get_database_statistics(mode='estimated'),
+        # Advanced queries / window functions
+        'get_users_with_conditional_data': lambda repo: repo.get_users_with_conditional_data(),
+        'get_products_with_window_functions': lambda repo: repo.get_products_with_window_functions(),
+        'get_users_with_subqueries': lambda repo: repo.get_users_with_subqueries(),
+        'get_complex_filtered_data': lambda repo: repo.get_complex_filtered_data(),
+        'execute_raw_sql_query': lambda repo: repo.execute_raw_sql_query('SELECT count(*) FROM orders'),
+        # Streaming variants (server-side cursor)
+        'stream_order_details_with_products': lambda repo: sum(1 for _ in repo.stream_order_details_with_products()),
+        'stream_users_with_conditional_data': lambda repo: sum(1 for _ in repo.stream_users_with_conditional_data()),
+        'stream_products_with_window_functions':
+            lambda repo: sum(1 for _ in repo.stream_products_with_window_functions()),
+        # Updates
+        'update_user_language': lambda repo: repo.update_user_language(user_id, 'uk'),
+        'update_product_price': lambda repo: repo.update_product_price(1, 42),
+        'update_order_quantities': lambda repo: repo.update_order_quantities(1, 2),
+        'conditional_update_users': lambda repo: repo.conditional_update_users(),
+        'transfer_order_ownership': lambda repo: repo.transfer_order_ownership(user_id, other_user_id),
+        # Bulk
+        'bulk_insert_users': lambda repo: repo.bulk_insert_users(new_users),
+        'bulk_insert_products': lambda repo: repo.bulk_insert_products(new_products),
+        'bulk_upsert_users': lambda repo: repo.bulk_upsert_users(new_users),
+        'bulk_upsert(products)': lambda repo: repo.bulk_upsert(Product, [dict(product, product_id=i + 1)
+                                                                         for i, product in enumerate(new_products)]),
+        'bulk_upsert(orderproducts)': lambda repo: repo.bulk_upsert(
+            OrderProduct, [{'order_id': 1, 'product_id': i % 10 + 1, 'quantity': i,
+                            'order_created_at': first_order_created_at} for i in range(100)]),
+        'bulk_copy': lambda repo: repo.bulk_copy({'users': iter(new_users)}, upsert=True),
+        # Deletes
+        'delete_user_by_id': lambda repo: repo.delete_user_by_id(user_id),
+        'delete_products_by_price_range': lambda repo: repo.delete_products_by_price_range(10, 12),
+        'delete_empty_orders': lambda repo: repo.delete_empty_orders(),
+    }
+
+
+def _rows(result):
+    if isinstance(result, (list, tuple)) and len(result) == 2 and isinstance(result[0], list):
+        return len(result[0])  # (items, next_page_token)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def measure(session, repo, call, iterations: int) -> dict:
+    samples = []
+    rows = 0
+    for _ in range(iterations):
+        savepoint = session.begin_nested()
+        started = time.perf_counter()
+        result = call(repo)
+        samples.append(time.perf_counter() - started)
+        rows = _rows(result)
+        savepoint.rollback()
+        session.expunge_all()
+
+    savepoint = session.begin_nested()
+    tracemalloc.start()
+    call(repo)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    savepoint.rollback()
+    session.expunge_all()
+
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = samples[0]
+    return {
+        'iterations': iterations,
+        'rows': rows,
+        'p50_ms': p50 * 1000,
+        'p95_ms': p95 * 1000,
+        'p99_ms': p99 * 1000,
+        'ops_per_sec': len(samples) / sum(samples),
+        'peak_python_memory_kb': peak / 1024,
+    }
+
+
+def load_scale(url: str, scale: int, processes: int) -> GeneratorConfig:
+    config = GeneratorConfig(users=max(100, scale // 10), products=max(100, scale // 100),
+                             order_lines=scale, processes=processes)
+    engine = make_engine(url=url)
+    with engine.begin() as connection:
+        connection.execute(text("TRUNCATE TABLE users, products CASCADE"))
+        connection.execute(text("TRUNCATE TABLE _generator_chunks"))
+
+    generate_dataset(url, config, progress=lambda message: None)
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    engine.dispose()
+    return config
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args, url: str):
+    engine = make_engine(url=url)
+    session_pool = sessionmaker(engine, expire_on_commit=False)
+    report = {'commit': git_commit(), 'started_at': datetime.now(timezone.utc).isoformat(), 'scales': {}}
+
+    for scale in args.scales:
+        if args.no_load:
+            config = GeneratorConfig(users=max(100, scale // 10), products=max(100, scale // 100), order_lines=scale)
+        else:
+            print(f"Loading {scale} order lines...")
+            config = load_scale(url, scale, args.processes)
+
+        calls = repo_calls(config)
+        selected = args.methods or list(calls)
+        results = {}
+        with session_pool() as session:
+            repo = Repo(session, autocommit=False)
+            for name in selected:
+                if name in args.exclude:
+                    continue
+                results[name] = stats = measure(session, repo, calls[name], args.iterations)
+                print(f"{scale:>10} {name:38s} p50 {stats['p50_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms  "
+                      f"p99 {stats['p99_ms']:9.2f} ms  {stats['ops_per_sec']:9.1f} ops/s  "
+                      f"{stats['peak_python_memory_kb']:10.1f} KiB")
+            session.rollback()
+        report['scales'][str(scale)] = results
+
+    engine.dispose()
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{report['commit']}-{int(time.time())}.json"
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Saved {output}")
+
+
+def compare(args) -> int:
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    regressions = 0
+    print(f"{base['commit']} -> {new['commit']} (threshold {args.threshold:.0%} on {args.metric})")
+    for scale, methods in new['scales'].items():
+        for name, stats in methods.items():
+            before = base['scales'].get(scale, {}).get(name)
+            if not before or not before[args.metric]:
+                continue
+            change = stats[args.metric] / before[args.metric] - 1
+            flag = 'REGRESSION' if change > args.threshold else ''
+            regressions += bool(flag)
+            print(f"{scale:>10} {name:38s} {before[args.metric]:9.2f} -> {stats[args.metric]:9.2f} "
+                  f"({change:+.1%}) {flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=[1_000, 100_000, 10_000_000])
+    run_parser.add_argument('--iterations', type=int, default=20)
+    run_parser.add_argument('--processes', type=int, default=4)
+    run_parser.add_argument('--methods', nargs='*')
+    run_parser.add_argument('--exclude', nargs='*', default=[])
+    run_parser.add_argument('--no-load', action='store_true', help='benchmark the data already in the database')
+    run_parser.add_argument('--output')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    compare_parser.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p95_ms', 'p99_ms'])
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        sys.exit(compare(args))
+
+    url = DatabaseSettings.from_env().url().render_as_string(hide_password=False)
+    run(args, url)
@@ -0,0 +1,124 @@
+"""
+Chunked INSERT ... ON CONFLICT DO UPDATE for the lesson_2 tables.
+
+One statement per chunk instead of one for the whole list:
+    - chunks stay under PostgreSQL's limit of 65535 bind parameters per statement
+    - rows are deduplicated on the conflict key inside each chunk (the last occurrence wins), so
+      PostgreSQL never fails with "ON CONFLICT DO UPDATE command cannot affect row a second time"
+    - each chunk is sorted by key, so concurrent upserts lock rows in the same order
+    - with commit_each_chunk=True row locks are only held for one chunk at a time
+    - rows that leave out some columns are upserted separately, so the missing columns keep their
+      defaults on insert and their current values on update instead of becoming NULL
+
+Inserted and updated rows are told apart with RETURNING (xmax = 0), which is true for new rows.
+"""
+import time
+from itertools import islice
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from copy_loader import _resolve_table
+
+MAX_BIND_PARAMETERS = 65535
+
+_inserted = literal_column('(xmax = 0)').label('inserted')
+
+
+class UpsertStats(NamedTuple):
+    table: str
+    rows: int
+    inserted: int
+    updated: int
+    duplicates: int  # rows dropped because a later row in the same chunk had the same key
+    chunks: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def dedupe(rows: Sequence[dict], key: Sequence[str]) -> list:
+    """Last row per key, sorted by key; rows without a full key (e.g. serial ids left out) are kept as is"""
+    latest = {}
+    keyless = []
+    for row in rows:
+        values = tuple(row.get(column) for column in key)
+        if None in values:
+            keyless.append(row)
+        else:
+            latest[values] = row
+    return [latest[values] for values in sorted(latest)] + keyless
+
+
+class ChunkedUpserter:
+    """Upsert rows into the lesson_2 tables through a Session, one statement per chunk"""
+
+    def __init__(self, session, chunk_size: int = 5000, commit_each_chunk: bool = False):
+        self.session = session
+        self.chunk_size = chunk_size
+        self.commit_each_chunk = commit_each_chunk
+
+    def chunk_size_for(self, columns: Sequence[str]) -> int:
+        """Requested chunk size, capped so one statement stays under the bind parameter limit"""
+        return max(1, min(self.chunk_size, MAX_BIND_PARAMETERS // max(len(columns), 1)))
+
+    def _statement(self, table, columns, key, update_columns=None):
+        stmt = pg_insert(table)
+        updates = {column: stmt.excluded[column] for column in columns
+                   if column not in key and (update_columns is None or column in update_columns)}
+        if 'updated_at' in table.c and 'updated_at' not in columns:
+            updates['updated_at'] = func.now()
+        if updates:
+            stmt = stmt.on_conflict_do_update(index_elements=key, set_=updates)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=key)
+        return stmt.returning(_inserted)
+
+    def upsert(self, table, rows: Iterable[dict], key: Optional[Sequence[str]] = None,
+               columns: Optional[Sequence[str]] = None,
+               update_columns: Optional[Sequence[str]] = None) -> UpsertStats:
+        """
+        Upsert dict rows into one table (name, model or Table).
+
+        key defaults to the primary key. With columns given, every row is written with exactly those
+        columns (missing keys are NULL); without, each row is written with its own keys.
+        update_columns limits what a conflict overwrites (default: every written non-key column).
+        """
+        table = _resolve_table(table)
+        key = list(key) if key is not None else [column.name for column in table.primary_key.columns]
+        update_columns = set(update_columns) if update_columns is not None else None
+        # Sized for the widest possible row when the columns vary from row to row
+        chunk_size = self.chunk_size_for(columns if columns is not None else table.c)
+        rows = iter(rows)
+        statements = {}  # written columns -> statement
+        started = time.perf_counter()
+        total = inserted = updated = duplicates = chunks = 0
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            unique = dedupe(chunk, key)
+            groups = {}
+            for row in unique:
+                groups.setdefault(tuple(columns) if columns is not None else tuple(sorted(row)), []).append(row)
+            for group_columns, group in groups.items():
+                stmt = statements.get(group_columns)
+                if stmt is None:
+                    stmt = statements[group_columns] = self._statement(table, group_columns, key, update_columns)
+                result = self.session.execute(stmt.values([{column: row.get(column) for column in group_columns}
+                                                           for row in group]))
+                flags = result.scalars().all()
+                inserted += sum(flags)
+                updated += len(flags) - sum(flags)
+            total += len(chunk)
+            duplicates += len(chunk) - len(unique)
+            chunks += 1
+            if self.commit_each_chunk:
+                self.session.commit()
+
+        return UpsertStats(table.name, total, inserted, updated, duplicates, chunks,
+                           time.perf_counter() - started)
@@ -0,0 +1,166 @@
+"""
+Streaming bulk loader on top of PostgreSQL COPY FROM STDIN.
+
+Rows come from any iterable/generator (dicts or tuples) and are pushed to the server in
+buffers of at most `buffer_bytes`, so memory use does not grow with the size of the import.
+"""
+import io
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import chain
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+from lesson_2 import Base, User, Order, Product, OrderProduct
+
+# Parents before children, so foreign keys are satisfied when loading several tables at once
+LOAD_ORDER = [User.__table__, Product.__table__, Order.__table__, OrderProduct.__table__]
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+class CopyStats(NamedTuple):
+    table: str
+    rows: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _format_value(value) -> str:
+    """Encode one value in COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    return str(value).translate(_ESCAPES)
+
+
+def _resolve_table(table):
+    if isinstance(table, str):
+        return Base.metadata.tables[table]
+    return getattr(table, '__table__', table)
+
+
+class CopyLoader:
+    """COPY rows into the lesson_2 tables through the connection of a Session"""
+
+    def __init__(self, session, buffer_bytes: int = 8 * 1024 * 1024):
+        self.session = session
+        self.buffer_bytes = buffer_bytes
+
+    def _cursor(self):
+        return self.session.connection().connection.dbapi_connection.cursor()
+
+    def _copy(self, cursor, table_name: str, columns: Sequence[str], rows: Iterable) -> int:
+        sql = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN"
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            if isinstance(row, dict):
+                row = [row.get(column) for column in columns]
+            buffer.write('\t'.join(map(_format_value, row)))
+            buffer.write('\n')
+            count += 1
+            if buffer.tell() >= self.buffer_bytes:
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+                buffer = io.StringIO()
+        if buffer.tell():
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+        return count
+
+    def _sync_sequence(self, cursor, table, columns):
+        """COPY bypasses serial defaults, so move the sequence past explicitly loaded ids"""
+        column = table.autoincrement_column
+        if column is not None and column.name in columns:
+            # pg_get_serial_sequence() is NULL for non-serial keys such as users.telegram_id
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column.name}'), "
+                f"GREATEST((SELECT max({column.name}) FROM {table.name}), 1))"
+            )
+
+    def load(self, table, rows: Iterable, columns: Optional[Sequence[str]] = None,
+             upsert: bool = False) -> CopyStats:
+        """
+        Stream rows into one table.
+
+        columns defaults to the keys of the first row for dicts, or every table column for tuples.
+        With upsert=True rows are copied into a temp table and merged with ON CONFLICT DO UPDATE
+        (the last occurrence of a duplicated key wins).
+        """
+        table = _resolve_table(table)
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return CopyStats(table.name, 0, 0.0)
+        if columns is None:
+            columns = list(first) if isinstance(first, dict) else [column.name for column in table.columns]
+        rows = chain([first], rows)
+
+        started = time.perf_counter()
+        cursor = self._cursor()
+        try:
+            if upsert:
+                count = self._copy_and_merge(cursor, table, columns, rows)
+            else:
+                count = self._copy(cursor, table.name, columns, rows)
+            self._sync_sequence(cursor, table, columns)
+        finally:
+            cursor.close()
+        return CopyStats(table.name, count, time.perf_counter() - started)
+
+    def _copy_and_merge(self, cursor, table, columns, rows) -> int:
+        staging = f"_copy_{table.name}"
+        key = [column.name for column in table.primary_key.columns]
+        column_list = ', '.join(columns)
+        updates = [column for column in columns if column not in key]
+
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+        cursor.execute(
+            f"CREATE TEMP TABLE {staging} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.execute(f"ALTER TABLE {staging} ADD COLUMN _copy_seq BIGSERIAL")
+        count = self._copy(cursor, staging, columns, rows)
+
+        on_conflict = (
+            f"DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in updates)}"
+            if updates else "DO NOTHING"
+        )
+        cursor.execute(
+            f"INSERT INTO {table.name} ({column_list}) "
+            f"SELECT DISTINCT ON ({', '.join(key)}) {column_list} FROM {staging} "
+            f"ORDER BY {', '.join(key)}, _copy_seq DESC "
+            f"ON CONFLICT ({', '.join(key)}) {on_conflict}"
+        )
+        cursor.execute(f"DROP TABLE {staging}")
+        return count
+
+    def load_all(self, rows_by_table: dict, upsert: bool = False) -> dict:
+        """Load several tables (keyed by table name or model) in foreign key order"""
+        resolved = {_resolve_table(table): rows for table, rows in rows_by_table.items()}
+        stats = {}
+        for table in LOAD_ORDER:
+            if table in resolved:
+                stats[table.name] = self.load(table, resolved[table], upsert=upsert)
+        return stats
+
+
+if __name__ == "__main__":
+    from db import make_engine, make_session_pool
+
+    session_pool = make_session_pool(make_engine())
+    with session_pool() as session:
+        users = ({'telegram_id': 700_000 + i, 'full_name': f'Copy User {i}', 'username': f'copy{i}',
+                  'language_code': 'en'} for i in range(100_000))
+        stats = CopyLoader(session).load_all({'users': users}, upsert=True)
+        session.commit()
+        for table_stats in stats.values():
+            print(f"{table_stats.table}: {table_stats.rows} rows, {table_stats.rows_per_sec:.0f} rows/s")
@@ -0,0 +1,241 @@
+"""
+Deterministic, parallel, restartable fake dataset generator.
+
+Tables are generated in chunks. Every chunk derives its own RNG seed from (seed, table, chunk),
+so a chunk always produces the same rows no matter which process builds it or when. Chunks are
+COPY-loaded and recorded in `_generator_chunks` (created by the generator chunks migration) in the
+same transaction, so a failed build can simply be started again and only the missing chunks are generated.
+
+    python data_generator.py --users 1000000 --products 50000 --order-lines 10000000 --processes 8
+"""
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from copy_loader import CopyLoader
+from db import DatabaseSettings, make_engine
+
+FIRST_TELEGRAM_ID = 10_000_000
+DEFAULT_NOW = datetime(2026, 1, 1)
+LANGUAGES = ['en', 'uk', 'es', 'fr', 'de', 'pt', 'ru', 'tr', 'ar', 'hi']
+LANGUAGE_WEIGHTS = [40, 12, 10, 8, 7, 6, 6, 4, 4, 3]
+
+
+@dataclass
+class GeneratorConfig:
+    users: int = 10_000
+    products: int = 1_000
+    order_lines: int = 100_000
+    mean_lines_per_order: float = 3.0
+    referral_rate: float = 0.3
+    months: int = 24
+    seed: int = 0
+    chunk_size: int = 50_000
+    processes: int = 4
+
+    def __post_init__(self):
+        if self.mean_lines_per_order < 1:
+            raise ValueError(f"mean_lines_per_order must be at least 1, got {self.mean_lines_per_order}")
+
+    @property
+    def orders(self) -> int:
+        return max(1, round(self.order_lines / self.mean_lines_per_order))
+
+    def chunks(self, rows: int) -> int:
+        return math.ceil(rows / self.chunk_size)
+
+
+def _rng(config: GeneratorConfig, table: str, chunk: int) -> random.Random:
+    return random.Random(f"{config.seed}:{table}:{chunk}")
+
+
+def _faker(config: GeneratorConfig, table: str, chunk: int):
+    from faker import Faker
+
+    fake = Faker()
+    fake.seed_instance(f"{config.seed}:{table}:{chunk}")
+    return fake
+
+
+def _timestamp(rng: random.Random, config: GeneratorConfig, now: datetime) -> datetime:
+    return now - timedelta(seconds=rng.random() * config.months * 30 * 24 * 3600)
+
+
+def _chunk_bounds(config: GeneratorConfig, rows: int, chunk: int):
+    start = chunk * config.chunk_size
+    return start, min(start + config.chunk_size, rows)
+
+
+def generate_users(config: GeneratorConfig, chunk: int, now: datetime):
+    rng = _rng(config, 'users', chunk)
+    fake = _faker(config, 'users', chunk)
+    start, stop = _chunk_bounds(config, config.users, chunk)
+    # Preferential attachment: every user enters the pool once and again for each user they invite,
+    # which gives multi-level referral chains and a heavy tail of "super referrers".
+    # Chains stay inside the chunk, so every chunk can be loaded independently.
+    referrer_pool = []
+    for index in range(start, stop):
+        telegram_id = FIRST_TELEGRAM_ID + index
+        referrer_id = None
+        if referrer_pool and rng.random() < config.referral_rate:
+            referrer_id = rng.choice(referrer_pool)
+            referrer_pool.append(referrer_id)
+        referrer_pool.append(telegram_id)
+        created_at = _timestamp(rng, config, now)
+        yield {
+            'telegram_id': telegram_id,
+            'full_name': fake.name(),
+            'username': fake.user_name() if rng.random() < 0.8 else None,
+            'language_code': rng.choices(LANGUAGES, LANGUAGE_WEIGHTS)[0],
+            'referrer_id': referrer_id,
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+
+def generate_products(config: GeneratorConfig, chunk: int, now: datetime):
+    rng = _rng(config, 'products', chunk)
+    fake = _faker(config, 'products', chunk)
+    start, stop = _chunk_bounds(config, config.products, chunk)
+    for index in range(start, stop):
+        created_at = _timestamp(rng, config, now)
+        yield {
+            'product_id': index + 1,
+            'title': fake.word(),
+            'description': fake.sentence(),
+            'price': round(rng.lognormvariate(3.5, 1.0), 2),
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+
+def _pick_product(rng: random.Random, config: GeneratorConfig) -> int:
+    # Zipf-like popularity: the first ~1% of product ids sell about half of all units.
+    # The Pareto draw starts at 1, so shift it to start at product id 1 and redraw the tail
+    # past the last product instead of piling it onto that id.
+    scale = max(1, config.products // 100)
+    while True:
+        product_id = 1 + int((rng.paretovariate(1.0) - 1) * scale)
+        if product_id <= config.products:
+            return product_id
+
+
+def generate_orders(config: GeneratorConfig, chunk: int, now: datetime):
+    """Orders of one chunk and their order lines"""
+    rng = _rng(config, 'orders', chunk)
+    start, stop = _chunk_bounds(config, config.orders, chunk)
+    orders, lines = [], []
+    for index in range(start, stop):
+        order_id = index + 1
+        created_at = _timestamp(rng, config, now)
+        orders.append({
+            'order_id': order_id,
+            'user_id': FIRST_TELEGRAM_ID + rng.randrange(config.users),
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        # Geometric number of lines (>= 1) with the configured mean
+        if config.mean_lines_per_order == 1:
+            size = 1
+        else:
+            size = 1 + int(math.log(1 - rng.random()) / math.log(1 - 1 / config.mean_lines_per_order))
+        products = {_pick_product(rng, config) for _ in range(size)}
+        for product_id in products:
+            quantity = min(int(rng.paretovariate(2.0)), 20)
+            lines.append({'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                          'order_created_at': created_at})
+    return orders, lines
+
+
+def _ensure_order_partitions(session, config: GeneratorConfig, now: datetime):
+    # Partitioned orders (see partitioning.py) need a partition for every month the orders fall in
+    if session.execute(text("SELECT to_regprocedure('create_order_partitions(date, date)')")).scalar() is None:
+        return
+    session.execute(text("SELECT create_order_partitions(:from_month, :to_month)"), {
+        'from_month': (now - timedelta(days=config.months * 30)).date(), 'to_month': now.date(),
+    })
+    session.commit()
+
+
+def _done_chunks(session, table: str, seed: int) -> set:
+    result = session.execute(
+        text("SELECT chunk FROM _generator_chunks WHERE table_name = :table AND seed = :seed"),
+        {'table': table, 'seed': seed},
+    )
+    return set(result.scalars().all())
+
+
+def load_chunk(url: str, config_data: dict, table: str, chunk: int, now: datetime) -> int:
+    """Generate and COPY one chunk; runs inside a worker process"""
+    config = GeneratorConfig(**config_data)
+    engine = make_engine(url=url, pool_size=1)
+    try:
+        with sessionmaker(engine)() as session:
+            loader = CopyLoader(session)
+            if table == 'users':
+                rows = loader.load('users', generate_users(config, chunk, now)).rows
+            elif table == 'products':
+                rows = loader.load('products', generate_products(config, chunk, now)).rows
+            else:
+                orders, lines = generate_orders(config, chunk, now)
+                rows = loader.load('orders', orders).rows
+                rows += loader.load('orderproducts', lines).rows
+            session.execute(
+                text("INSERT INTO _generator_chunks (table_name, chunk, seed, row_count) "
+                     "VALUES (:table, :chunk, :seed, :rows)"),
+                {'table': table, 'chunk': chunk, 'seed': config.seed, 'rows': rows},
+            )
+            session.commit()
+        return rows
+    finally:
+        engine.dispose()
+
+
+def generate_dataset(url, config: GeneratorConfig, now: datetime = None, progress=print) -> dict:
+    """
+    Build the whole dataset; safe to re-run after a failure (finished chunks are skipped).
+
+    Pass the same `now` when resuming to keep timestamps identical to the first attempt.
+    """
+    url = url if isinstance(url, str) else url.render_as_string(hide_password=False)
+    now = now or DEFAULT_NOW
+    engine = make_engine(url=url)
+    with sessionmaker(engine)() as session:
+        _ensure_order_partitions(session, config, now)
+        done = {table: _done_chunks(session, table, config.seed) for table in ('users', 'products', 'orders')}
+    engine.dispose()
+
+    totals = {}
+    # Phases run one after another because orders reference both users and products
+    with ProcessPoolExecutor(max_workers=config.processes) as pool:
+        for table, rows in (('users', config.users), ('products', config.products), ('orders', config.orders)):
+            pending = [chunk for chunk in range(config.chunks(rows)) if chunk not in done[table]]
+            futures = {pool.submit(load_chunk, url, asdict(config), table, chunk, now): chunk for chunk in pending}
+            totals[table] = 0
+            for future in as_completed(futures):
+                totals[table] += future.result()
+                progress(f"{table}: chunk {futures[future]} done ({totals[table]} rows this run)")
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=GeneratorConfig.users)
+    parser.add_argument('--products', type=int, default=GeneratorConfig.products)
+    parser.add_argument('--order-lines', type=int, default=GeneratorConfig.order_lines)
+    parser.add_argument('--seed', type=int, default=GeneratorConfig.seed)
+    parser.add_argument('--chunk-size', type=int, default=GeneratorConfig.chunk_size)
+    parser.add_argument('--processes', type=int, default=GeneratorConfig.processes)
+    args = parser.parse_args()
+
+    url = DatabaseSettings.from_env().url()
+    config = GeneratorConfig(users=args.users, products=args.products, order_lines=args.order_lines,
+                             seed=args.seed, chunk_size=args.chunk_size, processes=args.processes)
+    print(generate_dataset(url, config))
@@ -0,0 +1,234 @@
+"""
+One place to build engines and sessions, configured from the environment (.env).
+
+Connection:
+    POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB
+Pool / connection tuning (all optional):
+    DB_POOL_SIZE              persistent connections kept in the pool (default 5)
+    DB_MAX_OVERFLOW           extra connections allowed under bursts (default 10)
+    DB_POOL_TIMEOUT           seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE           recycle connections older than this many seconds (default 1800)
+    DB_POOL_PRE_PING          test connections on checkout (default true)
+    DB_POOL_WARMUP            connections opened at startup by warm_up() (default 0)
+    DB_STATEMENT_TIMEOUT_MS   per-connection statement_timeout, 0 = off (default 0)
+    DB_EXECUTEMANY_PAGE_SIZE  rows per psycopg2 execute_batch/execute_values page (default 1000)
+    DB_QUERY_CACHE_SIZE       compiled statements kept per engine by SQLAlchemy (default 500)
+    DB_PREPARED_STATEMENT_CACHE_SIZE
+                              server-side prepared statements per asyncpg connection, 0 = off (default 100);
+                              psycopg2 has no server-side prepare, so the sync engine ignores it
+    DB_ECHO                   log every statement (default false)
+Read replicas (optional, see routing.py):
+    DB_REPLICA_URLS           comma separated SQLAlchemy URLs of read replicas (default none)
+Shards (optional, see sharding.py):
+    DB_SHARD_URLS             comma separated SQLAlchemy URLs of the shards, in shard order (default none)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Barrier, BrokenBarrierError
+
+from sqlalchemy import URL, create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+@dataclass
+class DatabaseSettings:
+    user: str = "testuser"
+    password: str = "testpassword"
+    host: str = "localhost"
+    port: int = 5434
+    database: str = "testdb"
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    pool_warmup: int = 0
+    statement_timeout_ms: int = 0
+    executemany_page_size: int = 1000
+    query_cache_size: int = 500
+    prepared_statement_cache_size: int = 100
+    echo: bool = False
+    replica_urls: list = field(default_factory=list)
+    shard_urls: list = field(default_factory=list)
+
+    @classmethod
+    def from_env(cls, path: str = '.env', **overrides) -> "DatabaseSettings":
+        from environs import Env
+
+        env = Env()
+        env.read_env(path)
+        defaults = cls()
+        settings = cls(
+            user=env.str("POSTGRES_USER", defaults.user),
+            password=env.str("POSTGRES_PASSWORD", defaults.password),
+            host=env.str("POSTGRES_HOST", defaults.host),
+            port=env.int("POSTGRES_PORT", defaults.port),
+            database=env.str("POSTGRES_DB", defaults.database),
+            pool_size=env.int("DB_POOL_SIZE", defaults.pool_size),
+            max_overflow=env.int("DB_MAX_OVERFLOW", defaults.max_overflow),
+            pool_timeout=env.float("DB_POOL_TIMEOUT", defaults.pool_timeout),
+            pool_recycle=env.int("DB_POOL_RECYCLE", defaults.pool_recycle),
+            pool_pre_ping=env.bool("DB_POOL_PRE_PING", defaults.pool_pre_ping),
+            pool_warmup=env.int("DB_POOL_WARMUP", defaults.pool_warmup),
+            statement_timeout_ms=env.int("DB_STATEMENT_TIMEOUT_MS", defaults.statement_timeout_ms),
+            executemany_page_size=env.int("DB_EXECUTEMANY_PAGE_SIZE", defaults.executemany_page_size),
+            query_cache_size=env.int("DB_QUERY_CACHE_SIZE", defaults.query_cache_size),
+            prepared_statement_cache_size=env.int("DB_PREPARED_STATEMENT_CACHE_SIZE",
+                                                  defaults.prepared_statement_cache_size),
+            echo=env.bool("DB_ECHO", defaults.echo),
+            replica_urls=env.list("DB_REPLICA_URLS", defaults.replica_urls),
+            shard_urls=env.list("DB_SHARD_URLS", defaults.shard_urls),
+        )
+        for name, value in overrides.items():
+            setattr(settings, name, value)
+        return settings
+
+    def url(self, drivername: str = "postgresql+psycopg2") -> URL:
+        return URL.create(
+            drivername=drivername,
+            username=self.user,
+            password=self.password,
+            host=self.host,
+            port=self.port,
+            database=self.database,
+        )
+
+
+def make_engine(settings: DatabaseSettings = None, metrics=None, url=None, **engine_kwargs):
+    """Sync (psycopg2) engine with tuned pooling; pass a QueryMetrics to instrument it"""
+    settings = settings or DatabaseSettings.from_env()
+    connect_args = {}
+    if settings.statement_timeout_ms:
+        connect_args["options"] = f"-c statement_timeout={settings.statement_timeout_ms}"
+    options = dict(
+        echo=settings.echo,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_pre_ping=settings.pool_pre_ping,
+        connect_args=connect_args,
+        query_cache_size=settings.query_cache_size,
+        executemany_mode="values_plus_batch",
+        executemany_batch_page_size=settings.executemany_page_size,
+        insertmanyvalues_page_size=settings.executemany_page_size,
+    )
+    options.update(engine_kwargs)
+    if options.get("poolclass") is NullPool:
+        for key in ("pool_size", "max_overflow", "pool_timeout"):
+            options.pop(key)
+    engine = create_engine(url or settings.url(), **options)
+    if metrics is not None:
+        metrics.instrument(engine)
+    return engine
+
+
+def make_async_engine(settings: DatabaseSettings = None, metrics=None, **engine_kwargs):
+    """Async (asyncpg) engine with the same pool settings"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    settings = settings or DatabaseSettings.from_env()
+    connect_args = {"prepared_statement_cache_size": settings.prepared_statement_cache_size}
+    if settings.statement_timeout_ms:
+        connect_args["server_settings"] = {"statement_timeout": str(settings.statement_timeout_ms)}
+    options = dict(
+        echo=settings.echo,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_pre_ping=settings.pool_pre_ping,
+        connect_args=connect_args,
+        query_cache_size=settings.query_cache_size,
+    )
+    options.update(engine_kwargs)
+    engine = create_async_engine(settings.url("postgresql+asyncpg"), **options)
+    if metrics is not None:
+        metrics.instrument(engine)
+    return engine
+
+
+def make_replica_engines(settings: DatabaseSettings = None, metrics=None, **engine_kwargs) -> list:
+    """One engine per DB_REPLICA_URLS entry, pooled like the primary"""
+    settings = settings or DatabaseSettings.from_env()
+    return [make_engine(settings, metrics, url=url, **engine_kwargs) for url in settings.replica_urls]
+
+
+def make_shard_engines(settings: DatabaseSettings = None, metrics=None, **engine_kwargs) -> list:
+    """One engine per DB_SHARD_URLS entry, in shard order"""
+    settings = settings or DatabaseSettings.from_env()
+    return [make_engine(settings, metrics, url=url, **engine_kwargs) for url in settings.shard_urls]
+
+
+def make_session_pool(engine, **kwargs):
+    kwargs.setdefault("expire_on_commit", False)
+    return sessionmaker(engine, **kwargs)
+
+
+def warm_up(engine, connections: int = None, timeout: float = 30.0) -> int:
+    """Open `connections` pooled connections up front (default: the whole pool)"""
+    if not isinstance(engine.pool, QueuePool):  # NullPool / StaticPool have no pool to fill
+        return 0
+    connections = min(connections if connections is not None else engine.pool.size(), engine.pool.size())
+
+    def touch(_):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                # Hold the connection until every worker has one, so the pool really grows
+                barrier.wait()
+        except BaseException:
+            # Release the workers already waiting instead of leaving them blocked for good
+            barrier.abort()
+            raise
+
+    if connections <= 0:
+        return 0
+    barrier = Barrier(connections, timeout=timeout)
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(touch, worker) for worker in range(connections)]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        # The workers released by abort() only saw BrokenBarrierError, raise the failure behind it
+        raise next((error for error in errors if not isinstance(error, BrokenBarrierError)), errors[0])
+    return connections
+
+
+def pool_status(engine, settings: DatabaseSettings = None) -> dict:
+    """Current pool occupancy; saturation is checked out / (size + max overflow of the settings)"""
+    pool = getattr(engine, 'sync_engine', engine).pool
+    if not isinstance(pool, QueuePool):  # NullPool / StaticPool keep no count of their connections
+        return {'size': 0, 'checked_in': 0, 'checked_out': 0, 'overflow': 0, 'saturation': 0.0}
+    settings = settings or DatabaseSettings.from_env()
+    capacity = pool.size() + max(settings.max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': checked_out,
+        'overflow': pool.overflow(),
+        'saturation': checked_out / capacity if capacity else 0.0,
+    }
+
+
+_engine = None
+_session_pool = None
+
+
+def get_engine():
+    """Process-wide engine, created on first use (not at import time)"""
+    global _engine
+    if _engine is None:
+        settings = DatabaseSettings.from_env()
+        _engine = make_engine(settings)
+        if settings.pool_warmup:
+            warm_up(_engine, settings.pool_warmup)
+    return _engine
+
+
+def get_session_pool():
+    global _session_pool
+    if _session_pool is None:
+        _session_pool = make_session_pool(get_engine())
+    return _session_pool
@@ -0,0 +1,369 @@
+"""
+Per-query instrumentation for Repo based on SQLAlchemy engine events.
+
+Every statement is tagged with the Repo method that issued it (see tag_repo_methods), and
+QueryMetrics records latency histograms, row counts, pool checkout wait and a slow-query log.
+Metrics are exported in the Prometheus text exposition format.
+
+    metrics = QueryMetrics(slow_query_threshold=0.5, explain_slow_queries=True)
+    metrics.instrument(engine)
+    ...
+    print(metrics.to_prometheus())
+
+count_queries / assert_query_count count round-trips, e.g. to prove an eager-loading strategy
+issues a constant number of queries.
+
+StatementCacheStats counts how often SQLAlchemy's compiled-statement cache was hit (see
+Repo.get_statement_cache_stats).
+"""
+import functools
+import inspect
+import logging
+import threading
+from contextlib import contextmanager
+import time
+import weakref
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.engine.default import CacheStats
+
+from db import DatabaseSettings, pool_status
+
+slow_query_logger = logging.getLogger('repo.slow_query')
+
+current_repo_method: ContextVar = ContextVar('current_repo_method', default=None)
+
+UNTAGGED = '-'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _tag_iterator(iterator, name):
+    # Re-tag on every step so the consumer's own Repo calls between rows keep their own tag
+    while True:
+        token = current_repo_method.set(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            current_repo_method.reset(token)
+        yield item
+
+
+def _tagged(method):
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if current_repo_method.get() is not None:
+            # Called from another Repo method, keep the outer tag
+            return method(*args, **kwargs)
+        token = current_repo_method.set(name)
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            current_repo_method.reset(token)
+        if inspect.isgenerator(result):
+            return _tag_iterator(result, name)
+        return result
+
+    return wrapper
+
+
+def tag_repo_methods(cls):
+    """Class decorator: statements run by public methods are tagged with the method name"""
+    for name, member in list(vars(cls).items()):
+        if not name.startswith('_') and inspect.isfunction(member):
+            setattr(cls, name, _tagged(member))
+    return cls
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(bind):
+    """Record every statement sent to the database inside the block (bind: Engine or Session)"""
+    if isinstance(bind, Session):
+        bind = bind.get_bind()
+    engine = getattr(bind, 'sync_engine', bind)
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._before_cursor_execute)
+
+
+@contextmanager
+def assert_query_count(bind, expected: int):
+    """Raise AssertionError if the block does not issue exactly `expected` statements"""
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count != expected:
+        statements = '\n\n'.join(counter.statements)
+        raise AssertionError(f"expected {expected} queries, got {counter.count}:\n{statements}")
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[index] += 1
+                break
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile (0 < q <= 1)"""
+        target = q * self.count
+        seen = 0
+        for upper, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return upper
+        return float('inf')
+
+    def prometheus_lines(self, name: str, labels: str = ''):
+        separator = ',' if labels else ''
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels}{separator}le="{upper}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}'
+        suffix = f'{{{labels}}}' if labels else ''
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {self.count}'
+
+
+class QueryMetrics:
+    """Collects statement metrics from one or more engines"""
+
+    def __init__(self, slow_query_threshold: float = 1.0, explain_slow_queries: bool = False,
+                 buckets=DEFAULT_BUCKETS):
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.buckets = buckets
+        self.latency = {}
+        self.rows = {}
+        self.errors = {}
+        self.slow_queries = {}
+        self.checkout_wait = Histogram(buckets)
+        self.connections_opened = 0
+        self._engines = []
+        self._lock = threading.Lock()
+
+    # ---------- wiring ----------
+    def instrument(self, engine):
+        engine = getattr(engine, 'sync_engine', engine)  # AsyncEngine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        event.listen(engine, 'connect', self._on_connect)
+        self._instrument_pool(engine.pool)
+        self._engines.append(engine)
+        return engine
+
+    def _instrument_pool(self, pool):
+        # The pool has no "before checkout" event, so time Pool.connect() itself
+        connect = pool.connect
+
+        @functools.wraps(connect)
+        def timed_connect():
+            started = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.checkout_wait.observe(elapsed)
+
+        pool.connect = timed_connect
+
+    # ---------- event handlers ----------
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        method = current_repo_method.get() or UNTAGGED
+        rowcount = max(cursor.rowcount, 0)
+        with self._lock:
+            self.latency.setdefault(method, Histogram(self.buckets)).observe(elapsed)
+            self.rows[method] = self.rows.get(method, 0) + rowcount
+            if elapsed >= self.slow_query_threshold:
+                self.slow_queries[method] = self.slow_queries.get(method, 0) + 1
+        if elapsed >= self.slow_query_threshold:
+            self._log_slow_query(conn, method, elapsed, rowcount, statement, parameters, executemany)
+
+    def _handle_error(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('query_started'):
+            conn.info['query_started'].pop()
+        method = current_repo_method.get() or UNTAGGED
+        with self._lock:
+            self.errors[method] = self.errors.get(method, 0) + 1
+
+    def _log_slow_query(self, conn, method, elapsed, rowcount, statement, parameters, executemany):
+        plan = None
+        if (self.explain_slow_queries and not executemany
+                and statement.lstrip().upper().startswith(('SELECT', 'WITH'))):
+            # A separate cursor keeps the original result set intact for the caller. EXPLAIN ANALYZE
+            # runs the statement again, so it is always rolled back to the savepoint: a WITH ... INSERT
+            # (add_order_with_products) would otherwise write twice and fire the triggers twice, and a
+            # failing EXPLAIN would abort the caller's transaction. Without a transaction block (AUTOCOMMIT,
+            # e.g. the CONCURRENTLY index migrations) there is no savepoint and no EXPLAIN at all
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                try:
+                    cursor.execute("SAVEPOINT repo_explain")
+                except Exception as e:  # the plan is best effort, never fail the query for it
+                    plan = f"EXPLAIN ANALYZE skipped: {e}"
+                else:
+                    try:
+                        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+                        plan = '\n'.join(row[0] for row in cursor.fetchall())
+                    except Exception as e:
+                        plan = f"EXPLAIN ANALYZE failed: {e}"
+                    finally:
+                        cursor.execute("ROLLBACK TO SAVEPOINT repo_explain")
+                        cursor.execute("RELEASE SAVEPOINT repo_explain")
+            finally:
+                cursor.close()
+        slow_query_logger.warning(
+            "slow query in %s: %.3fs, %d rows\n%s\nparameters: %r%s",
+            method, elapsed, rowcount, statement, parameters, f"\n{plan}" if plan else '',
+        )
+
+    # ---------- export ----------
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                method: {
+                    'count': histogram.count,
+                    'total_seconds': histogram.sum,
+                    'p50': histogram.percentile(0.5),
+                    'p95': histogram.percentile(0.95),
+                    'p99': histogram.percentile(0.99),
+                    'rows': self.rows.get(method, 0),
+                    'slow': self.slow_queries.get(method, 0),
+                    'errors': self.errors.get(method, 0),
+                }
+                for method, histogram in self.latency.items()
+            }
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append('# HELP repo_query_duration_seconds Statement latency by Repo method')
+            lines.append('# TYPE repo_query_duration_seconds histogram')
+            for method, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.prometheus_lines('repo_query_duration_seconds', f'method="{method}"'))
+
+            for metric, help_text, values in (
+                ('repo_query_rows_total', 'Rows returned or affected by Repo method', self.rows),
+                ('repo_slow_queries_total', 'Statements over the slow query threshold', self.slow_queries),
+                ('repo_query_errors_total', 'Statements that raised', self.errors),
+            ):
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} counter')
+                for method, value in sorted(values.items()):
+                    lines.append(f'{metric}{{method="{method}"}} {value}')
+
+            lines.append('# HELP repo_pool_checkout_wait_seconds Time spent waiting for a pooled connection')
+            lines.append('# TYPE repo_pool_checkout_wait_seconds histogram')
+            lines.extend(self.checkout_wait.prometheus_lines('repo_pool_checkout_wait_seconds'))
+            lines.append('# HELP repo_pool_connections_opened_total New DBAPI connections (connection setups)')
+            lines.append('# TYPE repo_pool_connections_opened_total counter')
+            lines.append(f'repo_pool_connections_opened_total {self.connections_opened}')
+
+        settings = DatabaseSettings.from_env()
+        statuses = [(engine.url.render_as_string(), pool_status(engine, settings)) for engine in self._engines]
+        for metric, key, help_text in (
+            ('repo_pool_saturation', 'saturation', 'Checked out connections / (pool size + max overflow)'),
+            ('repo_pool_checked_out', 'checked_out', 'Connections currently checked out'),
+        ):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} gauge')
+            for url, status in statuses:
+                lines.append(f'{metric}{{engine="{url}"}} {status[key]}')
+        return '\n'.join(lines) + '\n'
+
+
+class StatementCacheStats:
+    """Compiled-statement cache outcomes of one engine, by Repo method"""
+
+    def __init__(self, engine):
+        engine = getattr(engine, 'sync_engine', engine)
+        self._engine = weakref.ref(engine)  # the engine's event registry already holds us
+        self.hits = {}
+        self.misses = {}
+        self.uncached = {}  # caching disabled or no cache key (e.g. text() / raw driver SQL)
+        self._lock = threading.Lock()
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        method = current_repo_method.get() or UNTAGGED
+        outcome = context.cache_hit
+        if outcome is CacheStats.CACHE_HIT:
+            counter = self.hits
+        elif outcome is CacheStats.CACHE_MISS:
+            counter = self.misses
+        else:
+            counter = self.uncached
+        with self._lock:
+            counter[method] = counter.get(method, 0) + 1
+
+    def stats(self, method: str = None) -> dict:
+        with self._lock:
+            if method is None:
+                hits, misses, uncached = (sum(counter.values())
+                                          for counter in (self.hits, self.misses, self.uncached))
+            else:
+                hits, misses, uncached = (counter.get(method, 0)
+                                          for counter in (self.hits, self.misses, self.uncached))
+        lookups = hits + misses
+        engine = self._engine()
+        compiled_cache = engine._compiled_cache if engine is not None else None
+        return {
+            'hits': hits,
+            'misses': misses,
+            'uncached': uncached,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'cache_size': len(compiled_cache) if compiled_cache is not None else 0,
+        }
+
+
+_statement_cache_stats = weakref.WeakKeyDictionary()
+
+
+def statement_cache_stats(engine) -> StatementCacheStats:
+    """The engine's StatementCacheStats, attached on first use (counts start from then)"""
+    engine = getattr(engine, 'sync_engine', engine)
+    tracker = _statement_cache_stats.get(engine)
+    if tracker is None:
+        tracker = _statement_cache_stats[engine] = StatementCacheStats(engine)
+    return tracker
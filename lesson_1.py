@@ -1,17 +1,9 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import URL
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 
-url = URL.create(
-    drivername="postgresql+psycopg2",
-    username="testuser",
-    password="testpassword",
-    host="localhost",
-    port=5434,
-    database="testdb",
-)
+from db import make_engine
 
-engine = create_engine(url, echo=True)
+engine = make_engine(echo=True)
 SessionLocal = sessionmaker(bind=engine)
 
 # Create table and insert dummy data
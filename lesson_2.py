@@ -1,10 +1,9 @@
 from typing import Optional, Annotated          # ✅ use typing.Annotated
 from datetime import datetime
 
-from sqlalchemy import BIGINT, Integer, Text, func, ForeignKey, create_engine, DECIMAL
-from sqlalchemy.dialects.mysql import VARCHAR
+from sqlalchemy import (BIGINT, Integer, SmallInteger, Numeric, Text, func, ForeignKey, ForeignKeyConstraint, DECIMAL,
+                        Index, VARCHAR)
 from sqlalchemy.dialects.postgresql import TIMESTAMP
-from sqlalchemy.engine import URL
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, declared_attr, relationship
 
 # ---------- Base / Mixins ----------
@@ -29,6 +28,16 @@ user_fk_cascade  = Annotated[int, mapped_column(BIGINT, ForeignKey("users.telegr
 
 # ---------- Models ----------
 class User(Base, TimestampMixin, TableNameMixin):
+    __table_args__ = (
+        # Keyset pagination over (created_at, telegram_id), also serves ORDER BY created_at
+        Index("ix_users_created_at_telegram_id", "created_at", "telegram_id"),
+        # Referral joins / EXISTS on users.referrer_id
+        Index("ix_users_referrer_id", "referrer_id"),
+        # username ILIKE '%...%' needs trigrams (pg_trgm), a btree can't serve infix matches
+        Index("ix_users_username_trgm", "username", postgresql_using="gin",
+              postgresql_ops={"username": "gin_trgm_ops"}),
+    )
+
     telegram_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
     full_name:   Mapped[str_255]
     username:    Mapped[Optional[str_255]]
@@ -41,31 +50,123 @@ class User(Base, TimestampMixin, TableNameMixin):
         return f"User(id={self.telegram_id}, name='{self.full_name}', username='{self.username}', lang='{self.language_code}')"
 
 class Product(Base, TimestampMixin, TableNameMixin):
+    __table_args__ = (
+        # Price range deletes and price filters
+        Index("ix_products_price", "price"),
+    )
+
     product_id:   Mapped[int_pk]
     title:        Mapped[str_255]
     description:  Mapped[Optional[str]] = mapped_column(VARCHAR(3000))
     price : Mapped[float] = mapped_column(DECIMAL(16, 4), nullable=False)
 
 class Order(Base, TimestampMixin, TableNameMixin):
-    order_id: Mapped[int_pk]
-    user_id:  Mapped[user_fk_cascade]
+    __table_args__ = (
+        # Keyset pagination over (created_at, order_id), globally and per user;
+        # the second one also serves every join on orders.user_id
+        Index("ix_orders_created_at_order_id", "created_at", "order_id"),
+        Index("ix_orders_user_id_created_at_order_id", "user_id", "created_at", "order_id"),
+        # One partition per month (orders_pYYYYMM), see partitioning.py
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # The primary key of a partitioned table has to include the partition key;
+    # order_id alone still comes from the orders_order_id_seq sequence
+    order_id:   Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id:    Mapped[user_fk_cascade]
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, server_default=func.now())
     products: Mapped[list["OrderProduct"]] = relationship("OrderProduct", cascade="all, delete-orphan", passive_deletes=True)
     user:     Mapped["User"] = relationship(back_populates='orders')
 
 class OrderProduct(Base, TableNameMixin):
-    order_id:   Mapped[int] = mapped_column(Integer, ForeignKey("orders.order_id", ondelete="CASCADE"), primary_key=True)
+    __table_args__ = (
+        ForeignKeyConstraint(["order_id", "order_created_at"], ["orders.order_id", "orders.created_at"],
+                             ondelete="CASCADE"),
+        # Joins to products and the ON DELETE RESTRICT check (order_id is covered by the primary key)
+        Index("ix_orderproducts_product_id", "product_id"),
+        # Partitioned like orders, on the order's created_at: a month of orders and its lines go together
+        {"postgresql_partition_by": "RANGE (order_created_at)"},
+    )
+
+    order_id:   Mapped[int] = mapped_column(Integer, primary_key=True)
     product_id: Mapped[int] = mapped_column(Integer, ForeignKey("products.product_id", ondelete="RESTRICT"), primary_key=True)
     quantity:   Mapped[int]
+    order_created_at: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True)
     product:    Mapped["Product"] = relationship("Product", passive_deletes=True)
 
-# ---------- Engine / DDL ----------
-url = URL.create(
-    drivername="postgresql+psycopg2",
-    username="testuser",
-    password="testpassword",
-    host="localhost",
-    port=5434,
-    database="testdb",
-)
-engine = create_engine(url, echo=True)
+class UserReferral(Base, TableNameMixin):
+    """Referral closure table: one row per (ancestor, descendant) pair, including (user, user, 0).
+
+    Maintained by triggers on users (see the referral closure migration), never written by the ORM.
+    """
+    __table_args__ = (
+        # "Whose downline is X in" (ancestors of X); the primary key covers the downline of X
+        Index("ix_userreferrals_descendant_id", "descendant_id"),
+    )
+
+    ancestor_id:   Mapped[int] = mapped_column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True)
+    descendant_id: Mapped[int] = mapped_column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True)
+    depth:         Mapped[int] = mapped_column(Integer, nullable=False)
+
+# ---------- Order summaries ----------
+# Maintained by triggers on orders, orderproducts and products (see the order stats migration),
+# never written by the ORM; order_stats.py checks them against a full recompute.
+# Hot rows (a month, a popular product) are spread over `slot`s, one per backend modulo 8, so
+# concurrent checkouts don't queue on one row lock: read them summed over the slots.
+
+class UserOrderStat(Base, TableNameMixin):
+    """Per-user totals: every order, the orders that have lines, their lines and the spend on them"""
+
+    user_id:           Mapped[int] = mapped_column(BIGINT, ForeignKey("users.telegram_id", ondelete="CASCADE"), primary_key=True)
+    order_count:       Mapped[int] = mapped_column(Integer, nullable=False)
+    orders_with_lines: Mapped[int] = mapped_column(Integer, nullable=False)
+    line_count:        Mapped[int] = mapped_column(BIGINT, nullable=False)
+    total_spent:       Mapped[float] = mapped_column(Numeric, nullable=False)
+
+class ProductOrderStat(Base, TableNameMixin):
+    """Per-product quantity and number of order lines"""
+
+    product_id:     Mapped[int] = mapped_column(Integer, ForeignKey("products.product_id", ondelete="CASCADE"), primary_key=True)
+    slot:           Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    total_quantity: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    line_count:     Mapped[int] = mapped_column(BIGINT, nullable=False)
+
+class MonthlyOrderStat(Base, TableNameMixin):
+    """Per-month (of the order's created_at) number of order lines and revenue"""
+
+    month:      Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True)
+    slot:       Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    line_count: Mapped[int] = mapped_column(BIGINT, nullable=False)
+    revenue:    Mapped[float] = mapped_column(Numeric, nullable=False)
+
+class TableRowCount(Base, TableNameMixin):
+    """Exact row count of a table (summed over the slots), maintained by triggers (see table_stats.py)"""
+
+    table_name: Mapped[str] = mapped_column(VARCHAR(63), primary_key=True)
+    slot:       Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    row_count:  Mapped[int] = mapped_column(BIGINT, nullable=False)
+
+class MutationProgress(Base):
+    """Checkpoint of a running batched UPDATE / DELETE job (see batched_mutations.py)"""
+    __tablename__ = "_mutation_progress"
+
+    job:        Mapped[str] = mapped_column(VARCHAR(255), primary_key=True)
+    last_key:   Mapped[str] = mapped_column(Text, nullable=False)
+    batches:    Mapped[int] = mapped_column(Integer, nullable=False)
+    row_count:  Mapped[int] = mapped_column(BIGINT, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False, server_default=func.now())
+
+class GeneratorChunk(Base):
+    """A chunk of fake data loaded by data_generator.py, so a restarted build skips it"""
+    __tablename__ = "_generator_chunks"
+
+    table_name:  Mapped[str] = mapped_column(VARCHAR(32), primary_key=True)
+    chunk:       Mapped[int] = mapped_column(Integer, primary_key=True)
+    seed:        Mapped[int] = mapped_column(Integer, primary_key=True)
+    row_count:   Mapped[int] = mapped_column(BIGINT, nullable=False)
+    finished_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False, server_default=func.now())
+
+# ---------- Engine ----------
+# Importing the models has no side effects: engines live in db.py and are created on first use
+# (db.get_engine() / db.make_engine()), so alembic and worker processes don't pay for one here.
 
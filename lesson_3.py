@@ -1,12 +1,99 @@
+import base64
+import json
 import random
+from contextlib import contextmanager
+from datetime import datetime
 
-from faker.proxy import Faker
-from sqlalchemy import insert, URL, create_engine, select, or_, join, func, desc, update, delete, and_, case, exists, text
-from sqlalchemy.orm import sessionmaker, aliased
+from sqlalchemy import (insert, select, or_, join, func, desc, update, delete, and_, case, exists, text, tuple_,
+                        bindparam, literal, not_, any_, true, BIGINT, Integer)
+from sqlalchemy.orm import aliased, joinedload, raiseload, selectinload, subqueryload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.postgresql import ARRAY, array, insert as pg_insert
+
+from arrow_export import ArrowExporter, ExportStats
+from batched_mutations import BatchedMutation, MutationStats
+from bulk_upsert import ChunkedUpserter, UpsertStats
+from copy_loader import CopyLoader
+from instrumentation import statement_cache_stats, tag_repo_methods
+from lesson_2 import User, Order, Product, OrderProduct, UserReferral
+from order_stats import (average_order_value_stmt, monthly_order_summary_stmt, top_customers_stmt, top_products_stmt,
+                         users_with_conditional_data_stmt)
+from readonly import ColumnBatch, UserDTO, dto_stmt, selects_entity, to_dtos
+from table_stats import count_rows, table_statistics
+from user_cache import CacheBackend, UserCache, user_from_dict
+
+
+LOADER_STRATEGIES = {
+    'selectin': selectinload,  # one extra SELECT ... WHERE key IN (...) per relationship
+    'joined': joinedload,      # LEFT OUTER JOIN into the same statement
+    'subquery': subqueryload,  # one extra SELECT per relationship, joined to the original query
+    'raise': raiseload,        # load nothing, raise instead of lazy loading on access
+}
+
+
+def loader_option(strategy: str, *path):
+    """Loader option for a relationship path, e.g. loader_option('selectin', User.orders, Order.products)"""
+    try:
+        load = LOADER_STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown loading strategy {strategy!r}, expected one of {sorted(LOADER_STRATEGIES)}") from None
+    option = load(path[0])
+    for attribute in path[1:]:
+        option = getattr(option, load.__name__)(attribute)
+    return option
+
+
+# Hot path statements, built once at import. Calls only bind new parameter values: no statement
+# construction, and the cache key is memoized on the object, so the compiled-cache lookup is cheap too.
+_add_user_stmt = select(User).from_statement(
+    pg_insert(User).values(
+        telegram_id=bindparam('telegram_id'),
+        full_name=bindparam('full_name'),
+        username=bindparam('username'),
+        language_code=bindparam('language_code')
+    ).on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_=dict(full_name=bindparam('full_name'), username=bindparam('username'))
+    ).returning(User)
+)
+_user_by_id_stmt = select(User).where(User.telegram_id == bindparam('telegram_id'))
+_, _user_dto_by_id_stmt = dto_stmt(_user_by_id_stmt)
+_user_language_stmt = select(User.language_code).where(
+    User.telegram_id == bindparam('telegram_id')
+).order_by(User.created_at.desc())
+_add_order_stmt = select(Order).from_statement(
+    insert(Order).values(user_id=bindparam('user_id')).returning(Order)
+)
+_add_product_to_order_stmt = select(OrderProduct).from_statement(
+    pg_insert(OrderProduct).values(
+        order_id=bindparam('order_id'), product_id=bindparam('product_id'), quantity=bindparam('quantity'),
+        # The line is partitioned on its order's created_at
+        order_created_at=select(Order.created_at).where(Order.order_id == bindparam('order_id')).scalar_subquery()
+    ).on_conflict_do_update(
+        index_elements=[OrderProduct.order_id, OrderProduct.product_id, OrderProduct.order_created_at],
+        set_=dict(quantity=bindparam('quantity'))
+    ).returning(OrderProduct)
+)
+
+
+def _build_add_order_with_products_stmt():
+    # One statement: the order insert feeds the order line insert through a data-modifying CTE,
+    # the lines arrive as two parallel arrays unnested server-side
+    new_order = insert(Order).values(user_id=bindparam('user_id')).returning(*Order.__table__.c).cte('new_order')
+    items = func.unnest(
+        bindparam('product_ids', type_=ARRAY(Integer)), bindparam('quantities', type_=ARRAY(Integer))
+    ).table_valued('product_id', 'quantity').render_derived(name='items')
+    lines = insert(OrderProduct).from_select(
+        ['order_id', 'product_id', 'quantity', 'order_created_at'],
+        select(new_order.c.order_id, items.c.product_id, items.c.quantity, new_order.c.created_at)
+        .select_from(new_order).join(items, true())
+    ).cte('lines')
+    return select(Order).from_statement(select(new_order).add_cte(lines))
+
+
+_add_order_with_products_stmt = _build_add_order_with_products_stmt()
 
-from lesson_2 import User, Order, Product, OrderProduct
 
 """
 INSERT INTO users(telegram_id, full_name, username, language_code, created_at)
@@ -14,50 +101,249 @@ VALUES (1, 'Jhon Doe', 'johhny', 'en', '2020-01-01');
 """
 
 
+def _collect_keys(rows, key: str, keys: list):
+    """Pass rows through, appending row[key] of each to keys"""
+    for row in rows:
+        keys.append(row[key])
+        yield row
+
+
+def encode_page_token(created_at: datetime, key: int) -> str:
+    """Opaque continuation token for keyset pagination"""
+    payload = json.dumps([created_at.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_page_token(token: str):
+    try:
+        created_at, key = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(created_at), int(key)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page token: {token!r}") from e
+
+
+@tag_repo_methods
 class Repo:
-    def __init__(self, session):
+    # Reports and listings that may be served by a read replica (see routing.py). Point lookups stay on
+    # the primary: they feed the user cache and usually follow a write in the same request.
+    READ_ONLY_METHODS = frozenset({
+        'get_all_users', 'get_users_page', 'get_orders_page', 'get_user_order_history',
+        'get_users_page_with_referrers', 'select_all_invited_users', 'get_users_with_orders',
+        'get_order_details_with_products', 'get_users_with_referral_count', 'get_referral_ancestors',
+        'get_referral_descendants', 'get_referral_subtree', 'get_top_referrers_by_downline',
+        'get_total_users_count', 'get_average_order_value', 'get_top_products_by_quantity',
+        'get_user_statistics', 'get_monthly_order_summary', 'get_users_with_conditional_data',
+        'get_products_with_window_functions', 'stream_order_details_with_products',
+        'stream_users_with_conditional_data', 'stream_products_with_window_functions',
+        'get_users_with_subqueries', 'get_complex_filtered_data', 'get_database_statistics',
+        'get_top_customers_optimized', 'stream_record_batches', 'export_parquet', 'stream_columns',
+    })
+    # Methods that write; after one, the session reads from the primary (read your writes, see routing.py)
+    WRITE_METHODS = frozenset({
+        'add_user', 'add_order', 'add_product', 'add_product_to_order', 'add_order_with_products',
+        'update_user_language', 'update_product_price', 'update_order_quantities', 'delete_user_by_id',
+        'delete_products_by_price_range', 'delete_empty_orders', 'bulk_insert_users', 'bulk_insert_products',
+        'bulk_upsert_users', 'bulk_upsert', 'bulk_copy', 'conditional_update_users', 'transfer_order_ownership',
+        'execute_raw_sql_query',
+    })
+    RESULT_TYPES = ('orm', 'dto')
+    # Named reports for stream_record_batches / export_parquet (statement builders below)
+    EXPORT_QUERIES = {
+        'order_details': '_order_details_stmt',
+        'monthly_order_summary': '_monthly_order_summary_stmt',
+        'users_with_conditional_data': '_users_with_conditional_data_stmt',
+        'products_with_window_functions': '_products_with_window_functions_stmt',
+    }
+
+    def __init__(self, session, autocommit: bool = True, user_cache: UserCache = None,
+                 use_summaries: bool = False, stats_cache: CacheBackend = None, result_type: str = 'orm'):
+        if result_type not in self.RESULT_TYPES:
+            raise ValueError(f"Unknown result_type {result_type!r}, expected one of {', '.join(self.RESULT_TYPES)}")
         self.session = session
+        self.autocommit = autocommit
+        self.user_cache = user_cache
+        # Row counts for mode='cached' (see table_stats.py), e.g. one LRUTTLCache(ttl=60) per process
+        self.stats_cache = stats_cache
+        # Analytics methods read the trigger-maintained summary tables instead of the full tables (see order_stats.py)
+        self.use_summaries = use_summaries
+        # 'dto': user / order lookups return frozen DTOs (see readonly.py) instead of tracked ORM instances
+        self.result_type = result_type
+        self._transaction_depth = 0
+        self._stale_user_ids = set()
+        self._stale_all_users = False
+        if session.bind is not None:
+            # Start counting now; other sessions (binds= per mapper, bound later) are resolved on first use
+            statement_cache_stats(session.bind)
 
-    def add_user(self, telegram_id: int, full_name: str, username: str, language_code=None):
-        stmt = select(User).from_statement(
-            pg_insert(User).values(
-                telegram_id=telegram_id,
-                full_name=full_name,
-                username=username,
-                language_code=language_code
-            ).on_conflict_do_update(
-                index_elements=[User.telegram_id],
-                set_=dict(full_name=full_name, username=username)
-            ).returning(User)
-        )
-        result = self.session.scalars(stmt).first()
+    # Unit of Work
+    @contextmanager
+    def transaction(self):
+        """Defer commits of all Repo calls in the block to a single commit (nested blocks use SAVEPOINTs)"""
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                with self.session.begin_nested():
+                    yield self
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        self._transaction_depth += 1
+        try:
+            yield self
+            self.session.commit()
+        except BaseException:
+            self.session.rollback()
+            raise
+        finally:
+            self._transaction_depth -= 1
+            self._flush_user_cache()
+
+    def commit(self):
+        """Commit pending work (needed when the Repo was created with autocommit=False)"""
         self.session.commit()
+        self._flush_user_cache()
+
+    def _commit(self):
+        if self.autocommit and not self._transaction_depth:
+            self.session.commit()
+            self._flush_user_cache()
+
+    def _rollback(self):
+        # Inside transaction() the enclosing block decides what to roll back
+        if not self._transaction_depth:
+            self.session.rollback()
+            self._flush_user_cache()
+
+    # User Cache
+    def _invalidate_users(self, telegram_ids=None):
+        """Drop cached users now and again once the transaction ends (None = every user)"""
+        if self.user_cache is None:
+            return
+        if telegram_ids is None:
+            self._stale_all_users = True
+            self.user_cache.clear()
+            return
+        for telegram_id in telegram_ids:
+            self._stale_user_ids.add(telegram_id)
+            self.user_cache.invalidate(telegram_id)
+
+    def _flush_user_cache(self):
+        # A concurrent reader may have re-cached the old row before our commit became visible
+        if self.user_cache is None:
+            return
+        if self._stale_all_users:
+            self.user_cache.clear()
+        for telegram_id in self._stale_user_ids:
+            self.user_cache.invalidate(telegram_id)
+        self._stale_user_ids.clear()
+        self._stale_all_users = False
+
+    def get_cache_stats(self) -> dict:
+        """Hit/miss/eviction counters of the user cache"""
+        return self.user_cache.stats() if self.user_cache is not None else {}
+
+    def get_statement_cache_stats(self, method: str = None) -> dict:
+        """Compiled-statement cache hits/misses of this engine (optionally for one Repo method)"""
+        return statement_cache_stats(self.session.get_bind(User)).stats(method)
+
+    def add_user(self, telegram_id: int, full_name: str, username: str, language_code=None):
+        result = self.session.scalars(_add_user_stmt, dict(
+            telegram_id=telegram_id,
+            full_name=full_name,
+            username=username,
+            language_code=language_code
+        )).first()
+        self._invalidate_users([telegram_id])
+        self._commit()
         return result
 
+    def _entities(self, stmt) -> list:
+        """Result of a select(Model): ORM instances, or with result_type='dto' frozen DTOs outside the identity map"""
+        if self.result_type == 'dto':
+            dto, stmt = dto_stmt(stmt)
+            return to_dtos(dto, self.session.execute(stmt))
+        return self.session.execute(stmt).scalars().all()
+
     def get_user_by_id(self, telegram_id: int) -> User:
-        stmt = select(User).where(User.telegram_id == telegram_id)
-        result = self.session.execute(stmt)
-        return result.scalars().first()
+        dtos = self.result_type == 'dto'
+        if self.user_cache is not None:
+            data = self.user_cache.get(telegram_id)
+            if data is not None:
+                return UserDTO(**data) if dtos else user_from_dict(self.session, data)
+        if dtos:
+            row = self.session.execute(_user_dto_by_id_stmt, dict(telegram_id=telegram_id)).first()
+            user = UserDTO(*row) if row is not None else None
+        else:
+            result = self.session.execute(_user_by_id_stmt, dict(telegram_id=telegram_id))
+            user = result.scalars().first()
+        # Only committed rows: inside transaction() or with autocommit=False the row may be our own uncommitted write
+        if user is not None and self.user_cache is not None and self.autocommit and not self._transaction_depth:
+            self.user_cache.set(user)
+        return user
 
     def get_all_users(self):
         stmt = select(User).where(or_(User.language_code == 'en', User.language_code == "uk"),
                                   User.username.ilike("%john%"),
                                   User.telegram_id > 0).order_by(User.created_at.desc()).limit(10)
+        return self._entities(stmt)
+
+    # Keyset Pagination
+    def _keyset_page(self, stmt, created_at_column, key_column, page_size: int, page_token: str = None):
+        # Newest first; (created_at, key) is unique, so the page boundary never skips or repeats rows
+        if page_token is not None:
+            created_at, key = decode_page_token(page_token)
+            stmt = stmt.where(tuple_(created_at_column, key_column) < tuple_(created_at, key))
+        stmt = stmt.order_by(created_at_column.desc(), key_column.desc()).limit(page_size + 1)
+        items = self._entities(stmt)
+        if len(items) <= page_size:
+            return items, None
+        items = items[:page_size]
+        last = items[-1]
+        return items, encode_page_token(last.created_at, getattr(last, key_column.key))
+
+    def get_users_page(self, page_size: int = 10, page_token: str = None,
+                       language_codes: list = None, username_contains: str = None):
+        """Page through users by (created_at, telegram_id), returns (users, next_page_token or None)"""
+        stmt = select(User).where(User.telegram_id > 0)
+        if language_codes:
+            stmt = stmt.where(User.language_code.in_(language_codes))
+        if username_contains:
+            stmt = stmt.where(User.username.icontains(username_contains, autoescape=True))
+        return self._keyset_page(stmt, User.created_at, User.telegram_id, page_size, page_token)
+
+    def get_orders_page(self, page_size: int = 10, page_token: str = None, user_id: int = None):
+        """Page through orders by (created_at, order_id), returns (orders, next_page_token or None)"""
+        stmt = select(Order)
+        if user_id is not None:
+            stmt = stmt.where(Order.user_id == user_id)
+        return self._keyset_page(stmt, Order.created_at, Order.order_id, page_size, page_token)
+
+    # Eager Loading
+    def get_user_order_history(self, telegram_id: int, strategy: str = 'selectin') -> User:
+        """User with orders -> order lines -> products loaded up front, so rendering it runs no more queries"""
+        stmt = select(User).where(User.telegram_id == telegram_id).options(
+            loader_option(strategy, User.orders, Order.products, OrderProduct.product)
+        )
         result = self.session.execute(stmt)
-        return result.scalars().all()
+        # joined eager loading of collections repeats the user row once per order line
+        return result.unique().scalars().first()
+
+    def get_users_page_with_referrers(self, page_size: int = 10, page_token: str = None,
+                                      strategy: str = 'selectin'):
+        """Keyset page of users (see get_users_page) with User.referrer loaded up front"""
+        stmt = select(User).where(User.telegram_id > 0).options(loader_option(strategy, User.referrer))
+        return self._keyset_page(stmt, User.created_at, User.telegram_id, page_size, page_token)
 
     def get_user_language(self, telegram_id: int) -> str:
-        stmt = select(User.language_code).where(User.telegram_id == telegram_id).order_by(User.created_at.desc())
-        result = self.session.execute(stmt)
+        if self.user_cache is not None:
+            user = self.get_user_by_id(telegram_id)
+            return user.language_code if user is not None else None
+        result = self.session.execute(_user_language_stmt, dict(telegram_id=telegram_id))
         return result.scalars().first()
     def add_order(self,user_id:int):
-        stmt = select(Order).from_statement(
-            insert(Order).values(
-               user_id=user_id
-            ).returning(Order)
-        )
-        result = self.session.scalars(stmt).first()
-        self.session.commit()
+        result = self.session.scalars(_add_order_stmt, dict(user_id=user_id)).first()
+        self._commit()
         return result
 
     def add_product(self,title,description,price):
@@ -67,20 +353,39 @@ class Repo:
             ).returning(Product)
         )
         result = self.session.scalars(stmt).first()
-        self.session.commit()
+        self._commit()
         return result
     def add_product_to_order(self, order_id, product_id, quantity):
-        stmt = select(OrderProduct).from_statement(
-            pg_insert(OrderProduct).values(
-                order_id=order_id,product_id=product_id,quantity=quantity
-            ).on_conflict_do_update(
-                index_elements=[OrderProduct.order_id, OrderProduct.product_id],
-                set_=dict(quantity=quantity)
-            ).returning(OrderProduct)
-        )
-        result = self.session.scalars(stmt).first()
-        self.session.commit()
+        result = self.session.scalars(
+            _add_product_to_order_stmt, dict(order_id=order_id, product_id=product_id, quantity=quantity)
+        ).first()
+        self._commit()
         return result
+
+    def add_order_with_products(self, user_id: int, items) -> Order:
+        """
+        Create an order with all its lines in one statement and one commit.
+
+        items: iterable of (product_id, quantity); a product listed twice gets the summed quantity.
+        Returns the Order with Order.products (and their products, lazily) ready to use.
+        """
+        quantities = {}
+        for product_id, quantity in items:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        order = self.session.scalars(_add_order_with_products_stmt, dict(
+            user_id=user_id, product_ids=list(quantities), quantities=list(quantities.values())
+        )).one()
+        # The lines were written exactly as sent, so attach them without reading them back
+        lines = []
+        for product_id, quantity in quantities.items():
+            line = OrderProduct(order_id=order.order_id, product_id=product_id, quantity=quantity,
+                                order_created_at=order.created_at)
+            make_transient_to_detached(line)
+            lines.append(self.session.merge(line, load=False))
+        set_committed_value(order, 'products', lines)
+        self._commit()
+        return order
+
     def select_all_invited_users(self):
         ParentUser = aliased(User)
         ReferralUser = aliased(User)
@@ -100,9 +405,9 @@ class Repo:
         result = self.session.execute(stmt)
         return result.all()
 
-    def get_order_details_with_products(self):
-        """Get order details with product information using multiple JOINs"""
-        stmt = select(
+    @staticmethod
+    def _order_details_stmt():
+        return select(
             User.full_name.label('customer_name'),
             Order.order_id,
             Product.title.label('product_name'),
@@ -113,7 +418,10 @@ class Repo:
                       OrderProduct, Order.order_id == OrderProduct.order_id),
                  Product, OrderProduct.product_id == Product.product_id)
         )
-        result = self.session.execute(stmt)
+
+    def get_order_details_with_products(self):
+        """Get order details with product information using multiple JOINs"""
+        result = self.session.execute(self._order_details_stmt())
         return result.all()
 
     def get_users_with_referral_count(self):
@@ -130,15 +438,109 @@ class Repo:
         result = self.session.execute(stmt)
         return result.all()
 
+    # Referral Tree
+    @staticmethod
+    def _referral_tree_cte(start, max_depth: int = None, upwards: bool = False):
+        """Recursive CTE walking the referral tree down from (or up from) the users matching `start`.
+
+        Rows are (telegram_id, full_name, referrer_id, depth, path), where path holds the ids from the
+        starting user to the row; it also stops the walk if the data contains a referral cycle.
+        """
+        tree = select(
+            User.telegram_id, User.full_name, User.referrer_id,
+            literal(0).label('depth'),
+            array([User.telegram_id], type_=BIGINT).label('path')
+        ).where(start).cte('referral_tree', recursive=True)
+        link = User.telegram_id == tree.c.referrer_id if upwards else User.referrer_id == tree.c.telegram_id
+        step = select(
+            User.telegram_id, User.full_name, User.referrer_id,
+            tree.c.depth + 1,
+            func.array_append(tree.c.path, User.telegram_id, type_=ARRAY(BIGINT))
+        ).join(tree, link).where(not_(User.telegram_id == any_(tree.c.path)))
+        if max_depth is not None:
+            step = step.where(tree.c.depth < max_depth)
+        return tree.union_all(step)
+
+    def get_referral_ancestors(self, telegram_id: int, max_depth: int = None):
+        """Referral chain above a user in one query, nearest first: (telegram_id, full_name, depth)"""
+        tree = self._referral_tree_cte(User.telegram_id == telegram_id, max_depth, upwards=True)
+        stmt = select(tree.c.telegram_id, tree.c.full_name, tree.c.depth).where(
+            tree.c.depth > 0
+        ).order_by(tree.c.depth)
+        result = self.session.execute(stmt)
+        return result.all()
+
+    def get_referral_descendants(self, telegram_id: int, max_depth: int = None, use_closure: bool = False):
+        """Whole downline of a user (or max_depth levels of it): (telegram_id, full_name, referrer_id, depth).
+
+        use_closure=True reads the trigger-maintained userreferrals table instead of recursing.
+        """
+        if use_closure:
+            stmt = select(
+                User.telegram_id, User.full_name, User.referrer_id, UserReferral.depth
+            ).join(UserReferral, UserReferral.descendant_id == User.telegram_id).where(
+                UserReferral.ancestor_id == telegram_id, UserReferral.depth > 0
+            ).order_by(UserReferral.depth, User.telegram_id)
+            if max_depth is not None:
+                stmt = stmt.where(UserReferral.depth <= max_depth)
+        else:
+            tree = self._referral_tree_cte(User.telegram_id == telegram_id, max_depth)
+            stmt = select(tree.c.telegram_id, tree.c.full_name, tree.c.referrer_id, tree.c.depth).where(
+                tree.c.depth > 0
+            ).order_by(tree.c.depth, tree.c.telegram_id)
+        result = self.session.execute(stmt)
+        return result.all()
+
+    def get_referral_subtree(self, telegram_id: int, max_depth: int = None):
+        """A user and max_depth levels of their downline, each with the size of its own downline
+        within that subtree: (telegram_id, full_name, referrer_id, depth, downline_count)"""
+        tree = self._referral_tree_cte(User.telegram_id == telegram_id, max_depth)
+        # Every row counts once for each user on its path, itself included
+        memberships = select(func.unnest(tree.c.path).label('ancestor_id')).subquery()
+        downlines = select(
+            memberships.c.ancestor_id, (func.count() - 1).label('downline_count')
+        ).group_by(memberships.c.ancestor_id).subquery()
+        stmt = select(
+            tree.c.telegram_id, tree.c.full_name, tree.c.referrer_id, tree.c.depth, downlines.c.downline_count
+        ).join(downlines, downlines.c.ancestor_id == tree.c.telegram_id).order_by(tree.c.depth, tree.c.telegram_id)
+        result = self.session.execute(stmt)
+        return result.all()
+
+    def get_top_referrers_by_downline(self, limit: int = 10, use_closure: bool = False):
+        """Users with the largest total downline (all levels): (telegram_id, full_name, downline_count).
+
+        use_closure=True aggregates the userreferrals table instead of walking every referral tree.
+        """
+        if use_closure:
+            downlines = select(
+                UserReferral.ancestor_id, func.count().label('downline_count')
+            ).where(UserReferral.depth > 0).group_by(UserReferral.ancestor_id)
+        else:
+            Referred = aliased(User)
+            tree = self._referral_tree_cte(exists().where(Referred.referrer_id == User.telegram_id))
+            downlines = select(
+                tree.c.path[1].label('ancestor_id'), (func.count() - 1).label('downline_count')
+            ).group_by('ancestor_id')
+        downlines = downlines.order_by(desc('downline_count')).limit(limit).subquery()
+        stmt = select(User.telegram_id, User.full_name, downlines.c.downline_count).join(
+            downlines, downlines.c.ancestor_id == User.telegram_id
+        ).order_by(downlines.c.downline_count.desc(), User.telegram_id)
+        result = self.session.execute(stmt)
+        return result.all()
+
     # Aggregated Queries
-    def get_total_users_count(self):
-        """Get total number of users"""
+    def get_total_users_count(self, mode: str = 'count'):
+        """Get total number of users (mode: 'count', 'exact', 'estimated' or 'cached', see table_stats.py)"""
+        if mode != 'count':
+            return count_rows(self.session, ('users',), mode, self.stats_cache)['users']
         stmt = select(func.count(User.telegram_id))
         result = self.session.execute(stmt)
         return result.scalar()
 
     def get_average_order_value(self):
         """Get average order value across all orders"""
+        if self.use_summaries:
+            return self.session.execute(average_order_value_stmt()).scalar()
         stmt = select(func.avg(Product.price * OrderProduct.quantity)).select_from(
             join(OrderProduct, Product, OrderProduct.product_id == Product.product_id)
         )
@@ -147,6 +549,8 @@ class Repo:
 
     def get_top_products_by_quantity(self, limit=5):
         """Get top products by total quantity ordered"""
+        if self.use_summaries:
+            return self.session.execute(top_products_stmt(limit)).all()
         stmt = select(
             Product.title,
             func.sum(OrderProduct.quantity).label('total_quantity')
@@ -166,17 +570,35 @@ class Repo:
         result = self.session.execute(stmt)
         return result.all()
 
-    def get_monthly_order_summary(self):
-        """Get monthly order summary with aggregations"""
+    @staticmethod
+    def _monthly_order_summary_stmt(since: datetime = None, until: datetime = None):
         stmt = select(
             func.date_trunc('month', Order.created_at).label('month'),
             func.count(Order.order_id).label('order_count'),
             func.sum(Product.price * OrderProduct.quantity).label('total_revenue')
         ).select_from(
-            join(join(Order, OrderProduct, Order.order_id == OrderProduct.order_id),
+            # Joining on the partition key as well lets both tables prune and join partition by partition
+            join(join(Order, OrderProduct, and_(Order.order_id == OrderProduct.order_id,
+                                                Order.created_at == OrderProduct.order_created_at)),
                  Product, OrderProduct.product_id == Product.product_id)
         ).group_by(func.date_trunc('month', Order.created_at)).order_by('month')
-        result = self.session.execute(stmt)
+        if since is not None:
+            stmt = stmt.where(Order.created_at >= since, OrderProduct.order_created_at >= since)
+        if until is not None:
+            stmt = stmt.where(Order.created_at < until, OrderProduct.order_created_at < until)
+        return stmt
+
+    def get_monthly_order_summary(self, since: datetime = None, until: datetime = None):
+        """
+        Get monthly order summary with aggregations
+
+        since / until bound orders.created_at (until excluded); only the monthly partitions of
+        orders and orderproducts in that range are scanned. With use_summaries they have to be
+        the first of a month.
+        """
+        if self.use_summaries:
+            return self.session.execute(monthly_order_summary_stmt(since, until)).all()
+        result = self.session.execute(self._monthly_order_summary_stmt(since, until))
         return result.all()
 
     # Update Queries with ORM
@@ -184,35 +606,71 @@ class Repo:
         """Update user language by telegram_id"""
         stmt = update(User).where(User.telegram_id == telegram_id).values(language_code=new_language)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._invalidate_users([telegram_id])
+        self._commit()
         return result.rowcount
 
     def update_product_price(self, product_id: int, new_price: float):
         """Update product price"""
         stmt = update(Product).where(Product.product_id == product_id).values(price=new_price)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._commit()
         return result.rowcount
 
-    def update_order_quantities(self, order_id: int, quantity_multiplier: float):
-        """Update all product quantities in an order"""
+    def update_order_quantities(self, order_id: int, quantity_multiplier: float,
+                                batch_size: int = None, sleep: float = 0.0, progress=None):
+        """Update all product quantities in an order (batch_size: see _run_batched)"""
+        values = dict(quantity=OrderProduct.quantity * quantity_multiplier)
+        if batch_size:
+            return self._run_batched(f"update_order_quantities:{order_id}:{quantity_multiplier}",
+                                     OrderProduct, OrderProduct.order_id == order_id, values,
+                                     batch_size, sleep, progress).rows
         stmt = update(OrderProduct).where(
             OrderProduct.order_id == order_id
-        ).values(quantity=OrderProduct.quantity * quantity_multiplier)
+        ).values(values)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._commit()
         return result.rowcount
 
+    # Batched Mutations
+    def _run_batched(self, job: str, model, where, values=None, batch_size: int = 1000,
+                     sleep: float = 0.0, progress=None) -> MutationStats:
+        """
+        Run an UPDATE/DELETE as committed, primary-key-ordered batches of batch_size rows
+        (see batched_mutations), pausing `sleep` seconds between batches. progress(MutationStats)
+        is called after every batch. An interrupted job resumes when the same call is made again.
+        """
+        if self._transaction_depth:
+            raise ValueError("Batched mutations commit every batch and cannot run inside Repo.transaction()")
+        if not self.autocommit:
+            # The first batch's commit would also commit whatever the caller has pending
+            raise ValueError("Batched mutations commit every batch and cannot run on a Repo(autocommit=False)")
+        runner = BatchedMutation(self.session, batch_size=batch_size, sleep=sleep, progress=progress)
+        return runner.run(job, model, where, values)
+
     # Delete Queries with ORM
     def delete_user_by_id(self, telegram_id: int):
         """Delete user by telegram_id"""
+        referred = []
+        if self.user_cache is not None:
+            # ON DELETE SET NULL rewrites the referrer_id of everyone they invited, drop those rows too
+            referred = self.session.scalars(select(User.telegram_id).where(User.referrer_id == telegram_id)).all()
         stmt = delete(User).where(User.telegram_id == telegram_id)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._invalidate_users([telegram_id, *referred])
+        self._commit()
         return result.rowcount
 
-    def delete_products_by_price_range(self, min_price: float, max_price: float):
-        """Delete products within price range (handles foreign key constraints)"""
+    def delete_products_by_price_range(self, min_price: float, max_price: float,
+                                       batch_size: int = None, sleep: float = 0.0, progress=None):
+        """Delete products within price range (handles foreign key constraints; batch_size: see _run_batched)"""
+        if batch_size:
+            in_range = and_(Product.price >= min_price, Product.price <= max_price)
+            job = f"delete_products_by_price_range:{min_price}:{max_price}"
+            self._run_batched(f"{job}:orderproducts", OrderProduct,
+                              OrderProduct.product_id.in_(select(Product.product_id).where(in_range)),
+                              None, batch_size, sleep, progress)
+            return self._run_batched(job, Product, in_range, None, batch_size, sleep, progress).rows
         try:
             # First delete related OrderProduct records
             product_ids_subquery = select(Product.product_id).where(
@@ -229,19 +687,23 @@ class Repo:
                 and_(Product.price >= min_price, Product.price <= max_price)
             )
             result = self.session.execute(stmt)
-            self.session.commit()
+            self._commit()
             return result.rowcount
             
         except SQLAlchemyError as e:
-            self.session.rollback()
+            self._rollback()
             raise e
 
-    def delete_empty_orders(self):
-        """Delete orders with no products"""
-        subquery = select(OrderProduct.order_id).distinct()
-        stmt = delete(Order).where(~Order.order_id.in_(subquery))
+    def delete_empty_orders(self, batch_size: int = None, sleep: float = 0.0, progress=None):
+        """Delete orders with no products (batch_size: see _run_batched)"""
+        # Anti-join: NOT EXISTS probes orderproducts' primary key per order, where NOT IN had to
+        # hash every order line (and matches nothing at all once the subquery yields a NULL)
+        empty = ~exists().where(OrderProduct.order_id == Order.order_id)
+        if batch_size:
+            return self._run_batched("delete_empty_orders", Order, empty, None, batch_size, sleep, progress).rows
+        stmt = delete(Order).where(empty)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._commit()
         return result.rowcount
 
     # Bulk Insert Operations with ORM
@@ -249,34 +711,59 @@ class Repo:
         """Bulk insert multiple users"""
         stmt = insert(User).values(users_data)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._commit()
         return result.rowcount
 
     def bulk_insert_products(self, products_data: list):
         """Bulk insert multiple products"""
         stmt = insert(Product).values(products_data)
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._commit()
         return result.rowcount
 
     def bulk_upsert_users(self, users_data: list):
         """Bulk upsert users (insert or update on conflict)"""
-        stmt = pg_insert(User).values(users_data).on_conflict_do_update(
-            index_elements=[User.telegram_id],
-            set_=dict(
-                full_name=pg_insert(User).excluded.full_name,
-                username=pg_insert(User).excluded.username,
-                language_code=pg_insert(User).excluded.language_code
-            )
-        )
-        result = self.session.execute(stmt)
-        self.session.commit()
-        return result.rowcount
+        # A conflict only refreshes the profile fields, never referrer_id or created_at
+        stats = self.bulk_upsert(User, users_data, update_columns=['full_name', 'username', 'language_code'])
+        return stats.inserted + stats.updated
+
+    def bulk_upsert(self, model, rows, chunk_size: int = 5000, commit_each_chunk: bool = False,
+                    update_columns: list = None) -> UpsertStats:
+        """
+        Chunked upsert of dict rows into User, Product or OrderProduct (on the primary key).
+
+        Duplicated keys within a chunk are collapsed (last row wins) and chunks are capped to the
+        bind parameter limit. A conflict overwrites update_columns (default: every non-key column
+        of the row). commit_each_chunk=True commits after every chunk, so locks are held
+        for one chunk only; a failure then leaves the earlier chunks committed.
+        Returns UpsertStats with inserted vs updated counts.
+        """
+        if commit_each_chunk and self._transaction_depth:
+            raise ValueError("commit_each_chunk cannot be used inside Repo.transaction()")
+        telegram_ids = []
+        if model is User:
+            rows = _collect_keys(rows, 'telegram_id', telegram_ids)  # for cache invalidation
+        upserter = ChunkedUpserter(self.session, chunk_size=chunk_size, commit_each_chunk=commit_each_chunk)
+        try:
+            stats = upserter.upsert(model, rows, update_columns=update_columns)
+        finally:
+            if model is User:
+                self._invalidate_users(telegram_ids)
+        self._commit()
+        return stats
+
+    def bulk_copy(self, rows_by_table: dict, upsert: bool = False, buffer_bytes: int = 8 * 1024 * 1024):
+        """Stream rows (any iterable of dicts/tuples) through COPY FROM STDIN, returns CopyStats per table"""
+        stats = CopyLoader(self.session, buffer_bytes=buffer_bytes).load_all(rows_by_table, upsert=upsert)
+        if upsert and 'users' in stats:
+            self._invalidate_users()
+        self._commit()
+        return stats
 
     # Advanced Query Operations
-    def get_users_with_conditional_data(self):
-        """Get users with conditional fields using CASE statements"""
-        stmt = select(
+    @staticmethod
+    def _users_with_conditional_data_stmt():
+        return select(
             User.full_name,
             User.language_code,
             case(
@@ -287,21 +774,82 @@ class Repo:
             func.coalesce(func.sum(Product.price * OrderProduct.quantity), 0).label('total_spent')
         ).outerjoin(Order).outerjoin(OrderProduct).outerjoin(Product
         ).group_by(User.telegram_id, User.full_name, User.language_code)
-        result = self.session.execute(stmt)
+
+    def get_users_with_conditional_data(self):
+        """Get users with conditional fields using CASE statements"""
+        if self.use_summaries:
+            return self.session.execute(users_with_conditional_data_stmt()).all()
+        result = self.session.execute(self._users_with_conditional_data_stmt())
         return result.all()
 
-    def get_products_with_window_functions(self):
-        """Get products with ranking and running totals using window functions"""
-        stmt = select(
+    @staticmethod
+    def _products_with_window_functions_stmt():
+        return select(
             Product.title,
             Product.price,
             func.rank().over(order_by=desc(Product.price)).label('price_rank'),
             func.sum(Product.price).over(order_by=Product.product_id).label('running_total'),
             func.avg(Product.price).over().label('avg_price')
         ).order_by(desc(Product.price))
-        result = self.session.execute(stmt)
+
+    def get_products_with_window_functions(self):
+        """Get products with ranking and running totals using window functions"""
+        result = self.session.execute(self._products_with_window_functions_stmt())
         return result.all()
 
+    # Streaming (server-side cursor) variants for large reports
+    def _stream(self, stmt, batch_size: int, partitions: bool):
+        # yield_per opens a server-side cursor (stream_results) and buffers batch_size rows at a time
+        result = self.session.execute(stmt, execution_options={'yield_per': batch_size})
+        try:
+            if partitions:
+                yield from result.partitions()
+            else:
+                yield from result
+        finally:
+            result.close()
+
+    def stream_order_details_with_products(self, batch_size: int = 1000, partitions: bool = False):
+        """Stream get_order_details_with_products rows (or lists of batch_size rows) without loading them all"""
+        return self._stream(self._order_details_stmt(), batch_size, partitions)
+
+    def stream_users_with_conditional_data(self, batch_size: int = 1000, partitions: bool = False):
+        """Stream get_users_with_conditional_data rows (or lists of batch_size rows)"""
+        return self._stream(self._users_with_conditional_data_stmt(), batch_size, partitions)
+
+    def stream_products_with_window_functions(self, batch_size: int = 1000, partitions: bool = False):
+        """Stream get_products_with_window_functions rows (or lists of batch_size rows)"""
+        return self._stream(self._products_with_window_functions_stmt(), batch_size, partitions)
+
+    # Arrow / Parquet export (see arrow_export.py, needs pyarrow)
+    def _export_stmt(self, query, query_args: dict):
+        if not isinstance(query, str):
+            return query
+        if query not in self.EXPORT_QUERIES:
+            raise ValueError(f"Unknown export query {query!r}, expected a select or one of {', '.join(self.EXPORT_QUERIES)}")
+        if query == 'monthly_order_summary' and self.use_summaries:
+            return monthly_order_summary_stmt(**query_args)
+        return getattr(self, self.EXPORT_QUERIES[query])(**query_args)
+
+    def stream_record_batches(self, query, batch_size: int = 50_000, **query_args):
+        """Stream a select (or a named report of EXPORT_QUERIES) as pyarrow RecordBatches of batch_size rows"""
+        return ArrowExporter(self.session, batch_size).record_batches(self._export_stmt(query, query_args))
+
+    def export_parquet(self, query, path: str, partition_by=(), batch_size: int = 50_000, max_open_files: int = 64,
+                       **query_args) -> ExportStats:
+        """Write a select (or a named report of EXPORT_QUERIES) to a Parquet dataset under path, in bounded memory"""
+        return ArrowExporter(self.session, batch_size).write_parquet(
+            self._export_stmt(query, query_args), path, partition_by=partition_by, max_open_files=max_open_files)
+
+    def stream_columns(self, query, batch_size: int = 50_000):
+        """Stream a select (or every row of a model) as readonly.ColumnBatch objects of batch_size rows"""
+        if isinstance(query, type):
+            query = select(query)
+        if selects_entity(query):
+            _, query = dto_stmt(query)
+        return (ColumnBatch.from_rows(query.selected_columns, rows)
+                for rows in self._stream(query, batch_size, partitions=True))
+
     def get_users_with_subqueries(self):
         """Get users using EXISTS and subqueries"""
         has_orders = exists().where(Order.user_id == User.telegram_id)
@@ -335,8 +883,21 @@ class Repo:
         return result.all()
 
     # Advanced Update Operations
-    def conditional_update_users(self):
-        """Update users based on complex conditions"""
+    def conditional_update_users(self, batch_size: int = None, sleep: float = 0.0, progress=None):
+        """Update users based on complex conditions (batch_size: see _run_batched)"""
+        if batch_size:
+            # Correlated per user, so each batch only sums the orders of its own users
+            spent = select(func.sum(Product.price * OrderProduct.quantity)).select_from(
+                join(join(Order, OrderProduct, Order.order_id == OrderProduct.order_id),
+                     Product, OrderProduct.product_id == Product.product_id)
+            ).where(Order.user_id == User.telegram_id).scalar_subquery()
+            try:
+                stats = self._run_batched("conditional_update_users", User, spent > 10000,
+                                          dict(language_code='premium'), batch_size, sleep, progress)
+            finally:
+                self._invalidate_users()
+                self._flush_user_cache()
+            return stats.rows
         subquery = select(Order.user_id).join(OrderProduct).join(Product).group_by(
             Order.user_id
         ).having(func.sum(Product.price * OrderProduct.quantity) > 10000)
@@ -346,7 +907,8 @@ class Repo:
         ).values(language_code='premium')
         
         result = self.session.execute(stmt)
-        self.session.commit()
+        self._invalidate_users()
+        self._commit()
         return result.rowcount
 
     # Transaction Management
@@ -369,11 +931,11 @@ class Repo:
             ).values(user_id=to_user_id)
             
             result = self.session.execute(stmt)
-            self.session.commit()
+            self._commit()
             return result.rowcount
             
         except SQLAlchemyError as e:
-            self.session.rollback()
+            self._rollback()
             raise e
 
     # Raw SQL Operations
@@ -382,29 +944,19 @@ class Repo:
         result = self.session.execute(text(sql_query))
         return result.fetchall()
 
-    def get_database_statistics(self):
-        """Get database statistics using raw SQL"""
-        stats_query = """
-        SELECT 
-            'users' as table_name, COUNT(*) as record_count 
-        FROM users
-        UNION ALL
-        SELECT 
-            'orders' as table_name, COUNT(*) as record_count 
-        FROM orders
-        UNION ALL
-        SELECT 
-            'products' as table_name, COUNT(*) as record_count 
-        FROM products
-        UNION ALL
-        SELECT 
-            'orderproducts' as table_name, COUNT(*) as record_count 
-        FROM orderproducts
+    def get_database_statistics(self, mode: str = 'count'):
         """
-        return self.execute_raw_sql_query(stats_query)
+        Get row counts, dead tuples and table / index sizes of the main tables (TableStatistics)
+
+        mode picks where record_count comes from: 'count' (COUNT(*) scans), 'exact' (trigger-maintained
+        counters), 'estimated' (planner statistics) or 'cached' (COUNT(*) kept in stats_cache).
+        """
+        return table_statistics(self.session, mode=mode, cache=self.stats_cache)
 
     def get_top_customers_optimized(self, limit: int = 10):
         """Optimized query for top customers by order value"""
+        if self.use_summaries:
+            return self.session.execute(top_customers_stmt(limit)).all()
         stmt = select(
             User.full_name,
             User.telegram_id,
@@ -419,89 +971,81 @@ class Repo:
 
 
 def seed_fake_data(repo):
-    # Clear existing data
-    from sqlalchemy import text
-    repo.session.execute(text('TRUNCATE TABLE users CASCADE'))
-    repo.session.commit()
+    # Faker is only needed for seeding, keep it out of the import path of Repo
+    from faker import Faker
+
+    # One unit of work instead of a commit per row
+    with repo.transaction():
+        # Clear existing data
+        from sqlalchemy import text
+        repo.session.execute(text('TRUNCATE TABLE users CASCADE'))
     
-    Faker.seed(0)
-    fake = Faker()
-    users = []
-    orders = []
-    products = []
+        Faker.seed(0)
+        fake = Faker()
+        users = []
+        orders = []
+        products = []
     
-    # Generate unique telegram_ids
-    used_ids = set()
+        # Generate unique telegram_ids
+        used_ids = set()
     
-    # Create initial users without referrers
-    for i in range(5):
-        telegram_id = 1000 + i  # Use sequential IDs to avoid duplicates
-        user = repo.add_user(
-            telegram_id=telegram_id,
-            full_name=fake.name(),
-            username=fake.user_name(),
-            language_code=fake.language_code()
-        )
-        users.append(user)
-        used_ids.add(telegram_id)
+        # Create initial users without referrers
+        for i in range(5):
+            telegram_id = 1000 + i  # Use sequential IDs to avoid duplicates
+            user = repo.add_user(
+                telegram_id=telegram_id,
+                full_name=fake.name(),
+                username=fake.user_name(),
+                language_code=fake.language_code()
+            )
+            users.append(user)
+            used_ids.add(telegram_id)
     
-    # Create users with referrers
-    for i in range(5):
-        telegram_id = 2000 + i  # Use different range for referred users
-        referrer = random.choice(users)
-        user_data = {
-            'telegram_id': telegram_id,
-            'full_name': fake.name(),
-            'username': fake.user_name(),
-            'language_code': fake.language_code(),
-            'referrer_id': referrer.telegram_id
-        }
-        # Insert user with referrer using raw insert
-        from sqlalchemy import insert
-        stmt = insert(User).values(**user_data).returning(User)
-        result = repo.session.execute(stmt)
-        user = result.scalars().first()
-        repo.session.commit()
-        users.append(user)
-        used_ids.add(telegram_id)
-    for _ in range(10):
-        order = repo.add_order(
-            user_id=random.choice(users).telegram_id
-        )
-        orders.append(order)
-    for _ in range(10):
-        product = repo.add_product(
-            title=fake.word(),
-            description=fake.sentence(),
-            price=fake.pyint()
-        )
-        products.append(product)
-    for _ in range(10):
-        repo.add_product_to_order(
-            order_id=random.choice(orders).order_id,
-            product_id=random.choice(products).product_id,
-            quantity=fake.pyint(min_value=1, max_value=5)
-        )
+        # Create users with referrers
+        for i in range(5):
+            telegram_id = 2000 + i  # Use different range for referred users
+            referrer = random.choice(users)
+            user_data = {
+                'telegram_id': telegram_id,
+                'full_name': fake.name(),
+                'username': fake.user_name(),
+                'language_code': fake.language_code(),
+                'referrer_id': referrer.telegram_id
+            }
+            # Insert user with referrer using raw insert
+            from sqlalchemy import insert
+            stmt = insert(User).values(**user_data).returning(User)
+            result = repo.session.execute(stmt)
+            user = result.scalars().first()
+            users.append(user)
+            used_ids.add(telegram_id)
+        for _ in range(10):
+            order = repo.add_order(
+                user_id=random.choice(users).telegram_id
+            )
+            orders.append(order)
+        for _ in range(10):
+            product = repo.add_product(
+                title=fake.word(),
+                description=fake.sentence(),
+                price=fake.pyint()
+            )
+            products.append(product)
+        for _ in range(10):
+            repo.add_product_to_order(
+                order_id=random.choice(orders).order_id,
+                product_id=random.choice(products).product_id,
+                quantity=fake.pyint(min_value=1, max_value=5)
+            )
     
     return users, orders, products
 
 
 if __name__ == "__main__":
-    from environs import Env
-
-    env = Env()
-    env.read_env('.env')
-
-    url = URL.create(
-        drivername="postgresql+psycopg2",
-        username=env.str("POSTGRES_USER"),
-        password=env.str("POSTGRES_PASSWORD"),
-        host=env.str("POSTGRES_HOST"),
-        port=env.str("POSTGRES_PORT"),
-        database=env.str("POSTGRES_DB"),
-    )
-    engine = create_engine(url)
-    session = sessionmaker(engine,expire_on_commit=False)
+    from db import make_engine, make_session_pool
+
+    engine = make_engine()
+    session = make_session_pool(engine)
     with session() as session:
         repo = Repo(session)
         users, orders, products = seed_fake_data(repo)
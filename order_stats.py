@@ -0,0 +1,223 @@
+"""
+Order summary tables (userorderstats, productorderstats, monthlyorderstats, see the order stats
+migration) and the analytics queries that read them.
+
+Triggers keep the tables up to date on every write to orders, orderproducts and products, so
+Repo(session, use_summaries=True) answers get_monthly_order_summary, get_top_customers_optimized,
+get_top_products_by_quantity, get_users_with_conditional_data and get_average_order_value from a
+few small rows instead of joining the full tables. The results are the same as the live queries:
+    - a month's order_count counts its order lines, as the joined live query does
+    - customer_type counts max(1, lines) per order, the rows of the live outer join
+    - revenue and spend use the current product prices
+Summaries only have whole months, so since / until have to be the first of a month.
+
+check_order_stats compares the tables with a full recompute, rebuild_order_stats recomputes them:
+    python order_stats.py            # exit status 1 on a mismatch
+    python order_stats.py --rebuild
+"""
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import case, desc, func, or_, select, text
+
+from lesson_2 import User, Order, Product, OrderProduct, UserOrderStat, ProductOrderStat, MonthlyOrderStat
+
+
+class OrderStatsMismatch(NamedTuple):
+    table: str
+    key: object
+    expected: tuple  # (column, ...) of the full recompute, None when the key should not exist
+    actual: tuple  # (column, ...) of the summary table, None when the key is missing
+
+
+def _check_month(name: str, value):
+    if value is not None and (value.day != 1 or (isinstance(value, datetime) and value != value.replace(
+            hour=0, minute=0, second=0, microsecond=0))):
+        raise ValueError(f"Summaries are monthly, {name} must be the first of a month: {value}")
+
+
+# Queries on the summary tables, used by Repo when use_summaries=True
+def monthly_order_summary_stmt(since: datetime = None, until: datetime = None):
+    _check_month('since', since)
+    _check_month('until', until)
+    stmt = select(
+        MonthlyOrderStat.month,
+        func.sum(MonthlyOrderStat.line_count).label('order_count'),
+        func.sum(MonthlyOrderStat.revenue).label('total_revenue')
+    ).group_by(MonthlyOrderStat.month).having(func.sum(MonthlyOrderStat.line_count) > 0
+    ).order_by(MonthlyOrderStat.month)
+    if since is not None:
+        stmt = stmt.where(MonthlyOrderStat.month >= since)
+    if until is not None:
+        stmt = stmt.where(MonthlyOrderStat.month < until)
+    return stmt
+
+
+def top_customers_stmt(limit: int):
+    return select(
+        User.full_name,
+        User.telegram_id,
+        UserOrderStat.total_spent,
+        UserOrderStat.orders_with_lines.label('order_count')
+    ).join(UserOrderStat, UserOrderStat.user_id == User.telegram_id
+    ).where(UserOrderStat.line_count > 0
+    ).order_by(desc(UserOrderStat.total_spent)).limit(limit)
+
+
+def top_products_stmt(limit: int):
+    quantities = select(
+        ProductOrderStat.product_id,
+        func.sum(ProductOrderStat.total_quantity).label('total_quantity')
+    ).group_by(ProductOrderStat.product_id).having(func.sum(ProductOrderStat.line_count) > 0).subquery()
+    return select(
+        Product.title, quantities.c.total_quantity
+    ).join(quantities, quantities.c.product_id == Product.product_id
+    ).order_by(desc(quantities.c.total_quantity)).limit(limit)
+
+
+def users_with_conditional_data_stmt():
+    # Rows of the live User -> Order -> OrderProduct outer join: one per line, one per order without lines
+    rows = func.coalesce(
+        UserOrderStat.line_count + UserOrderStat.order_count - UserOrderStat.orders_with_lines, 0)
+    return select(
+        User.full_name,
+        User.language_code,
+        case(
+            (rows > 2, 'VIP'),
+            (rows > 0, 'Regular'),
+            else_='New'
+        ).label('customer_type'),
+        func.coalesce(UserOrderStat.total_spent, 0).label('total_spent')
+    ).outerjoin(UserOrderStat, UserOrderStat.user_id == User.telegram_id)
+
+
+def average_order_value_stmt():
+    return select(func.sum(MonthlyOrderStat.revenue) / func.nullif(func.sum(MonthlyOrderStat.line_count), 0))
+
+
+# Full recompute, the same definitions as refresh_order_stats() in the migration
+def _expected_user_stats():
+    per_order = select(
+        Order.user_id,
+        func.count(OrderProduct.order_id).label('lines'),
+        func.coalesce(func.sum(OrderProduct.quantity * Product.price), 0).label('spent')
+    ).outerjoin(OrderProduct, (OrderProduct.order_id == Order.order_id)
+                & (OrderProduct.order_created_at == Order.created_at)
+    ).outerjoin(Product, Product.product_id == OrderProduct.product_id
+    ).group_by(Order.user_id, Order.order_id, Order.created_at).subquery()
+    return select(
+        per_order.c.user_id.label('key'),
+        func.count().label('order_count'),
+        func.count().filter(per_order.c.lines > 0).label('orders_with_lines'),
+        func.sum(per_order.c.lines).label('line_count'),
+        func.sum(per_order.c.spent).label('total_spent')
+    ).group_by(per_order.c.user_id).subquery()
+
+
+def _actual_user_stats():
+    return select(
+        UserOrderStat.user_id.label('key'),
+        UserOrderStat.order_count,
+        UserOrderStat.orders_with_lines,
+        UserOrderStat.line_count,
+        UserOrderStat.total_spent
+    ).subquery()
+
+
+def _expected_product_stats():
+    return select(
+        OrderProduct.product_id.label('key'),
+        func.sum(OrderProduct.quantity).label('total_quantity'),
+        func.count().label('line_count')
+    ).group_by(OrderProduct.product_id).subquery()
+
+
+def _actual_product_stats():
+    return select(
+        ProductOrderStat.product_id.label('key'),
+        func.sum(ProductOrderStat.total_quantity).label('total_quantity'),
+        func.sum(ProductOrderStat.line_count).label('line_count')
+    ).group_by(ProductOrderStat.product_id).subquery()
+
+
+def _expected_monthly_stats():
+    month = func.date_trunc('month', OrderProduct.order_created_at)
+    return select(
+        month.label('key'),
+        func.count().label('line_count'),
+        func.sum(OrderProduct.quantity * Product.price).label('revenue')
+    ).join(Product, Product.product_id == OrderProduct.product_id).group_by(month).subquery()
+
+
+def _actual_monthly_stats():
+    return select(
+        MonthlyOrderStat.month.label('key'),
+        func.sum(MonthlyOrderStat.line_count).label('line_count'),
+        func.sum(MonthlyOrderStat.revenue).label('revenue')
+    ).group_by(MonthlyOrderStat.month).subquery()
+
+
+SUMMARIES = {
+    'userorderstats': (_expected_user_stats, _actual_user_stats),
+    'productorderstats': (_expected_product_stats, _actual_product_stats),
+    'monthlyorderstats': (_expected_monthly_stats, _actual_monthly_stats),
+}
+
+
+def _mismatches(session, table: str, expected, actual) -> list:
+    columns = [column.name for column in expected.c if column.name != 'key']
+    # All-zero summary rows (e.g. a user whose orders were all deleted) equal a missing row
+    differs = [func.coalesce(expected.c[name], 0) != func.coalesce(actual.c[name], 0) for name in columns]
+    stmt = select(
+        func.coalesce(expected.c.key, actual.c.key).label('key'),
+        (expected.c.key.is_not(None)).label('has_expected'),
+        (actual.c.key.is_not(None)).label('has_actual'),
+        *[expected.c[name].label(f'expected_{name}') for name in columns],
+        *[actual.c[name].label(f'actual_{name}') for name in columns],
+    ).select_from(expected.join(actual, expected.c.key == actual.c.key, full=True)
+    ).where(or_(*differs)
+    ).order_by('key')
+    mismatches = []
+    for row in session.execute(stmt).mappings():
+        mismatches.append(OrderStatsMismatch(
+            table, row['key'],
+            tuple(row[f'expected_{name}'] for name in columns) if row['has_expected'] else None,
+            tuple(row[f'actual_{name}'] for name in columns) if row['has_actual'] else None,
+        ))
+    return mismatches
+
+
+def check_order_stats(session) -> list:
+    """Compare every summary table with a full recompute, returns the OrderStatsMismatches (empty when consistent)"""
+    mismatches = []
+    for table, (expected, actual) in SUMMARIES.items():
+        mismatches.extend(_mismatches(session, table, expected(), actual()))
+    return mismatches
+
+
+def rebuild_order_stats(session):
+    """Recompute every summary table from orders, orderproducts and products"""
+    session.execute(text("SELECT refresh_order_stats()"))
+    session.commit()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import make_engine, make_session_pool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help="recompute the summary tables after checking them")
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with make_session_pool(engine)() as session:
+        mismatches = check_order_stats(session)
+        for mismatch in mismatches:
+            print(f"{mismatch.table} {mismatch.key}: expected {mismatch.expected}, found {mismatch.actual}")
+        print(f"{len(mismatches)} mismatched summary rows")
+        if args.rebuild:
+            rebuild_order_stats(session)
+            print("summary tables rebuilt")
+    engine.dispose()
+    raise SystemExit(1 if mismatches and not args.rebuild else 0)
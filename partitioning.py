@@ -0,0 +1,140 @@
+"""
+Monthly partitions of orders and orderproducts (see the orders monthly partitions migration).
+
+Both tables have one partition per calendar month, orders_pYYYYMM and orderproducts_pYYYYMM,
+so a month of orders and its lines are created and removed together:
+    - ensure_order_partitions creates the current month and `months_ahead` future months; run it
+      daily (python partitioning.py from cron, or SELECT ensure_order_partitions(3) from pg_cron)
+    - drop_order_partitions removes every month that ended before a cutoff with DETACH + DROP,
+      which costs the same for one row or millions and leaves no dead tuples behind
+      (detach_only=True keeps the detached tables, e.g. to archive them)
+Reports bounded on orders.created_at, e.g. Repo.get_monthly_order_summary(since=...), only scan
+the partitions of the requested months.
+
+    python partitioning.py --months-ahead 3 --retain-months 24
+"""
+from datetime import date
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+
+_PARTITIONS_QUERY = text("""
+    SELECT child.relname AS name, child.reltuples::bigint AS estimated_rows,
+           pg_total_relation_size(child.oid) AS total_bytes
+    FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = to_regclass('orders')
+    ORDER BY child.relname
+""")
+
+_FOREIGN_KEYS_QUERY = text("""
+    SELECT conname FROM pg_constraint
+    WHERE contype = 'f' AND conrelid = to_regclass(:table) AND confrelid = to_regclass('orders')
+""")
+
+
+class OrderPartition(NamedTuple):
+    month: date
+    name: str
+    estimated_rows: int  # planner estimate (pg_class.reltuples), -1 before the first ANALYZE
+    total_bytes: int
+
+
+def partition_suffix(month: date) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def _month(name: str) -> Optional[date]:
+    suffix = name.rpartition('_')[2]
+    if len(suffix) != 7 or not suffix.startswith('p') or not suffix[1:].isdigit():
+        return None
+    return date(int(suffix[1:5]), int(suffix[5:7]), 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def order_partitions(session) -> list:
+    """Monthly partitions of orders, oldest first"""
+    partitions = []
+    for row in session.execute(_PARTITIONS_QUERY):
+        month = _month(row.name)
+        if month is not None:
+            partitions.append(OrderPartition(month, row.name, row.estimated_rows, row.total_bytes))
+    return partitions
+
+
+def ensure_order_partitions(session, months_ahead: int = 3) -> int:
+    """Create missing partitions up to `months_ahead` months from now, returns how many months were created"""
+    created = session.execute(text("SELECT ensure_order_partitions(:months_ahead)"),
+                              {'months_ahead': months_ahead}).scalar()
+    session.commit()
+    return created
+
+
+def create_order_partitions(session, from_month: date, to_month: date) -> int:
+    """Create missing partitions for every month from `from_month` to `to_month` (e.g. before a backfill)"""
+    created = session.execute(text("SELECT create_order_partitions(:from_month, :to_month)"),
+                              {'from_month': from_month, 'to_month': to_month}).scalar()
+    session.commit()
+    return created
+
+
+def drop_order_partitions(session, older_than: date, detach_only: bool = False) -> list:
+    """
+    Remove the months that ended on or before `older_than`; returns the removed OrderPartitions.
+
+    The lines are detached first (the orders partition is still referenced by them until then),
+    all in one transaction. With detach_only=True the tables stay as standalone tables without
+    their foreign keys to orders.
+    """
+    removed = [partition for partition in order_partitions(session)
+               if add_months(partition.month, 1) <= older_than]
+    # Dropping a partition fires no triggers: take its rows off the summary tables and row counts first
+    forget_stats, forget_counts = session.execute(text(
+        "SELECT to_regprocedure('order_stats_forget(timestamp, timestamp)') IS NOT NULL,"
+        " to_regprocedure('table_row_counts_forget(text, regclass)') IS NOT NULL")).one()
+    for partition in removed:
+        lines = f"orderproducts_{partition_suffix(partition.month)}"
+        if forget_stats:
+            session.execute(text("SELECT order_stats_forget(:from_ts, :to_ts)"),
+                            {'from_ts': partition.month, 'to_ts': add_months(partition.month, 1)})
+        if forget_counts:
+            for table, relation in (('orderproducts', lines), ('orders', partition.name)):
+                session.execute(text("SELECT table_row_counts_forget(:table, CAST(:relation AS regclass))"),
+                                {'table': table, 'relation': relation})
+        session.execute(text(f"ALTER TABLE orderproducts DETACH PARTITION {lines}"))
+        if detach_only:
+            for name in session.execute(_FOREIGN_KEYS_QUERY, {'table': lines}).scalars().all():
+                session.execute(text(f'ALTER TABLE {lines} DROP CONSTRAINT "{name}"'))
+        else:
+            session.execute(text(f"DROP TABLE {lines}"))
+        session.execute(text(f"ALTER TABLE orders DETACH PARTITION {partition.name}"))
+        if not detach_only:
+            session.execute(text(f"DROP TABLE {partition.name}"))
+    session.commit()
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import make_engine, make_session_pool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--retain-months', type=int, default=None,
+                        help="drop the months that ended more than this many months ago (default: keep all)")
+    parser.add_argument('--detach-only', action='store_true')
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with make_session_pool(engine)() as session:
+        print(f"created {ensure_order_partitions(session, args.months_ahead)} monthly partitions")
+        if args.retain_months is not None:
+            cutoff = add_months(date.today().replace(day=1), -args.retain_months)
+            removed = drop_order_partitions(session, cutoff, detach_only=args.detach_only)
+            print(f"{'detached' if args.detach_only else 'dropped'} {len(removed)} months before {cutoff}: "
+                  f"{', '.join(partition.name for partition in removed) or '-'}")
+    engine.dispose()
@@ -0,0 +1,129 @@
+"""
+Lightweight results for read-only queries, instead of ORM instances.
+
+An ORM instance carries instrumentation state and sits in the Session's identity map until the
+session is closed. Read-heavy handlers only need the values:
+    - dto_class(User) -> UserDTO, a frozen dataclass with __slots__ and one field per column;
+      Repo(session, result_type='dto') returns these from get_user_by_id, get_all_users,
+      get_users_page and get_orders_page (same attributes, no lazy loads, nothing to flush)
+    - ColumnBatch stores a batch of rows column by column: NOT NULL integers, fixed-point decimals
+      (DECIMAL(16,4) as int64 ten-thousandths) and naive timestamps (microseconds since the epoch)
+      in array.array, other columns (and a batch's column that has NULLs anyway) in lists;
+      Repo.stream_columns yields one per batch_size rows
+
+    for batch in repo.stream_columns(Order, batch_size=50_000):
+        batch['user_id']              # array('q', [...])
+        batch.values('created_at')    # [datetime(...), ...]
+"""
+import array
+from dataclasses import make_dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import starmap
+from typing import Iterator, Sequence
+
+from sqlalchemy import inspect, types as sqltypes
+
+from lesson_2 import User, Order, Product
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+@lru_cache(maxsize=None)
+def dto_class(model) -> type:
+    """Frozen __slots__ dataclass with the column attributes of a mapped class, in mapper order"""
+    fields = [attr.key for attr in inspect(model).column_attrs]
+    dto = make_dataclass(f"{model.__name__}DTO", fields, frozen=True, slots=True)
+    dto.__module__ = __name__  # picklable as readonly.UserDTO, ...
+    return dto
+
+
+UserDTO = dto_class(User)
+OrderDTO = dto_class(Order)
+ProductDTO = dto_class(Product)
+
+
+def dto_stmt(stmt):
+    """The select(Model) stmt selecting the DTO's columns instead of the entity (same FROM / WHERE / ORDER BY)"""
+    model = stmt.column_descriptions[0]['entity']
+    columns = [getattr(model, field) for field in dto_class(model).__dataclass_fields__]
+    return dto_class(model), stmt.with_only_columns(*columns)
+
+
+def selects_entity(stmt) -> bool:
+    """True for select(Model), whose rows are ORM instances"""
+    descriptions = stmt.column_descriptions
+    return len(descriptions) == 1 and descriptions[0]['expr'] is descriptions[0]['entity']
+
+
+def to_dtos(dto, rows) -> list:
+    return list(starmap(dto, rows))
+
+
+def _codec(column):
+    """(array typecode, encode, decode) for values that fit an array.array, None to keep a list"""
+    if getattr(column, 'nullable', True) and not getattr(column, 'primary_key', False):
+        return None  # array.array has no NULL
+    sql_type = column.type
+    if isinstance(sql_type, sqltypes.Integer):
+        return 'q', None, None
+    if isinstance(sql_type, sqltypes.Float):
+        return 'd', None, None
+    if (isinstance(sql_type, sqltypes.Numeric) and sql_type.asdecimal and sql_type.scale is not None
+            and (sql_type.precision or 19) <= 18):
+        scale = sql_type.scale
+        return 'q', lambda value: int(value.scaleb(scale)), lambda value: Decimal(value).scaleb(-scale)
+    if isinstance(sql_type, sqltypes.DateTime) and not sql_type.timezone:
+        return 'q', lambda value: (value - _EPOCH) // _MICROSECOND, lambda value: _EPOCH + value * _MICROSECOND
+    return None
+
+
+class ColumnBatch:
+    """A batch of rows stored column by column (see the module docstring for the encodings)"""
+
+    __slots__ = ('names', 'columns', '_decoders')
+
+    def __init__(self, names: Sequence[str], columns: list, decoders: list):
+        self.names = list(names)
+        self.columns = columns
+        self._decoders = decoders
+
+    @classmethod
+    def from_rows(cls, selected_columns, rows: Sequence) -> 'ColumnBatch':
+        codecs = [_codec(column) for column in selected_columns]
+        columns = []
+        decoders = []
+        for values, codec in zip(zip(*rows) if rows else [()] * len(codecs), codecs):
+            if codec is not None and None in values:
+                codec = None  # NOT NULL columns still return NULLs from the outer side of an outer join
+            if codec is None:
+                columns.append(list(values))
+                decoders.append(None)
+            else:
+                typecode, encode, decode = codec
+                columns.append(array.array(typecode, values if encode is None else map(encode, values)))
+                decoders.append(decode)
+        return cls([column.key for column in selected_columns], columns, decoders)
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name: str):
+        """The stored column: array.array (encoded) or list"""
+        return self.columns[self.names.index(name)]
+
+    def values(self, name: str) -> list:
+        """The column as Python values (datetime, Decimal, ...)"""
+        index = self.names.index(name)
+        decode = self._decoders[index]
+        return list(self.columns[index]) if decode is None else [decode(value) for value in self.columns[index]]
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*(self.values(name) for name in self.names))
+
+    @property
+    def nbytes(self) -> int:
+        """Buffer size of the array columns (list columns hold references to Python objects)"""
+        return sum(column.itemsize * len(column) for column in self.columns if isinstance(column, array.array))
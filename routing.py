@@ -0,0 +1,119 @@
+"""
+Read/write routing between a primary and read replicas.
+
+RoutingSession picks the engine per statement: statements issued by the read-only Repo methods
+(Repo.READ_ONLY_METHODS, recognised through the instrumentation tag) go to a replica, everything
+else goes to the primary.
+    - replicas are used round-robin; one whose replication lag is over max_lag seconds (checked at most
+      every lag_check_interval seconds) or that cannot be reached is skipped, and with no usable
+      replica the read falls back to the primary
+    - read your writes: once a session has written (flushed, run an INSERT / UPDATE / DELETE or called
+      one of Repo.WRITE_METHODS), the rest of that session reads from the primary; stick_to_primary()
+      does the same up front, e.g. for a request that just wrote elsewhere
+    - point lookups (get_user_by_id, ...) are in neither set: they read from the primary without
+      pinning the session to it
+
+    router = ReplicaRouter(make_engine(), make_replica_engines(), max_lag=5.0)
+    session_pool = make_routing_session_pool(router)
+    with session_pool() as session:
+        Repo(session).get_monthly_order_summary()  # replica
+"""
+import itertools
+import threading
+import time
+from typing import Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session, sessionmaker
+
+from instrumentation import current_repo_method
+from lesson_3 import Repo
+
+# 0 when caught up (or not a replica at all, e.g. the primary under a second URL); an idle primary
+# sends no transactions, so replay timestamps alone would report a growing lag
+_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class ReplicaRouter:
+    """The primary engine, the replica engines and which Repo methods may read from a replica"""
+
+    def __init__(self, primary, replicas: Sequence = (), max_lag: float = 5.0, lag_check_interval: float = 1.0,
+                 read_only_methods: Optional[frozenset] = None, write_methods: Optional[frozenset] = None):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.read_only_methods = read_only_methods if read_only_methods is not None else Repo.READ_ONLY_METHODS
+        self.write_methods = write_methods if write_methods is not None else Repo.WRITE_METHODS
+        self._lag = {}  # replica -> (lag in seconds or None when unreachable, checked_at)
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def replica_lag(self, replica) -> Optional[float]:
+        """Replication lag in seconds (cached for lag_check_interval), None if the replica is unreachable"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._lag.get(replica)
+        if cached is not None and now - cached[1] < self.lag_check_interval:
+            return cached[0]
+        try:
+            with replica.connect() as connection:
+                lag = float(connection.execute(_LAG_QUERY).scalar())
+        except Exception:  # a replica that is down is skipped until the next check
+            lag = None
+        with self._lock:
+            self._lag[replica] = (lag, now)
+        return lag
+
+    def pick_replica(self):
+        """Next replica within max_lag, or None"""
+        if not self.replicas:
+            return None
+        start = next(self._next)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            lag = self.replica_lag(replica)
+            if lag is not None and lag <= self.max_lag:
+                return replica
+        return None
+
+
+class RoutingSession(Session):
+    """Session sending read-only Repo methods to replicas (see the module docstring)"""
+
+    def __init__(self, router: ReplicaRouter, bind=None, **kwargs):
+        super().__init__(bind=bind or router.primary, **kwargs)
+        self.router = router
+        self.has_written = False
+        # One replica per session, so the reads of a request see a single snapshot source
+        self._replica = None
+
+    def stick_to_primary(self):
+        """Read from the primary for the rest of this session"""
+        self.has_written = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        method = current_repo_method.get()
+        if (not self.has_written and not self._flushing and clause is not None
+                and method in self.router.read_only_methods):
+            if self._replica is None:
+                self._replica = self.router.pick_replica()
+            if self._replica is not None:
+                return self._replica
+        # The write methods count as a write whatever they run: a select() can write too (add_order_with_products'
+        # select().from_statement() over data-modifying CTEs), bulk_copy uses the raw connection
+        if (self._flushing or (clause is not None and not clause.is_select)
+                or method in self.router.write_methods):
+            self.has_written = True
+        return self.router.primary
+
+
+def make_routing_session_pool(router: ReplicaRouter, **kwargs):
+    kwargs.setdefault("expire_on_commit", False)
+    return sessionmaker(class_=RoutingSession, router=router, **kwargs)
@@ -0,0 +1,164 @@
+"""
+Horizontal sharding of users and their orders by telegram_id.
+
+Every shard is a database with the full schema (apply the migrations to each, see the README).
+A user lives on shard telegram_id % number_of_shards, and so do its orders and order lines, so
+every single-user operation runs on one shard with its foreign keys intact:
+    - add_user, get_user_by_id, add_order, add_order_with_products, ... go to the user's shard
+    - transfer_order_ownership works between users of the same shard only
+    - products are reference data: upsert_products writes them to every shard with the same ids
+    - aggregates (get_total_users_count, get_top_customers_optimized, get_monthly_order_summary,
+      get_user_statistics) run on all shards in parallel and are merged here; with a stats_cache,
+      get_total_users_count(mode='cached') caches each shard's count under its own keys
+Order ids come from each shard's own sequence and are only unique within a shard.
+A referrer has to live on the same shard as the users it referred (referrer_id is a foreign key).
+Changing the number of shards moves users, which has to be done offline.
+
+    sharded = ShardedRepo([session_pool() for session_pool in make_shard_session_pools()])
+    sharded.add_user(123, 'John', 'john')
+    sharded.get_monthly_order_summary()
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional, Sequence
+
+from db import make_session_pool, make_shard_engines
+from lesson_2 import Product
+from lesson_3 import Repo
+from user_cache import CacheBackend, NamespacedCache
+
+
+class MonthlyOrderSummary(NamedTuple):
+    month: datetime
+    order_count: int
+    total_revenue: Optional[Decimal]
+
+
+class UserStatistics(NamedTuple):
+    language_code: Optional[str]
+    user_count: int
+    total_orders: int
+
+
+def _add(a, b):
+    return b if a is None else a if b is None else a + b
+
+
+def make_shard_session_pools(engines: Sequence = None, **kwargs) -> list:
+    """One session pool per shard, in shard order (default: engines for DB_SHARD_URLS)"""
+    return [make_session_pool(engine, **kwargs) for engine in (engines if engines is not None else make_shard_engines())]
+
+
+class ShardedRepo:
+    """Repo over several shards: single-user calls go to one shard, aggregates scatter-gather"""
+
+    def __init__(self, sessions: Sequence, autocommit: bool = True, max_workers: int = None,
+                 use_summaries: bool = False, stats_cache: CacheBackend = None):
+        if not sessions:
+            raise ValueError("ShardedRepo needs at least one shard session")
+        # Every shard counts its own tables, so each one keeps its row counts under its own keys
+        self.shards = [Repo(session, autocommit=autocommit, use_summaries=use_summaries,
+                            stats_cache=NamespacedCache(stats_cache, index) if stats_cache is not None else None)
+                       for index, session in enumerate(sessions)]
+        # One worker per shard: a Session is not thread safe, each shard's session is used by one task at a time
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self.shards),
+                                            thread_name_prefix='shard')
+
+    def close(self):
+        self._executor.shutdown()
+        for repo in self.shards:
+            repo.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Routing
+    def shard_index(self, telegram_id: int) -> int:
+        return telegram_id % len(self.shards)
+
+    def shard_for(self, telegram_id: int) -> Repo:
+        return self.shards[self.shard_index(telegram_id)]
+
+    def scatter(self, method: str, *args, **kwargs) -> list:
+        """Call a Repo method on every shard in parallel, returns the results in shard order"""
+        futures = [self._executor.submit(getattr(repo, method), *args, **kwargs) for repo in self.shards]
+        return [future.result() for future in futures]
+
+    # Single-user operations
+    def add_user(self, telegram_id: int, full_name: str, username: str, language_code=None):
+        return self.shard_for(telegram_id).add_user(telegram_id, full_name, username, language_code)
+
+    def get_user_by_id(self, telegram_id: int):
+        return self.shard_for(telegram_id).get_user_by_id(telegram_id)
+
+    def get_user_language(self, telegram_id: int) -> str:
+        return self.shard_for(telegram_id).get_user_language(telegram_id)
+
+    def get_user_order_history(self, telegram_id: int, strategy: str = 'selectin'):
+        return self.shard_for(telegram_id).get_user_order_history(telegram_id, strategy)
+
+    def update_user_language(self, telegram_id: int, new_language: str):
+        return self.shard_for(telegram_id).update_user_language(telegram_id, new_language)
+
+    def delete_user_by_id(self, telegram_id: int):
+        return self.shard_for(telegram_id).delete_user_by_id(telegram_id)
+
+    def add_order(self, user_id: int):
+        return self.shard_for(user_id).add_order(user_id)
+
+    def add_order_with_products(self, user_id: int, items):
+        return self.shard_for(user_id).add_order_with_products(user_id, items)
+
+    def transfer_order_ownership(self, from_user_id: int, to_user_id: int):
+        """Transfer all orders between two users of the same shard"""
+        if self.shard_index(from_user_id) != self.shard_index(to_user_id):
+            raise ValueError(f"Users {from_user_id} and {to_user_id} live on different shards")
+        return self.shard_for(from_user_id).transfer_order_ownership(from_user_id, to_user_id)
+
+    def bulk_insert_users(self, users_data: list) -> int:
+        """Insert users on their shards (one statement per shard, in parallel)"""
+        by_shard = [[] for _ in self.shards]
+        for row in users_data:
+            shard = self.shard_index(row['telegram_id'])
+            referrer_id = row.get('referrer_id')
+            if referrer_id is not None and self.shard_index(referrer_id) != shard:
+                raise ValueError(f"User {row['telegram_id']} and its referrer {referrer_id} live on different shards")
+            by_shard[shard].append(row)
+        futures = [self._executor.submit(repo.bulk_insert_users, rows)
+                   for repo, rows in zip(self.shards, by_shard) if rows]
+        return sum(future.result() for future in futures)
+
+    # Reference data
+    def upsert_products(self, products_data: list) -> int:
+        """Insert or update products (with explicit product_id) on every shard"""
+        stats = self.scatter('bulk_upsert', Product, products_data)
+        return stats[0].inserted + stats[0].updated
+
+    # Scatter-gather aggregates
+    def get_total_users_count(self, mode: str = 'count') -> int:
+        return sum(self.scatter('get_total_users_count', mode))
+
+    def get_top_customers_optimized(self, limit: int = 10):
+        # Users are disjoint across shards, so the global top N is within the union of each shard's top N
+        rows = [row for shard_rows in self.scatter('get_top_customers_optimized', limit) for row in shard_rows]
+        return sorted(rows, key=lambda row: row.total_spent, reverse=True)[:limit]
+
+    def get_monthly_order_summary(self, since: datetime = None, until: datetime = None) -> list:
+        months = {}
+        for shard_rows in self.scatter('get_monthly_order_summary', since, until):
+            for row in shard_rows:
+                order_count, total_revenue = months.get(row.month, (0, None))
+                months[row.month] = (order_count + row.order_count, _add(total_revenue, row.total_revenue))
+        return [MonthlyOrderSummary(month, *totals) for month, totals in sorted(months.items())]
+
+    def get_user_statistics(self) -> list:
+        languages = {}
+        for shard_rows in self.scatter('get_user_statistics'):
+            for row in shard_rows:
+                user_count, total_orders = languages.get(row.language_code, (0, 0))
+                languages[row.language_code] = (user_count + row.user_count, total_orders + row.total_orders)
+        return [UserStatistics(language_code, *totals) for language_code, totals in languages.items()]
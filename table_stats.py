@@ -0,0 +1,137 @@
+"""
+Row counts and storage statistics of the main tables without full scans.
+
+A COUNT(*) reads every row of the table (or of every partition), which takes seconds at millions
+of orders. record_count can come from one of four modes:
+    'count'      COUNT(*), exact and slow
+    'exact'      the trigger-maintained tablerowcounts rows (see the table row counts migration)
+    'estimated'  planner statistics: pg_class.reltuples scaled to the current table size, or
+                 pg_stat_user_tables.n_live_tup before the first ANALYZE; typically within a few %
+    'cached'     COUNT(*) results kept in a cache backend (user_cache.LRUTTLCache) for its ttl
+Sizes, dead tuples and the last (auto)vacuum / analyze always come from the catalogs, summed over
+the partitions of partitioned tables.
+
+    python table_stats.py --mode estimated
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional, Sequence
+
+from sqlalchemy import func, select, text
+
+from lesson_2 import TableRowCount
+
+COUNTED_TABLES = ('users', 'orders', 'products', 'orderproducts')
+ROW_COUNT_MODES = ('count', 'exact', 'estimated', 'cached')
+
+_STATISTICS_QUERY = text("""
+    SELECT t.table_name,
+           sum(CASE WHEN c.reltuples >= 0 AND c.relpages > 0
+                    THEN c.reltuples / c.relpages * (pg_relation_size(c.oid) / current_setting('block_size')::integer)
+                    ELSE coalesce(s.n_live_tup, 0) END)::bigint AS estimated_rows,
+           coalesce(sum(s.n_dead_tup), 0)::bigint AS dead_tuples,
+           sum(pg_table_size(c.oid))::bigint AS table_bytes,
+           sum(pg_indexes_size(c.oid))::bigint AS index_bytes,
+           sum(pg_total_relation_size(c.oid))::bigint AS total_bytes,
+           max(greatest(s.last_vacuum, s.last_autovacuum)) AS last_vacuum,
+           max(greatest(s.last_analyze, s.last_autoanalyze)) AS last_analyze
+    FROM unnest(CAST(:tables AS text[])) WITH ORDINALITY AS t(table_name, position)
+    CROSS JOIN LATERAL pg_partition_tree(to_regclass(t.table_name)) AS tree
+    JOIN pg_class c ON c.oid = tree.relid
+    LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+    WHERE tree.isleaf
+    GROUP BY t.table_name, t.position
+    ORDER BY t.position
+""")
+
+
+class TableStatistics(NamedTuple):
+    table_name: str
+    record_count: int  # in the requested mode
+    dead_tuples: int
+    table_bytes: int  # heap and TOAST
+    index_bytes: int
+    total_bytes: int
+    last_vacuum: Optional[datetime]
+    last_analyze: Optional[datetime]
+
+
+def _check_mode(mode: str, cache):
+    if mode not in ROW_COUNT_MODES:
+        raise ValueError(f"Unknown row count mode {mode!r}, expected one of {', '.join(ROW_COUNT_MODES)}")
+    if mode == 'cached' and cache is None:
+        raise ValueError("mode='cached' needs a cache backend (Repo(stats_cache=LRUTTLCache(ttl=60)))")
+
+
+def _full_counts(session, tables: Sequence[str]) -> dict:
+    # Table names come from the caller's code, never from user input
+    stmt = " UNION ALL ".join(f"SELECT '{table}' AS table_name, COUNT(*) AS record_count FROM {table}"
+                              for table in tables)
+    return dict(session.execute(text(stmt)).all())
+
+
+def _exact_counts(session, tables: Sequence[str]) -> dict:
+    stmt = select(TableRowCount.table_name, func.sum(TableRowCount.row_count)
+                  ).where(TableRowCount.table_name.in_(tables)).group_by(TableRowCount.table_name)
+    # A table without rows (or right after TRUNCATE) has no counter rows
+    return {table: 0 for table in tables} | {table: int(count) for table, count in session.execute(stmt)}
+
+
+def _cached_counts(session, tables: Sequence[str], cache) -> dict:
+    counts = {table: cache.get(('row_count', table)) for table in tables}
+    missing = [table for table, count in counts.items() if count is None]
+    if missing:
+        for table, count in _full_counts(session, missing).items():
+            cache.set(('row_count', table), count)
+            counts[table] = count
+    return counts
+
+
+def count_rows(session, tables: Sequence[str] = COUNTED_TABLES, mode: str = 'count', cache=None) -> dict:
+    """Row count per table in the given mode"""
+    _check_mode(mode, cache)
+    if mode == 'count':
+        return _full_counts(session, tables)
+    if mode == 'exact':
+        return _exact_counts(session, tables)
+    if mode == 'cached':
+        return _cached_counts(session, tables, cache)
+    return {row.table_name: row.estimated_rows
+            for row in session.execute(_STATISTICS_QUERY, {'tables': list(tables)})}
+
+
+def table_statistics(session, tables: Sequence[str] = COUNTED_TABLES, mode: str = 'count', cache=None) -> list:
+    """TableStatistics per table, in the order of `tables`"""
+    _check_mode(mode, cache)
+    rows = session.execute(_STATISTICS_QUERY, {'tables': list(tables)}).all()
+    counts = ({row.table_name: row.estimated_rows for row in rows} if mode == 'estimated'
+              else count_rows(session, tables, mode, cache))
+    return [TableStatistics(row.table_name, counts[row.table_name], row.dead_tuples, row.table_bytes,
+                            row.index_bytes, row.total_bytes, row.last_vacuum, row.last_analyze)
+            for row in rows]
+
+
+def rebuild_row_counts(session):
+    """Recount every counted table into tablerowcounts (a full scan of each)"""
+    session.execute(text("SELECT refresh_table_row_counts()"))
+    session.commit()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import make_engine, make_session_pool
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=[mode for mode in ROW_COUNT_MODES if mode != 'cached'], default='estimated')
+    parser.add_argument('--rebuild', action='store_true', help="recount the trigger-maintained row counts first")
+    args = parser.parse_args()
+
+    engine = make_engine()
+    with make_session_pool(engine)() as session:
+        if args.rebuild:
+            rebuild_row_counts(session)
+        for stats in table_statistics(session, mode=args.mode):
+            print(f"{stats.table_name:14s} {stats.record_count:>12} rows  {stats.dead_tuples:>10} dead  "
+                  f"table {stats.table_bytes / 2**20:9.1f} MiB  indexes {stats.index_bytes / 2**20:9.1f} MiB  "
+                  f"last analyze {stats.last_analyze or '-'}")
+    engine.dispose()
@@ -0,0 +1,187 @@
+"""
+Read-through cache for the hot user lookups (Repo.get_user_by_id / Repo.get_user_language).
+
+Entries are plain dicts of User column values, so any backend that can store a pickle can hold them.
+LRUTTLCache keeps them in-process; RedisCache lets several worker processes share one cache.
+"""
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from lesson_2 import User
+
+_USER_COLUMNS = [attr.key for attr in inspect(User).column_attrs]
+
+
+def user_to_dict(user: User) -> dict:
+    return {key: getattr(user, key) for key in _USER_COLUMNS}
+
+
+def user_from_dict(session, data: dict) -> User:
+    """Attach a cached row to the session as a clean persistent User, without a SELECT"""
+    user = User(**data)
+    make_transient_to_detached(user)
+    return session.merge(user, load=False)
+
+
+class CacheBackend(ABC):
+    """Interface for cache storage; get() returns None on a miss"""
+
+    evictions = 0
+
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    @abstractmethod
+    def set(self, key, value):
+        ...
+
+    @abstractmethod
+    def delete(self, key):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class LRUTTLCache(CacheBackend):
+    """
+    In-process cache evicting the least recently used entry and entries older than ttl seconds.
+
+    Thread-safe: one instance is meant to be shared by every thread of the process.
+    """
+
+    def __init__(self, maxsize: int = 100_000, ttl: float = 300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache(CacheBackend):
+    """Shared backend on a redis.Redis client (optional dependency); Redis handles TTL and eviction"""
+
+    def __init__(self, client, ttl: float = 300.0, prefix: str = 'user:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        payload = self.client.get(f"{self.prefix}{key}")
+        return pickle.loads(payload) if payload is not None else None
+
+    def set(self, key, value):
+        self.client.set(f"{self.prefix}{key}", pickle.dumps(value), px=int(self.ttl * 1000))
+
+    def delete(self, key):
+        self.client.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+
+class NamespacedCache(CacheBackend):
+    """View of a shared backend under its own key namespace, e.g. one per shard (clear() clears the backend)"""
+
+    def __init__(self, backend: CacheBackend, namespace):
+        self.backend = backend
+        self.namespace = namespace
+
+    @property
+    def evictions(self):
+        return self.backend.evictions
+
+    def get(self, key):
+        return self.backend.get((self.namespace, key))
+
+    def set(self, key, value):
+        self.backend.set((self.namespace, key), value)
+
+    def delete(self, key):
+        self.backend.delete((self.namespace, key))
+
+    def clear(self):
+        self.backend.clear()
+
+
+class UserCache:
+    """User rows keyed by telegram_id, with hit/miss/eviction counters"""
+
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend if backend is not None else LRUTTLCache()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # the counters are updated from every thread sharing the cache
+
+    def get(self, telegram_id: int) -> Optional[dict]:
+        data = self.backend.get(telegram_id)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, user: User):
+        self.backend.set(user.telegram_id, user_to_dict(user))
+
+    def invalidate(self, telegram_id: int):
+        self.backend.delete(telegram_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': self.backend.evictions,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+        }